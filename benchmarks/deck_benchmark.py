@@ -0,0 +1,411 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Headless benchmark of the deck rendering, driven by fake decks.
+Needs neither a display nor a connected deck. Run it from the root of the repo:
+    python -m benchmarks.deck_benchmark --decks 2 --layouts 3x5,4x8 --duration 20 --json results.json
+
+All data (settings, pages, synthetic media, caches) is written to a temporary data dir,
+so the results don't depend on the local setup and the user's data stays untouched.
+"""
+# Import Python modules
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+import psutil
+from PIL import Image, ImageDraw
+
+# Import globals
+import globals as gl
+
+BENCHMARK_ACTION_ID = "dev_core447_Benchmark::TickingAction"
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Headless StreamController render benchmark")
+    parser.add_argument("--decks", type=int, default=1, help="Number of fake decks")
+    parser.add_argument("--layouts", type=str, default="3x5", help="Comma separated key layouts (rowsxcols), cycled over the decks")
+    parser.add_argument("--pages", type=int, default=3, help="Number of synthetic pages per deck")
+    parser.add_argument("--page-loads", type=int, default=5, help="Number of measured page loads per deck")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of steady-state playback to measure")
+    parser.add_argument("--background-video", action="store_true", help="Use a background video on every page")
+    parser.add_argument("--render-backend", choices=["thread", "process"], default="thread")
+    parser.add_argument("--no-cache-videos", action="store_true", help="Disable the video caches")
+    parser.add_argument("--video-cache-budget-mb", type=int, default=1024, help="Memory budget of the video caches")
+    parser.add_argument("--keep-data", action="store_true", help="Don't delete the temporary data dir")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    return parser.parse_args()
+
+
+## Synthetic media
+
+def create_media(media_dir: str) -> dict[str, str]:
+    os.makedirs(media_dir, exist_ok=True)
+    paths = {}
+
+    # Image
+    image = Image.new("RGBA", (256, 256), (30, 120, 200, 255))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((32, 32, 224, 224), fill=(240, 180, 20, 255))
+    paths["image"] = os.path.join(media_dir, "image.png")
+    image.save(paths["image"])
+
+    # GIF
+    frames = []
+    for i in range(24):
+        frame = Image.new("RGB", (128, 128), (20, 20, 20))
+        ImageDraw.Draw(frame).rectangle((i * 4, 32, i * 4 + 32, 96), fill=(200, 40, 40))
+        frames.append(frame)
+    paths["gif"] = os.path.join(media_dir, "animation.gif")
+    frames[0].save(paths["gif"], save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+    # Videos
+    paths["video"] = os.path.join(media_dir, "video.mp4")
+    write_video(paths["video"], (256, 256), n_frames=90)
+    paths["background"] = os.path.join(media_dir, "background.mp4")
+    write_video(paths["background"], (1280, 720), n_frames=90)
+
+    return paths
+
+def write_video(path: str, size: tuple[int], n_frames: int, fps: int = 30) -> None:
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    x = np.arange(size[0], dtype=np.uint16)
+    y = np.arange(size[1], dtype=np.uint16)[:, None]
+    for i in range(n_frames):
+        frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        frame[..., 0] = (x + i * 4) % 256
+        frame[..., 1] = (y + i * 2) % 256
+        frame[..., 2] = (i * 3) % 256
+        writer.write(frame)
+    writer.release()
+
+
+## Synthetic pages
+
+def create_page_dict(layout: list[int], media: dict[str, str], page_index: int, background_video: bool) -> dict:
+    """
+    Fills the keys round robin with an image, a gif, a video, a label only, a ticking action and an empty key
+    """
+    rows, cols = layout
+    keys = {}
+    for y in range(rows):
+        for x in range(cols):
+            index = y * cols + x
+            kind = (index + page_index) % 6
+            key = {}
+            if kind == 0:
+                key["media"] = {"path": media["image"], "size": 0.8}
+                key["labels"] = {"bottom": label_dict(f"Img {index}")}
+            elif kind == 1:
+                key["media"] = {"path": media["gif"]}
+            elif kind == 2:
+                key["media"] = {"path": media["video"], "fps": 30, "loop": True}
+                key["labels"] = {"top": label_dict("Video")}
+            elif kind == 3:
+                key["labels"] = {"center": label_dict(f"P{page_index} K{index}", font_size=18)}
+                key["background"] = {"color": [40, 40, 40, 255]}
+            elif kind == 4:
+                key["actions"] = [{"id": BENCHMARK_ACTION_ID, "settings": {}}]
+            keys[f"{x}x{y}"] = key
+
+    page = {"keys": keys}
+    if background_video:
+        page["background"] = {"show": True, "path": media["background"], "loop": True, "fps": 30}
+    return page
+
+def label_dict(text: str, font_size: int = 14) -> dict:
+    return {"text": text, "font-size": font_size, "font-family": "", "color": [255, 255, 255, 255], "stroke-width": 1}
+
+
+## Benchmark harness
+
+class Recorder:
+    """
+    Collects the device writes of all fake decks
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes: dict[str, int] = {}
+        # (serial, key) -> time the last change of a ticking action was requested
+        self.pending: dict[tuple[str, int], float] = {}
+        self.tick_latencies: list[float] = []
+
+    def on_change_requested(self, serial: str, key: int) -> None:
+        with self.lock:
+            self.pending.setdefault((serial, key), time.perf_counter())
+
+    def on_write(self, serial: str, key: int) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            self.writes[serial] = self.writes.get(serial, 0) + 1
+            requested = self.pending.pop((serial, key), None)
+            if requested is not None:
+                self.tick_latencies.append(now - requested)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.writes = {}
+            self.pending = {}
+            self.tick_latencies = []
+
+def percentile(values: list[float], p: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def wait_until_idle(controller, timeout: float = 30) -> bool:
+    """
+    Waits until all queued tasks of the deck have been performed and the next frame went out
+    """
+    end = time.perf_counter() + timeout
+    media_player = controller.media_player
+    while time.perf_counter() < end:
+        if len(media_player.tasks) == 0 and len(media_player.image_tasks) == 0 and not media_player.ticking:
+            ticks = media_player.media_ticks
+            while media_player.media_ticks <= ticks + 1 and time.perf_counter() < end:
+                time.sleep(0.001)
+            return True
+        time.sleep(0.001)
+    return False
+
+def run(args: argparse.Namespace, data_path: str) -> dict:
+    # Configure the app settings before any manager reads them
+    settings_dir = os.path.join(data_path, "settings")
+    os.makedirs(settings_dir, exist_ok=True)
+    with open(os.path.join(settings_dir, "settings.json"), "w") as f:
+        json.dump({
+            "dev": {"collect-render-metrics": True},
+            "performance": {"render-backend": args.render_backend, "cache-videos": not args.no_cache_videos},
+            "warnings": {"enable-fps-warnings": False},
+            "store": {"auto-update": False}
+        }, f)
+
+    # Import own modules - after gl.DATA_PATH has been set, some modules create their dirs on import
+    from src.backend.SettingsManager import SettingsManager
+    from src.Signals.SignalManager import SignalManager
+    from src.backend.MetricsManager import MetricsManager
+    from src.backend.DeckManagement.FrameScheduler import FrameScheduler
+    from src.backend.DeckManagement.ActionExecutor import ActionExecutor
+    from src.backend.DeckManagement.TickScheduler import TickScheduler
+    from src.backend.DeckManagement.VideoCacheBudget import VideoCacheBudget
+    from src.backend.FingerprintManager import FingerprintManager
+    from src.backend.DeckManagement.GifFrameCache import GifFrameCache
+    from src.backend.DeckManagement.Subclasses.render_backend import create_render_backend
+    from src.backend.PageManagement.PageManager import PageManager
+    from src.backend.DeckManagement.DeckController import DeckController
+    from src.backend.DeckManagement.Subclasses.FakeDeck import FakeDeck
+    from src.backend.PluginManager.ActionBase import ActionBase
+
+    recorder = Recorder()
+
+    class BenchmarkDeck(FakeDeck):
+        def __init__(self, serial_number: str, layout: list[int]):
+            super().__init__(serial_number=serial_number, deck_type="Benchmark Deck")
+            self._key_layout = layout
+
+        def set_key_image(self, key, image):
+            recorder.on_write(self.serial_number, key)
+
+    class TickingAction(ActionBase):
+        """
+        Changes its label every tick, like a clock or a counter would
+        """
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.counter = 0
+
+        def on_tick(self):
+            self.counter += 1
+            recorder.on_change_requested(self.deck_controller.serial_number, self.key_index)
+            self.set_label(str(self.counter), position="center")
+
+    class BenchmarkActionHolder:
+        action_base = TickingAction
+
+        def init_and_get_action(self, deck_controller, page, coords):
+            return TickingAction(action_id=BENCHMARK_ACTION_ID, action_name="Ticking Action",
+                                 deck_controller=deck_controller, page=page, coords=coords, plugin_base=None)
+
+    class BenchmarkPluginManager:
+        def get_action_holder_from_id(self, action_id: str):
+            if action_id == BENCHMARK_ACTION_ID:
+                return BenchmarkActionHolder()
+
+    gl.settings_manager = SettingsManager()
+    gl.signal_manager = SignalManager()
+    gl.metrics_manager = MetricsManager()
+    gl.frame_scheduler = FrameScheduler()
+    gl.frame_scheduler.start()
+    gl.render_backend = create_render_backend()
+    gl.action_executor = ActionExecutor()
+    gl.tick_scheduler = TickScheduler()
+    gl.tick_scheduler.start()
+    gl.video_cache_budget = VideoCacheBudget(max_bytes=args.video_cache_budget_mb * 1024**2)
+    gl.fingerprint_manager = FingerprintManager()
+    gl.gif_frame_cache = GifFrameCache()
+    gl.page_manager = PageManager(gl.settings_manager)
+    gl.plugin_manager = BenchmarkPluginManager()
+
+    media = create_media(os.path.join(data_path, "media"))
+
+    layouts = [list(map(int, layout.split("x"))) for layout in args.layouts.split(",")]
+
+    process = psutil.Process()
+    results = {"args": vars(args), "decks": {}}
+
+    # Create the decks and their pages
+    controllers: list[DeckController] = []
+    page_paths: dict[DeckController, list[str]] = {}
+    pages_dir = os.path.join(data_path, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    for i in range(args.decks):
+        layout = layouts[i % len(layouts)]
+        controller = DeckController(None, BenchmarkDeck(serial_number=f"benchmark-deck-{i+1}", layout=layout))
+        controllers.append(controller)
+
+        page_paths[controller] = []
+        for p in range(args.pages):
+            path = os.path.join(pages_dir, f"{controller.serial_number}-{p}.json")
+            with open(path, "w") as f:
+                json.dump(create_page_dict(layout, media, p, args.background_video), f)
+            page_paths[controller].append(path)
+
+    # Page loads - the first load of a page includes the decoding of its media
+    gl.page_manager.set_n_pages_to_cache(args.pages * args.decks)
+    for controller in controllers:
+        load_times = []
+        for n in range(max(args.page_loads, 1)):
+            path = page_paths[controller][n % len(page_paths[controller])]
+            start = time.perf_counter()
+            page = gl.page_manager.get_page(path, controller)
+            controller.load_page(page)
+            wait_until_idle(controller)
+            load_times.append(time.perf_counter() - start)
+
+        results["decks"][controller.serial_number] = {
+            "layout": controller.deck.key_layout(),
+            "page-load-s": {
+                "first": load_times[0],
+                "median": percentile(load_times, 50),
+                "max": max(load_times)
+            }
+        }
+
+    # Steady-state playback
+    gl.metrics_manager.reset()
+    recorder.reset()
+    ticks_before = {controller: controller.media_player.media_ticks for controller in controllers}
+    frames_before = {controller: controller.media_player.get_frame_stats() for controller in controllers}
+    cpu_before = process.cpu_times()
+    rss_samples = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        rss_samples.append(process.memory_info().rss)
+        time.sleep(0.25)
+    duration = time.perf_counter() - start
+    cpu_after = process.cpu_times()
+
+    cpu_seconds = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+    for child in process.children(recursive=True):
+        # Render worker processes only report their own total
+        try:
+            child_times = child.cpu_times()
+            cpu_seconds += child_times.user + child_times.system
+        except psutil.NoSuchProcess:
+            pass
+
+    metrics = gl.metrics_manager.get_metrics()
+    for controller in controllers:
+        frames = controller.media_player.get_frame_stats()
+        deck_results = results["decks"][controller.serial_number]
+        deck_results["fps"] = (controller.media_player.media_ticks - ticks_before[controller]) / duration
+        deck_results["key-writes-per-s"] = recorder.writes.get(controller.serial_number, 0) / duration
+        deck_results["late-frames"] = frames["late-frames"] - frames_before[controller]["late-frames"]
+        deck_results["dropped-frames"] = frames["dropped-frames"] - frames_before[controller]["dropped-frames"]
+        deck_results["stages"] = metrics["decks"].get(controller.serial_number, {}).get("stages", {})
+
+    results["tick-to-write-latency-ms"] = {
+        "count": len(recorder.tick_latencies),
+        "p50": percentile(recorder.tick_latencies, 50) * 1000,
+        "p95": percentile(recorder.tick_latencies, 95) * 1000,
+        "max": max(recorder.tick_latencies, default=0) * 1000
+    }
+    results["rss-mb"] = {
+        "mean": sum(rss_samples) / len(rss_samples) / 1024**2,
+        "max": max(rss_samples) / 1024**2
+    }
+    results["cpu-percent"] = cpu_seconds / duration * 100
+    results["counters"] = metrics["counters"]
+    results["actions"] = metrics.get("actions", {})
+    results["video-cache"] = {
+        "used-mb": gl.video_cache_budget.used_bytes / 1024**2,
+        "evictions": gl.video_cache_budget.evictions
+    }
+
+    # Shut down
+    for controller in controllers:
+        controller.delete()
+    gl.frame_scheduler.stop()
+    gl.render_backend.close()
+    gl.tick_scheduler.stop()
+    gl.action_executor.stop()
+
+    return results
+
+def print_results(results: dict) -> None:
+    for serial, deck in results["decks"].items():
+        print(f"{serial} ({deck['layout'][0]}x{deck['layout'][1]})")
+        print(f"  fps: {deck['fps']:.1f}, key writes/s: {deck['key-writes-per-s']:.1f}, late frames: {deck['late-frames']}, dropped frames: {deck['dropped-frames']}")
+        load = deck["page-load-s"]
+        print(f"  page load: first {load['first']*1000:.1f} ms, median {load['median']*1000:.1f} ms, max {load['max']*1000:.1f} ms")
+        for stage, histogram in deck["stages"].items():
+            print(f"  {stage:<18} n={histogram['count']:<7} mean={histogram['mean-ms']:.3f} ms  p95={histogram['p95-ms']:.3f} ms  max={histogram['max-ms']:.3f} ms")
+
+    latency = results["tick-to-write-latency-ms"]
+    print(f"tick to write latency: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, max {latency['max']:.1f} ms ({latency['count']} samples)")
+    print(f"rss: mean {results['rss-mb']['mean']:.1f} MB, max {results['rss-mb']['max']:.1f} MB")
+    print(f"cpu: {results['cpu-percent']:.1f} %")
+    print(f"video cache: {results['video-cache']['used-mb']:.1f} MB, {results['video-cache']['evictions']} evictions")
+    counters = results["counters"]
+    if counters.get("key-renders", 0) > 0:
+        print(f"image allocations: {counters.get('image-allocations', 0) / counters['key-renders']:.2f} per rendered key")
+    actions = results["actions"]
+    if actions:
+        print(f"action queue: max {actions['max-queued']} queued, {actions['coalesced']} of {actions['submitted'] + actions['coalesced']} jobs coalesced")
+
+def main() -> None:
+    args = parse_args()
+
+    data_path = tempfile.mkdtemp(prefix="streamcontroller-benchmark-")
+    gl.DATA_PATH = data_path
+    try:
+        results = run(args, data_path)
+    finally:
+        if not args.keep_data:
+            shutil.rmtree(data_path, ignore_errors=True)
+
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Compares the numpy tiling engine with the per key crop and paste loop it replaced.
+Needs neither a deck nor a display. Run it from the root of the repo:
+    python -m benchmarks.tiling_benchmark --layouts 3x5,4x8 --sources 1920x1080,3840x2160
+"""
+# Import Python modules
+import argparse
+import json
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# Import own modules
+from src.backend.DeckManagement.Subclasses.tiling import DeckTiler, fit_array
+
+KEY_SIZE = (72, 72)
+SPACING = (36, 36)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark of the background tiling")
+    parser.add_argument("--layouts", type=str, default="3x5,4x8", help="Comma separated key layouts (rowsxcols)")
+    parser.add_argument("--sources", type=str, default="1920x1080,3840x2160", help="Comma separated source sizes (widthxheight)")
+    parser.add_argument("--iterations", type=int, default=20, help="Measured runs per case")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    return parser.parse_args()
+
+def parse_size(size: str) -> tuple[int]:
+    a, b = size.lower().split("x")
+    return int(a), int(b)
+
+
+## The previous implementation, kept here as the baseline
+
+def legacy_image_tiles(image: Image.Image, key_layout: tuple[int], resample: Image.Resampling) -> list[Image.Image]:
+    key_rows, key_cols = key_layout
+    key_width, key_height = KEY_SIZE
+    spacing_x, spacing_y = SPACING
+
+    full_deck_image_size = (key_width * key_cols + spacing_x * (key_cols - 1), key_height * key_rows + spacing_y * (key_rows - 1))
+    full_sized = ImageOps.fit(image, full_deck_image_size, resample)
+    return legacy_crop_tiles(full_sized, key_layout)
+
+def legacy_crop_tiles(full_sized: Image.Image, key_layout: tuple[int]) -> list[Image.Image]:
+    key_rows, key_cols = key_layout
+    key_width, key_height = KEY_SIZE
+    spacing_x, spacing_y = SPACING
+
+    tiles = []
+    for key in range(key_rows * key_cols):
+        row = key // key_cols
+        col = key % key_cols
+        start_x = col * (key_width + spacing_x)
+        start_y = row * (key_height + spacing_y)
+        segment = full_sized.crop((start_x, start_y, start_x + key_width, start_y + key_height))
+
+        # Same as PILHelper.create_key_image for a deck without native rotation
+        key_image = Image.new("RGB", KEY_SIZE)
+        key_image.paste(segment)
+        tiles.append(key_image)
+    return tiles
+
+def legacy_video_tiles(frame: np.ndarray, key_layout: tuple[int]) -> list[Image.Image]:
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    pil_image = Image.fromarray(frame_rgb)
+    return legacy_image_tiles(pil_image, key_layout, Image.Resampling.HAMMING)
+
+
+## The tiling engine
+
+def engine_image_tiles(tiler: DeckTiler, image: Image.Image) -> list[Image.Image]:
+    return tiler.get_image_tiles(image)
+
+def engine_video_tiles(tiler: DeckTiler, frame: np.ndarray) -> list[Image.Image]:
+    deck_sized = tiler.to_rgba(fit_array(frame, tiler.deck_image_size), cv2.COLOR_BGR2RGBA)
+    return tiler.get_tiles(deck_sized)
+
+
+def measure(func, iterations: int) -> dict:
+    # Warm up
+    func()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean-ms": round(statistics.mean(durations), 3),
+        "median-ms": round(statistics.median(durations), 3),
+        "min-ms": round(min(durations), 3),
+    }
+
+def create_source(size: tuple[int]) -> np.ndarray:
+    width, height = size
+    # A gradient, so the scaling has to do some real work
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = x[np.newaxis, :]
+    frame[..., 1] = y[:, np.newaxis]
+    frame[..., 2] = 128
+    return frame
+
+def main() -> None:
+    args = parse_args()
+    layouts = [parse_size(layout) for layout in args.layouts.split(",")]
+    sources = [parse_size(source) for source in args.sources.split(",")]
+
+    results = []
+    for source in sources:
+        frame = create_source(source)
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        for key_layout in layouts:
+            tiler = DeckTiler(key_layout, KEY_SIZE, SPACING)
+            deck_sized = ImageOps.fit(image, tiler.deck_image_size, Image.Resampling.LANCZOS)
+            deck_array = np.asarray(deck_sized)
+
+            # Both paths have to produce a tile for every key
+            assert len(engine_image_tiles(tiler, image)) == len(legacy_image_tiles(image, key_layout, Image.Resampling.LANCZOS))
+
+            case = {
+                "source": f"{source[0]}x{source[1]}",
+                "layout": f"{key_layout[0]}x{key_layout[1]}",
+                # Only the cutting of an already deck sized image
+                "tiles-legacy": measure(lambda: legacy_crop_tiles(deck_sized, key_layout), args.iterations),
+                "tiles-engine": measure(lambda: tiler.get_tiles(deck_array), args.iterations),
+                "image-legacy": measure(lambda: legacy_image_tiles(image, key_layout, Image.Resampling.LANCZOS), args.iterations),
+                "image-engine": measure(lambda: engine_image_tiles(tiler, image), args.iterations),
+                "video-legacy": measure(lambda: legacy_video_tiles(frame, key_layout), args.iterations),
+                "video-engine": measure(lambda: engine_video_tiles(tiler, frame), args.iterations),
+            }
+            results.append(case)
+
+            print(f"{case['source']} on {case['layout']}:")
+            for path in ("tiles", "image", "video"):
+                legacy = case[f"{path}-legacy"]["median-ms"]
+                engine = case[f"{path}-engine"]["median-ms"]
+                print(f"    {path}: legacy {legacy:.2f} ms, engine {engine:.2f} ms ({legacy / max(engine, 1e-6):.1f}x)")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,16 @@ if TYPE_CHECKING:
     from src.windows.Store.StoreBackend import StoreBackend
     from src.Signals.SignalManager import SignalManager
     from src.backend.DesktopGrabber import DesktopGrabber
+    from src.backend.DeckManagement.FrameScheduler import FrameScheduler
+    from src.backend.DeckManagement.ActionExecutor import ActionExecutor
+    from src.backend.DeckManagement.TickScheduler import TickScheduler
+    from src.backend.DeckManagement.Subclasses.render_backend import ThreadRenderBackend
+    from src.backend.MetricsManager import MetricsManager
+    from src.backend.MetricsService import MetricsService
+    from src.backend.MemoryTracker import MemoryTracker
+    from src.backend.DeckManagement.VideoCacheBudget import VideoCacheBudget
+    from src.backend.FingerprintManager import FingerprintManager
+    from src.backend.DeckManagement.GifFrameCache import GifFrameCache
 
 
 top_level_dir:str = os.path.dirname(__file__)
@@ -41,6 +51,16 @@ store_backend: "StoreBackend" = None
 pyro_daemon: Pyro5.api.Daemon = None
 signal_manager: "SignalManager" = None
 dekstop_grabber: "DesktopGrabber" = None
+frame_scheduler: "FrameScheduler" = None
+action_executor: "ActionExecutor" = None
+tick_scheduler: "TickScheduler" = None
+render_backend: "ThreadRenderBackend" = None
+metrics_manager: "MetricsManager" = None
+metrics_service: "MetricsService" = None
+memory_tracker: "MemoryTracker" = None
+video_cache_budget: "VideoCacheBudget" = None
+fingerprint_manager: "FingerprintManager" = None
+gif_frame_cache: "GifFrameCache" = None
 
 
 app_version: str = "1.2.1-beta" # In breaking.feature.fix-state format
@@ -46,6 +46,17 @@ from src.windows.Store.StoreBackend import StoreBackend, NoConnectionError
 from autostart import setup_autostart
 from src.Signals.SignalManager import SignalManager
 from src.backend.DesktopGrabber import DesktopGrabber
+from src.backend.DeckManagement.FrameScheduler import FrameScheduler
+from src.backend.DeckManagement.ActionExecutor import ActionExecutor
+from src.backend.DeckManagement.TickScheduler import TickScheduler
+from src.backend.DeckManagement.VideoCacheBudget import VideoCacheBudget
+from src.backend.FingerprintManager import FingerprintManager
+from src.backend.DeckManagement.GifFrameCache import GifFrameCache
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+from src.backend.DeckManagement.Subclasses.render_backend import create_render_backend
+from src.backend.MetricsManager import MetricsManager
+from src.backend.MemoryTracker import MemoryTracker
+from src.backend.MetricsService import MetricsService
 
 # Import globals
 import globals as gl
@@ -98,6 +109,27 @@ def create_global_objects():
 
     gl.signal_manager = SignalManager()
 
+    gl.metrics_manager = MetricsManager()
+    gl.memory_tracker = MemoryTracker()
+
+    # Drives the frames of all decks
+    gl.frame_scheduler = FrameScheduler()
+    gl.frame_scheduler.start()
+    gl.render_backend = create_render_backend()
+    # Runs the key events and ticks of all actions
+    performance_settings = gl.settings_manager.get_app_settings().get("performance", {})
+    gl.action_executor = ActionExecutor(max_workers=int(performance_settings.get("action-workers", 8)), max_tick_workers=int(performance_settings.get("tick-workers", 4)))
+    # Calls on_tick of the actions that implement it
+    gl.tick_scheduler = TickScheduler()
+    gl.tick_scheduler.start()
+
+    # Shared memory budget of all decoded video frames
+    gl.video_cache_budget = VideoCacheBudget(max_bytes=int(gl.settings_manager.get_app_settings().get("performance", {}).get("video-cache-budget-mb", 1024)) * 1024**2)
+
+    gl.fingerprint_manager = FingerprintManager()
+    gl.gif_frame_cache = GifFrameCache()
+    # Building matplotlib's font list takes a while, do it before the first labels get rendered
+    threading.Thread(target=font_registry.warm_up, name="font_warm_up", daemon=True).start()
     gl.media_manager = MediaManager()
     gl.asset_manager_backend = AssetManagerBackend()
     gl.page_manager = PageManager(gl.settings_manager)
@@ -179,6 +211,13 @@ if __name__ == "__main__":
 
     create_global_objects()
     create_cache_folder()
+
+    # Make the render metrics available on the session bus
+    try:
+        gl.metrics_service = MetricsService(session_bus)
+    except dbus.exceptions.DBusException as e:
+        log.error(f"Failed to export the metrics service. Error: {e}")
+
     threading.Thread(target=update_assets, name="update_assets").start()
     load()
 
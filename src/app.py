@@ -107,6 +107,11 @@ class App(Adw.Application):
         for ctrl in gl.deck_manager.deck_controller:
                 ctrl.delete()
 
+        gl.frame_scheduler.stop()
+        gl.render_backend.close()
+        gl.tick_scheduler.stop()
+        gl.action_executor.stop()
+
         gl.plugin_manager.loop_daemon = False
         log.debug("non-daemon threads:")
         for thread in threading.enumerate():
@@ -27,7 +27,7 @@ from loguru import logger as log
 from PIL import Image
 
 # Import own modules
-from src.backend.DeckManagement.HelperMethods import is_video, is_image, sha256, file_in_dir, create_empty_json, download_file
+from src.backend.DeckManagement.HelperMethods import is_video, is_image, file_in_dir, create_empty_json, download_file
 
 # Import globals
 import globals as gl
@@ -65,7 +65,7 @@ class AssetManagerBackend(list):
         if not file_in_dir(asset_path, os.path.join(gl.DATA_PATH, "cache")):
             internal_path = self.copy_asset(asset_path)
         
-        hash = sha256(asset_path)
+        hash = gl.fingerprint_manager.get_sha256(asset_path)
         if self.has_by_sha256(hash):
             log.warning(f"Tried to add already existing asset. Ignoring. File: {asset_path}")
             id = self.get_by_sha256(hash)["id"]
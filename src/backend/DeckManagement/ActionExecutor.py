@@ -0,0 +1,156 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+def get_job_tag(event: str, deck: str, page_coords: str, action_index: int = None) -> tuple:
+    """
+    Identifies the jobs of one event of a key, or of one of its actions if action_index is given.
+    Only built from values that stay the same while the page is loaded - unlike id() of the action, which can be reused.
+    """
+    return (event, deck, page_coords, action_index)
+
+@dataclass
+class ActionJob:
+    deck: str
+    key: int
+    _callable: callable
+    args: tuple
+    # See get_job_tag
+    tag: tuple = None
+    submitted: float = field(default_factory=time.perf_counter)
+
+class ActionExecutor:
+    """
+    Runs the callbacks of the actions on bounded pools of threads instead of a new thread per event.
+    Key events (on_ready, on_key_down, on_key_up...) of one key run one after another in the order they were submitted,
+    so key_down always finishes before key_up starts. Events of different keys run in parallel.
+    Ticks run in their own pool, so a slow on_tick can neither delay the key events of its key nor take the workers of the key events.
+    """
+    def __init__(self, max_workers: int = 8, max_tick_workers: int = 4):
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="action")
+        self.tick_pool = ThreadPoolExecutor(max_workers=max_tick_workers, thread_name_prefix="action_tick")
+
+        # (deck, key) -> events of the key that wait for the running one. Keys without a running event are not in here
+        self.queues: dict[tuple[str, int], deque[ActionJob]] = {}
+        # Tags of the ticks that are queued or running
+        self.pending_ticks: set[tuple] = set()
+
+        self.queued: int = 0
+        self.running: int = 0
+        self.max_queued: int = 0
+        self.submitted: int = 0
+        self.coalesced: int = 0
+
+    def submit(self, deck: str, key: int, method: callable, *args, tag: tuple = None) -> bool:
+        """
+        Queues a key event for the key of the deck
+        """
+        job = ActionJob(deck=deck, key=key, _callable=method, args=args, tag=tag)
+        with self.lock:
+            self.count_submitted()
+            queue = self.queues.get((deck, key))
+            if queue is not None:
+                # The key is busy, the job gets started once the running one is done
+                queue.append(job)
+                return True
+            self.queues[(deck, key)] = deque()
+
+        self.pool.submit(self.run, job)
+        return True
+
+    def submit_tick(self, deck: str, key: int, method: callable, *args, tag: tuple) -> bool:
+        """
+        Queues a tick. Returns False if it was skipped because the previous tick with the same tag is still queued or running.
+        """
+        job = ActionJob(deck=deck, key=key, _callable=method, args=args, tag=tag)
+        with self.lock:
+            if tag in self.pending_ticks:
+                # e.g. a slow on_tick that takes longer than its interval
+                self.coalesced += 1
+                return False
+            self.pending_ticks.add(tag)
+            self.count_submitted()
+
+        self.tick_pool.submit(self.run_tick, job)
+        return True
+
+    def count_submitted(self) -> None:
+        """
+        Must be called while holding self.lock
+        """
+        self.submitted += 1
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+
+    def execute(self, job: ActionJob) -> None:
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        gl.metrics_manager.record(job.deck, job.key, "action-queue-wait", time.perf_counter() - job.submitted)
+
+        try:
+            job._callable(*job.args)
+        except Exception as e:
+            log.error(f"Action callback {getattr(job._callable, '__name__', job._callable)} ({job.tag}) of key {job.key} on deck {job.deck} failed. Error: {e}")
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def run(self, job: ActionJob) -> None:
+        try:
+            self.execute(job)
+        finally:
+            with self.lock:
+                queue = self.queues[(job.deck, job.key)]
+                next_job = queue.popleft() if queue else None
+                if next_job is None:
+                    del self.queues[(job.deck, job.key)]
+
+        if next_job is not None:
+            # Go back into the pool instead of running it here, so a busy key can't occupy a worker forever
+            self.pool.submit(self.run, next_job)
+
+    def run_tick(self, job: ActionJob) -> None:
+        try:
+            self.execute(job)
+        finally:
+            with self.lock:
+                self.pending_ticks.discard(job.tag)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "queued": self.queued,
+                "running": self.running,
+                "max-queued": self.max_queued,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "pending-ticks": len(self.pending_ticks)
+            }
+
+    def stop(self) -> None:
+        log.info("Stopping action executor")
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.tick_pool.shutdown(wait=False, cancel_futures=True)
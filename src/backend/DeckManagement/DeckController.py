@@ -14,25 +14,27 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 # Import Python modules
 from concurrent.futures import ThreadPoolExecutor
-from copy import copy
 import os
 import random
 import statistics
-from threading import Thread, Timer
+from threading import Timer
 import threading
 import time
-from PIL import Image, ImageOps, ImageDraw, ImageFont, ImageSequence
+import uuid
+from PIL import Image, ImageOps, ImageDraw
 from StreamDeck.DeviceManager import DeviceManager
-from StreamDeck.ImageHelpers import PILHelper
 from StreamDeck.Devices import StreamDeck
 import usb.core
 import usb.util
 from loguru import logger as log
 import asyncio
-import matplotlib.font_manager
 from src.backend.DeckManagement.Subclasses.SingleKeyAsset import SingleKeyAsset
 from src.backend.DeckManagement.Subclasses.background_video_cache import BackgroundVideoCache
 from src.backend.DeckManagement.Subclasses.key_video_cache import VideoFrameCache
+from src.backend.DeckManagement.Subclasses.tiling import DeckTiler
+from src.backend.DeckManagement.Subclasses.key_image_cache import KeyImageCache
+from src.backend.DeckManagement.Subclasses.key_compositor import KeyCanvas, shrink_image, composite_label_overlay, get_label_overlay
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
 from dataclasses import dataclass
 import gc
 
@@ -41,9 +43,7 @@ from src.backend.DeckManagement.HelperMethods import *
 from src.backend.DeckManagement.ImageHelpers import *
 from src.backend.PageManagement.Page import Page, NoActionHolderFound
 from src.backend.DeckManagement.Subclasses.ScreenSaver import ScreenSaver
-
-import psutil
-process = psutil.Process()
+from src.backend.DeckManagement.ActionExecutor import get_job_tag
 
 # Import signals
 from src.Signals import Signals
@@ -78,17 +78,22 @@ class MediaPlayerSetImageTask:
     page: Page
     key_index: int
     native_image: bytes
+    # Generation of the key the image was rendered for
+    generation: int = None
 
     def run(self):
         try:
-            self.deck_controller.deck.set_key_image(self.key_index, self.native_image)
+            with gl.metrics_manager.measure(self.deck_controller.serial_number, self.key_index, "usb-write"):
+                self.deck_controller.deck.set_key_image(self.key_index, self.native_image)
         except StreamDeck.TransportError as e:
             log.error(f"Failed to set deck key image. Error: {e}")
 
 
-class MediaPlayerThread(threading.Thread):
+class MediaPlayer:
+    """
+    Plays the media of one deck. The frames are driven by the shared FrameScheduler (gl.frame_scheduler)
+    """
     def __init__(self, deck_controller: "DeckController"):
-        super().__init__(name="MediaPlayerThread", daemon=True)
         self.deck_controller: DeckController = deck_controller
         self.FPS = 30 # Max refresh rate of the internal displays
 
@@ -98,55 +103,91 @@ class MediaPlayerThread(threading.Thread):
         self.pause = False
         self._stop = False
 
+        # True while a tick of this player is in progress
+        self.ticking = False
+
+        # Frames that finished after their deadline and frames that were skipped because the previous one was still in progress
+        self.late_frames: int = 0
+        self.dropped_frames: int = 0
+
         self.tasks: list[MediaPlayerTask] = []
         # self.tasks = {}
         self.image_tasks = {}
+        # Serializes the image writes of the ticks and of the press feedback, so a pending image can't overwrite a newer one
+        self.write_lock = threading.Lock()
 
         self.fps: list[float] = []
         self.old_warning_state = False
 
         self.show_fps_warnings = gl.settings_manager.get_app_settings().get("warnings", {}).get("enable-fps-warnings", True)
 
-    def run(self):
+    def start(self) -> None:
+        self._stop = False
         self.running = True
-        while True:
-            start = time.time()
-            if not self.pause:
-                if self.deck_controller.background.video is not None and True:
-                    if self.deck_controller.background.video.page is self.deck_controller.active_page:
+        gl.frame_scheduler.add_media_player(self)
+
+    def tick(self, deadline: float = None) -> None:
+        """
+        Called by the frame scheduler once per frame.
+        deadline: time.monotonic() timestamp until which the frame should be on the deck
+        """
+        start = time.time()
+        # The visible video frames are computed from the wall time, so playback speed stays correct even if frames get dropped
+        now = time.monotonic()
+        try:
+            if not self.pause and not self._stop:
+                video = self.deck_controller.background.video
+                if video is not None and True:
+                    if video.page is self.deck_controller.active_page:
                         # There is a background video
-                        video_each_nth_frame = self.FPS // self.deck_controller.background.video.fps
-                        if self.media_ticks % video_each_nth_frame == 0:
-                            self.deck_controller.background.update_tiles()
+                        if video.seek(now):
+                            self.deck_controller.background.update_tiles() # Marks all keys showing the background as dirty
 
+                dirty_keys: list[ControllerKey] = []
                 for key in self.deck_controller.keys:
-                    # break
                     if key.key_video is not None:
-                        video_each_nth_frame = self.FPS // key.key_video.fps
-                        if self.media_ticks % video_each_nth_frame == 0:
-                            key.update()
-                    elif self.deck_controller.background.video is not None:
-                        key.update()
+                        key.key_video.seek(now) # Marks the key as dirty if the visible frame changed
+
+                    # Only composite and push keys whose inputs changed since their last render
+                    if key.is_dirty():
+                        dirty_keys.append(key)
 
-                # self.deck_controller.update_all_keys()
+                self.render_keys(dirty_keys)
 
                 # Perform media player tasks
                 self.perform_media_player_tasks()
 
             self.media_ticks += 1
+        except Exception as e:
+            log.error(f"Media player tick failed. Error: {e}")
+        finally:
+            if deadline is not None and time.monotonic() > deadline:
+                self.late_frames += 1
 
-            # Wait for approximately 1/30th of a second before the next call
             end = time.time()
-            # print(f"possible FPS: {1 / (end - start)}")
-            self.append_fps(1 / (end - start))
+            self.append_fps(1 / max(end - start, 1e-6))
             self.update_low_fps_warning()
-            wait = max(0, 1/self.FPS - (end - start))
-            time.sleep(wait)
-
-            if self._stop:
-                break
-
-        self.running = False
+            self.ticking = False
+
+    def get_frame_stats(self) -> dict:
+        return {
+            "late-frames": self.late_frames,
+            "dropped-frames": self.dropped_frames
+        }
+
+    def render_keys(self, keys: list["ControllerKey"]) -> None:
+        if len(keys) <= 1:
+            for key in keys:
+                key.update()
+            return
+        
+        # Distribute the renders over the shared render pool
+        futures = [gl.frame_scheduler.render_pool.submit(key.update) for key in keys]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Failed to render key. Error: {e}")
 
     def append_fps(self, fps: float) -> None:
         self.fps.append(fps)
@@ -186,8 +227,11 @@ class MediaPlayerThread(threading.Thread):
 
     def stop(self) -> None:
         self._stop = True
-        while self.running:
-            time.sleep(0.1)
+        gl.frame_scheduler.remove_media_player(self)
+        # Wait for the current tick to finish
+        while self.ticking:
+            time.sleep(0.01)
+        self.running = False
 
     def add_task(self, method: callable, *args, **kwargs):
         self.tasks.append(MediaPlayerTask(
@@ -198,13 +242,53 @@ class MediaPlayerThread(threading.Thread):
             kwargs=kwargs
         ))
 
-    def add_image_task(self, key_index: int, native_image: bytes):
-        self.image_tasks[key_index] = MediaPlayerSetImageTask(
+    def add_image_task(self, key_index: int, native_image: bytes, generation: int = None) -> bool:
+        """
+        Queues the image for the next tick. Returns False if it was dropped because a newer image was already written.
+        """
+        task = MediaPlayerSetImageTask(
             deck_controller=self.deck_controller,
             page=self.deck_controller.active_page,
             key_index=key_index,
-            native_image=native_image
+            native_image=native_image,
+            generation=generation
         )
+        with self.write_lock:
+            if self.is_outdated(task):
+                # e.g. a render that started before a press and finished after the press feedback was written
+                return False
+            self.image_tasks[key_index] = task
+        return True
+
+    def write_image_now(self, key_index: int, native_image: bytes, generation: int = None) -> bool:
+        """
+        Writes the image to the deck right away instead of on the next tick - used for the press feedback.
+        A pending image of the key is dropped because it is older, as are images of older generations that get queued later.
+        """
+        task = MediaPlayerSetImageTask(
+            deck_controller=self.deck_controller,
+            page=self.deck_controller.active_page,
+            key_index=key_index,
+            native_image=native_image,
+            generation=generation
+        )
+        with self.write_lock:
+            if self.is_outdated(task):
+                return False
+            self.image_tasks.pop(key_index, None)
+            if generation is not None:
+                controller_key = self.deck_controller.keys[key_index]
+                controller_key.written_generation = max(controller_key.written_generation, generation)
+            task.run()
+        return True
+
+    def is_outdated(self, task: MediaPlayerSetImageTask) -> bool:
+        """
+        True if an image of a newer generation was already written right away. Must be called while holding self.write_lock
+        """
+        if task.generation is None:
+            return False
+        return task.generation < self.deck_controller.keys[task.key_index].written_generation
 
     def perform_media_player_tasks(self):
         for task in list(self.tasks):
@@ -223,8 +307,11 @@ class MediaPlayerThread(threading.Thread):
             task.run()
 
         for key in list(self.image_tasks.keys()):
-            self.image_tasks[key].run()
-            del self.image_tasks[key]
+            with self.write_lock:
+                task = self.image_tasks.pop(key, None)
+                # The image might have been written by write_image_now in the meantime
+                if task is not None:
+                    task.run()
 
 class DeckController:
     def __init__(self, deck_manager: "DeckManager", deck: StreamDeck.StreamDeck):
@@ -241,6 +328,9 @@ class DeckController:
             del self
             return
         
+        # Cache the serial number - get_serial_number() reads it from the device every time
+        self.serial_number: str = deck.get_serial_number()
+        
         self.own_deck_stack_child: "DeckStackChild" = None
         self.own_key_grid: "KeyGridChild" = None
 
@@ -264,17 +354,15 @@ class DeckController:
 
         self.background = Background(self)
 
+        # Cache of composited key images - makes page flips and repeated press animations cheap
+        self.key_image_cache = KeyImageCache(max_size=gl.settings_manager.get_app_settings().get("performance", {}).get("key-image-cache-size", 256))
+
         self.deck.set_key_callback(self.key_change_callback)
 
-        # Start media player thread
-        self.media_player = MediaPlayerThread(deck_controller=self)
+        # Start media player - the frames are driven by the shared frame scheduler
+        self.media_player = MediaPlayer(deck_controller=self)
         self.media_player.start()
 
-        self.keep_actions_ticking = True
-        self.TICK_DELAY = 1
-        self.tick_thread = Thread(target=self.tick_actions, name="tick_actions")
-        self.tick_thread.start()
-
         self.page_auto_loaded: bool = False
         self.last_manual_loaded_page_path: str = None
 
@@ -287,13 +375,65 @@ class DeckController:
 
     
 
-    def update_key(self, index: int):
-        image = self.keys[index].get_current_deck_image()
-        native_image = PILHelper.to_native_key_format(self.deck, image.convert("RGB"))
+    def update_key(self, index: int, priority: bool = False):
+        """
+        priority: write the image to the deck right away instead of on the next tick of the media player
+        """
+        key = self.keys[index]
+        # Store the generation before rendering so that changes made during the render keep the key dirty
+        generation = key.generation
+        pressed = key.is_pressed()
+
+        render_key = key.get_render_key()
+        cached = self.key_image_cache.get(render_key)
+        native_image = None
+        if cached is not None:
+            image, native_image = cached
+        elif self.background.video is not None and key.shows_plain_background():
+            # The key shows nothing but the video tile, use the pre-encoded tile of the video cache
+            # Both images come from one read, so the ui and the deck always show the same frame
+            image, native_image = self.background.video.get_key_tile(self.background.video.active_frame, index)
+
+        if native_image is None:
+            image, native_image = gl.render_backend.render(key)
+
+            # Only cache the result if the inputs didn't change during the render
+            if render_key is not None and render_key == key.get_render_key():
+                self.key_image_cache.put(render_key, image, native_image)
+
+        if not pressed:
+            key.composite = (generation, image, native_image)
+
+        if priority:
+            written = self.media_player.write_image_now(index, native_image, generation)
+        else:
+            written = self.media_player.add_image_task(index, native_image, generation)
+        # Only now the key is clean - if the render failed it stays dirty and gets rendered again
+        key.set_rendered_generation(generation)
+
+        if written:
+            # An outdated image must not replace the newer one in the ui either
+            key.set_ui_key_image(image)
 
-        self.media_player.add_image_task(index, native_image)
+    def update_key_press(self, index: int) -> None:
+        """
+        Shows the current press state of the key. If nothing but the press state changed since the last render,
+        the image is taken from the composite of the key instead of rendering it again.
+        The image skips the queue of the media player and is written right away.
+        """
+        key = self.keys[index]
+        generation = key.generation
+        composite = key.composite
+        if composite is None or composite[0] != generation:
+            self.update_key(index, priority=True)
+        else:
+            image, native_image = key.get_press_variant(composite)
+            written = self.media_player.write_image_now(index, native_image, generation)
+            key.set_rendered_generation(generation)
+            if written:
+                key.set_ui_key_image(image)
 
-        self.keys[index].set_ui_key_image(image)
+        gl.metrics_manager.record(self.serial_number, index, "press-to-write", time.perf_counter() - key.press_time)
 
     def update_all_keys(self):
         start = time.time()
@@ -301,8 +441,9 @@ class DeckController:
         if self.background.video is not None:
             log.debug("Skipping update_all_keys because there is a background video")
             return
-        for i in range(self.deck.key_count()):
-            self.update_key(i)
+        for key in self.keys:
+            # Keys that did not change since their last render are already correct on the deck
+            key.update_if_dirty()
 
         log.debug(f"Updating all keys took {time.time() - start} seconds")
     
@@ -332,6 +473,10 @@ class DeckController:
     def get_key_image_size(self) -> tuple[int]:
         if not self.get_alive(): return
         return self.deck.key_image_format()["size"]
+
+    def mark_all_keys_dirty(self) -> None:
+        for key in self.keys:
+            key.mark_dirty()
     
     # ------------ #
     # Page Loading #
@@ -515,18 +660,6 @@ class DeckController:
         self.deck.set_brightness(int(value))
         self.brightness = value
 
-    def tick_actions(self) -> None:
-        while self.keep_actions_ticking:
-            time.sleep(self.TICK_DELAY)
-            if not self.screen_saver.showing and True:
-                for key in self.keys:
-                    key.own_actions_tick()
-            else:
-                for key in self.keys:
-                    key.update()
-            
-        
-
     # -------------- #
     # Helper methods #
     # -------------- #
@@ -592,7 +725,7 @@ class DeckController:
 
         self.media_player.stop()
 
-        self.keep_actions_ticking = False
+        gl.tick_scheduler.remove_deck(self)
         self.deck.run_read_thread = False
 
     def get_alive(self) -> bool:
@@ -634,6 +767,16 @@ class Background:
         if update:
             self.deck_controller.update_all_keys()
 
+    def get_tile_token(self, key: int) -> tuple:
+        """
+        Returns a hashable description of the tile of the given key, None if the tile can't be cached
+        """
+        if self.image is not None:
+            return (self.image.media_id, key)
+        if self.video is not None:
+            return
+        return ("empty",)
+
     def set_from_path(self, path: str, fps: int = 30, loop: bool = True, update: bool = True, allow_keep: bool = True) -> None:
         if path == "":
             path = None
@@ -653,85 +796,42 @@ class Background:
                     return
             self.set_video(BackgroundVideo(self.deck_controller, path, loop=loop, fps=fps), update=update)
         else:
+            media_id = get_file_media_id(path)
+            if allow_keep:
+                if self.image is not None and self.image.media_id == media_id:
+                    # The tiles are still valid
+                    return
             with Image.open(path) as image:
-                self.set_image(BackgroundImage(self.deck_controller, image.copy()), update=update)
+                self.set_image(BackgroundImage(self.deck_controller, image.copy(), media_id=media_id), update=update)
 
     def update_tiles(self) -> None:
-        if self.image is not None:
-            self.tiles = self.image.get_tiles()
-        elif self.video is not None:
-            self.tiles = self.video.get_next_tiles()
-        else:
-            self.tiles = [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
+        with gl.metrics_manager.measure(self.deck_controller.serial_number, None, "tile-fetch"):
+            if self.image is not None:
+                self.tiles = self.image.get_tiles()
+            elif self.video is not None:
+                self.tiles = self.video.get_next_tiles()
+            else:
+                self.tiles = [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
 
+        # Only keys that show the background need to be rendered again
+        for key in self.deck_controller.keys:
+            if key.background_color[-1] < 255:
+                key.mark_dirty()
         
 
 class BackgroundImage:
-    def __init__(self, deck_controller: DeckController, image: Image) -> None:
+    def __init__(self, deck_controller: DeckController, image: Image, media_id: str = None) -> None:
         self.deck_controller = deck_controller
         self.image = image
 
-    def create_full_deck_sized_image(self) -> Image:
-        key_rows, key_cols = self.deck_controller.deck.key_layout()
-        key_width, key_height = self.deck_controller.get_key_image_size()
-        spacing_x, spacing_y = 36, 36
-
-        key_width *= key_cols
-        key_height *= key_rows
-
-        # Compute the total number of extra non-visible pixels that are obscured by
-        # the bezel of the StreamDeck.
-        spacing_x *= key_cols - 1
-        spacing_y *= key_rows - 1
-
-        # Compute final full deck image size, based on the number of buttons and
-        # obscured pixels.
-        full_deck_image_size = (key_width + spacing_x, key_height + spacing_y)
-
-        # Resize the image to suit the StreamDeck's full image size. We use the
-        # helper function in Pillow's ImageOps module so that the image's aspect
-        # ratio is preserved.
-        return ImageOps.fit(self.image, full_deck_image_size, Image.LANCZOS)
-    
-    def crop_key_image_from_deck_sized_image(self, image: Image.Image, key):
-        key_spacing = (36, 36)
-        deck = self.deck_controller.deck
-
-
-        key_rows, key_cols = deck.key_layout()
-        key_width, key_height = deck.key_image_format()['size']
-        spacing_x, spacing_y = key_spacing
-
-        # Determine which row and column the requested key is located on.
-        row = key // key_cols
-        col = key % key_cols
-
-        # Compute the starting X and Y offsets into the full size image that the
-        # requested key should display.
-        start_x = col * (key_width + spacing_x)
-        start_y = row * (key_height + spacing_y)
+        if media_id is None:
+            media_id = uuid.uuid4().hex
+        self.media_id = media_id
 
-        # Compute the region of the larger deck image that is occupied by the given
-        # key, and crop out that segment of the full image.
-        region = (start_x, start_y, start_x + key_width, start_y + key_height)
-        segment = image.crop(region)
-
-        # Create a new key-sized image, and paste in the cropped section of the
-        # larger image.
-        key_image = PILHelper.create_key_image(deck)
-        key_image.paste(segment)
-
-        return key_image
-    
     def get_tiles(self) -> list[Image.Image]:
-        full_deck_sized_image = self.create_full_deck_sized_image()
-
-        tiles: list[Image.Image] = []
-        for key in range(self.deck_controller.deck.key_count()):
-            key_image = self.crop_key_image_from_deck_sized_image(full_deck_sized_image, key)
-            tiles.append(key_image)
-
-        return tiles
+        deck = self.deck_controller.deck
+        tiler = DeckTiler(deck.key_layout(), deck.key_image_format()["size"], self.deck_controller.spacing)
+        return tiler.get_image_tiles(self.image)
 
 
 class BackgroundVideo(BackgroundVideoCache):
@@ -743,124 +843,75 @@ class BackgroundVideo(BackgroundVideoCache):
 
         self.page: Page = self.deck_controller.active_page
 
-        self.active_frame: int = -1
+        self.active_frame: int = 0
+        # Playback position is computed from the time since the start
+        self.start_time: float = time.monotonic()
 
         super().__init__(video_path, deck_controller=deck_controller)
 
+    def seek(self, now: float) -> bool:
+        """
+        Sets the active frame to the frame that should be visible at the given time.monotonic() timestamp.
+        Returns True if the active frame changed.
+        """
+        frame = get_frame_index_at(now - self.start_time, self.fps, self.n_frames, self.loop)
+        if frame == self.active_frame:
+            return False
+        self.active_frame = frame
+        return True
+
     def get_next_tiles(self) -> list[Image.Image]:
         # return [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
-        self.active_frame += 1
-
-        if self.active_frame >= self.n_frames:
-            if self.loop:
-                self.active_frame = 0
-
+        if self.container is not None:
+            # Fresh views into the mmaped cache, nothing else holds them
+            return self.get_tiles(self.active_frame)
         tiles =  self.get_tiles(self.active_frame)
+        if tiles is None:
+            # The decoder didn't deliver the first frame yet
+            return [None for _ in range(self.key_count)]
         try:
             copied_tiles = [tile.copy() for tile in tiles]
         except:
             copied_tiles = [None for _ in range(len(tiles))]
         return copied_tiles
 
-        frame = self.get_next_frame()
-        frame_full_sized_image = self.create_full_deck_sized_image(frame)
-
-        tiles: list[Image.Image] = []
-        for key in range(self.deck_controller.deck.key_count()):
-            key_image = self.crop_key_image_from_deck_sized_image(frame_full_sized_image, key)
-            tiles.append(key_image)
-
-        return tiles
-
-    def get_next_frame(self) -> Image.Image:
-        self.active_frame += 1
-
-        if self.active_frame >= self.n_frames:
-            self.active_frame = 0
-        
-        return self.get_frame(self.active_frame)
-    
-    def create_full_deck_sized_image(self, frame: Image.Image) -> Image.Image:
-        key_rows, key_cols = self.deck_controller.deck.key_layout()
-        key_width, key_height = self.deck_controller.get_key_image_size()
-        spacing_x, spacing_y = 36, 36
-
-        key_width *= key_cols
-        key_height *= key_rows
-
-        # Compute the total number of extra non-visible pixels that are obscured by
-        # the bezel of the StreamDeck.
-        spacing_x *= key_cols - 1
-        spacing_y *= key_rows - 1
-
-        # Compute final full deck image size, based on the number of buttons and
-        # obscured pixels.
-        full_deck_image_size = (key_width + spacing_x, key_height + spacing_y)
-
-        # Resize the image to suit the StreamDeck's full image size. We use the
-        # helper function in Pillow's ImageOps module so that the image's aspect
-        # ratio is preserved.
-        return ImageOps.fit(frame, full_deck_image_size, Image.Resampling.HAMMING)
-    
-    def crop_key_image_from_deck_sized_image(self, image: Image.Image, key):
-        key_spacing = (36, 36)
-        deck = self.deck_controller.deck
-
-
-        key_rows, key_cols = deck.key_layout()
-        key_width, key_height = deck.key_image_format()['size']
-        spacing_x, spacing_y = key_spacing
-
-        # Determine which row and column the requested key is located on.
-        row = key // key_cols
-        col = key % key_cols
-
-        # Compute the starting X and Y offsets into the full size image that the
-        # requested key should display.
-        start_x = col * (key_width + spacing_x)
-        start_y = row * (key_height + spacing_y)
-
-        # Compute the region of the larger deck image that is occupied by the given
-        # key, and crop out that segment of the full image.
-        region = (start_x, start_y, start_x + key_width, start_y + key_height)
-        segment = image.crop(region)
-
-        # Create a new key-sized image, and paste in the cropped section of the
-        # larger image.
-        key_image = PILHelper.create_key_image(deck)
-        key_image.paste(segment)
-
-        return key_image
-    
 
 class KeyGIF(SingleKeyAsset):
     def __init__(self, controller_key: "ControllerKey", gif_path: str, fill_mode: str = "cover", size: float = 1,
                  valign: float = 0, halign: float = 0, fps: int = 30, loop: bool = True):
-        super().__init__(controller_key, fill_mode, size, valign, halign)
+        super().__init__(controller_key, fill_mode, size, valign, halign, media_id=get_file_media_id(gif_path))
         self.gif_path = gif_path
+        # Not used for the playback, gifs are played with the frame durations stored in the file
         self.fps = fps
         self.loop = loop
 
-        self.active_frame: int = -1
-
-        self.gif = Image.open(self.gif_path)
-        self.gif = ImageSequence.Iterator(self.gif)
-        self.frames = [frame.convert("RGBA") for frame in self.gif]
+        self.active_frame: int = 0
+        self.start_time: float = time.monotonic()
+        # time.monotonic() timestamp at which the visible frame changes next
+        self.next_change: float = 0
 
-    def get_next_frame(self) -> Image.Image:
-        self.active_frame += 1
+        # Shared with all other keys showing this gif in the same size, the frames are already fitted to the key
+        self.gif_frames = gl.gif_frame_cache.get_frames(gif_path, self.media_id, self.deck_controller.get_key_image_size(), fill_mode, size)
+        self.frames = self.gif_frames.frames
 
-        if self.active_frame >= len(self.frames):
-            if self.loop:
-                self.active_frame = 0
-            else:
-                self.active_frame = len(self.frames) - 1
-
-        return self.frames[self.active_frame]
-        self.gif.convert("RGBA")
+    def seek(self, now: float) -> None:
+        if now < self.next_change:
+            # Still the same frame, nothing to do for this tick
+            return
+        frame, remaining = self.gif_frames.get_frame_at(now - self.start_time, self.loop)
+        self.next_change = now + remaining
+        if frame != self.active_frame:
+            self.active_frame = frame
+            self.controller_key.mark_dirty()
+
+    def get_current_frame(self) -> Image.Image:
+        return self.frames[max(self.active_frame, 0)]
+    
+    def get_render_token(self) -> tuple:
+        return super().get_render_token() + (max(self.active_frame, 0),)
     
     def get_raw_image(self) -> Image.Image:
-        return self.get_next_frame()
+        return self.get_current_frame()
     
 
 class ControllerKey:
@@ -886,26 +937,43 @@ class ControllerKey:
 
         self.hide_error_timer: Timer = None
 
+        # The generation gets increased every time an input of the rendered image changes (background tile, labels, media frame, press state...)
+        # The key only needs to be rendered again if it changed since the last render
+        self.generation: int = 0
+        self.rendered_generation: int = -1
+        # Generation of the last image that was written right away (press feedback) - queued images of older generations are outdated
+        self.written_generation: int = -1
+
+        # The key is rendered into the same buffers every time, the lock prevents two renders of this key from sharing them
+        self.canvas: KeyCanvas = None
+        self.render_lock = threading.Lock()
+
+        # (generation, image, native image) of the last unpressed render, presses only shrink it
+        self.composite: tuple[int, Image.Image, bytes] = None
+        # (unpressed image, pressed image, pressed native image)
+        self.press_variant: tuple[Image.Image, Image.Image, bytes] = None
+        # time.perf_counter() of the last press or release
+        self.press_time: float = 0
+
         # self.pressed_on_page: Page = None #TODO: Block release on different page than press
 
     def get_current_deck_image(self) -> Image.Image:
-        background: Image.Image = None
-        # Only load the background image if it's not gonna be hidden by the background color
-        if self.background_color[-1] < 255:
-            background = copy(self.deck_controller.background.tiles[self.key])
+        with self.render_lock:
+            return self.render_to_canvas().copy()
 
-        if self.background_color[-1] > 0:
-            background_color_img = Image.new("RGBA", self.deck_controller.get_key_image_size(), color=tuple(self.background_color))
-            
-            if background is None:
-                # Use the color as the only background - happens if background color alpha is 255
-                background = background_color_img
-            else:
-                background.paste(background_color_img, (0, 0), background_color_img)
+    def get_canvas(self) -> KeyCanvas:
+        size = tuple(self.deck_controller.get_key_image_size())
+        if self.canvas is None or self.canvas.size != size:
+            self.canvas = KeyCanvas(size)
+        return self.canvas
 
-
-        if background is None:
-            background = self.deck_controller.generate_alpha_key().copy()
+    def render_to_canvas(self) -> Image.Image:
+        """
+        Renders the key into its canvas. Must be called while holding self.render_lock.
+        The returned image gets overwritten by the next render, copy it if you want to keep it.
+        """
+        canvas = self.get_canvas()
+        background = canvas.draw_background(self.deck_controller.background.tiles[self.key], self.background_color)
 
         image: Image.Image = None
         if self.key_image is not None:
@@ -917,10 +985,49 @@ class ControllerKey:
         labeled_image = self.add_labels_to_image(image)
 
         if self.is_pressed():
-            labeled_image = self.shrink_image(labeled_image)
+            labeled_image = canvas.shrink(labeled_image)
 
         return labeled_image
     
+    def get_render_key(self) -> tuple:
+        """
+        Returns a hashable description of all inputs of the rendered image.
+        Returns None if the image can't be cached (e.g. because it shows a frame of a video)
+        """
+        background_token = None
+        # The background is hidden by an opaque background color
+        if self.background_color[-1] < 255:
+            background_token = self.deck_controller.background.get_tile_token(self.key)
+            if background_token is None:
+                return
+        
+        media_token = None
+        if self.key_image is not None:
+            media_token = self.key_image.get_render_token()
+        elif self.key_video is not None:
+            media_token = self.key_video.get_render_token()
+        if media_token is None and (self.key_image is not None or self.key_video is not None):
+            return
+        
+        label_tokens = tuple((position, self.labels[position].get_render_token()) for position in sorted(dict(self.labels)))
+
+        return (background_token, media_token, label_tokens, tuple(self.background_color), self.is_pressed())
+
+    def shows_plain_background(self) -> bool:
+        """
+        Returns True if the rendered image of this key is nothing but the background tile
+        """
+        if self.key_image is not None or self.key_video is not None:
+            return False
+        if self.background_color[-1] > 0:
+            return False
+        if self.is_pressed():
+            return False
+        for label in dict(self.labels).values():
+            if label.text not in [None, ""]:
+                return False
+        return True
+
     def paste_foreground(self, background: Image.Image, foreground: Image.Image) -> Image.Image:
         img_size = self.deck_controller.get_key_image_size()
         img_size = (int(img_size[0] * self.size), int(img_size[1] * self.size)) # Calculate scaled size of the image
@@ -945,12 +1052,45 @@ class ControllerKey:
     def update(self) -> None:
         self.deck_controller.update_key(self.key)
 
+    def update_press_state(self) -> None:
+        self.deck_controller.update_key_press(self.key)
+
+    def get_press_variant(self, composite: tuple[int, Image.Image, bytes]) -> tuple[Image.Image, bytes]:
+        """
+        Returns the image and native image of the composite in the current press state
+        """
+        _, image, native_image = composite
+        if not self.is_pressed():
+            return image, native_image
+
+        variant = self.press_variant
+        if variant is None or variant[0] is not image:
+            pressed, pressed_native = gl.render_backend.render_pressed(self, image)
+            variant = (image, pressed, pressed_native)
+            self.press_variant = variant
+        return variant[1], variant[2]
+
+    def mark_dirty(self) -> None:
+        self.generation += 1
+
+    def is_dirty(self) -> bool:
+        return self.generation != self.rendered_generation
+
+    def set_rendered_generation(self, generation: int) -> None:
+        # A render of an older generation that finishes late must not go back behind a newer one
+        self.rendered_generation = max(self.rendered_generation, generation)
+    
+    def update_if_dirty(self) -> None:
+        if self.is_dirty():
+            self.update()
+
     def set_key_image(self, key_image: "KeyImage", update: bool = True) -> None:
         if self.key_image is not None:
             self.key_image.close()
 
         self.key_image = key_image
         self.key_video = None
+        self.mark_dirty()
 
         if update:
             self.update()
@@ -960,6 +1100,17 @@ class ControllerKey:
         if self.key_image is not None:
             self.key_image.close()
         self.key_image = None
+        self.mark_dirty()
+
+    def set_background_color(self, color: list[int], update: bool = True) -> None:
+        self.background_color = color
+        # Ensure the background color has an alpha channel
+        if len(self.background_color) == 3:
+            self.background_color.append(255)
+        self.mark_dirty()
+
+        if update:
+            self.update()
 
     def add_label(self, key_label: "KeyLabel", position: str = "center", update: bool = True) -> None:
         if position not in ["top", "center", "bottom"]:
@@ -967,6 +1118,7 @@ class ControllerKey:
             return
         
         self.labels[position] = key_label
+        self.mark_dirty()
 
         if update:
             self.update()
@@ -979,59 +1131,26 @@ class ControllerKey:
         if position not in self.labels:
             return
         del self.labels[position]
+        self.mark_dirty()
 
         if update:
             self.update()
 
-    def add_labels_to_image(self, _image: Image.Image) -> Image.Image:
-        # image = _image.copy()
-        # _image.close()
-        image = _image
-        # image = Image.new("RGBA", _image.size, (0, 0, 0, 0))
-
-        # image = Image.frombytes("RGBA", _image.size, _image.tobytes())
-
-        draw = ImageDraw.Draw(image)
-        draw.fontmode = "1" # Anti-aliased - this prevents frayed/noisy labels on the deck
-
-        # labels = copy(self.labels) # Prevent crash if labels change during iteration
-        labels = self.labels
+    def add_labels_to_image(self, image: Image.Image) -> Image.Image:
+        with gl.metrics_manager.measure(self.deck_controller.serial_number, self.key, "label-draw"):
+            # The overlays are cached by size and label content in key_compositor
+            return composite_label_overlay(image, get_label_overlay(image.size, self.get_label_list()))
 
-        for label in dict(labels):
-            text = labels[label].text
-            if text in [None, ""]:
-                continue
-            # text = "text"
-            font_path = labels[label].get_font_path()
-            color = tuple(labels[label].color)
-            font_size = labels[label].font_size
-            font = ImageFont.truetype(font_path, font_size)
-            font_weight = labels[label].font_weight
-
-            if text is None:
+    def get_label_list(self) -> list[tuple]:
+        """
+        Returns the labels to draw in the format of key_compositor.draw_labels - the same for both render backends
+        """
+        labels = []
+        for position, label in dict(self.labels).items():
+            if label.text in [None, ""]:
                 continue
-            
-            if label == "top":
-                position = (image.width / 2, font_size*1.125)
-
-            if label == "center":
-                position = (image.width / 2, (image.height + font_size) / 2 - 3)
-
-            if label == "bottom":
-                position = (image.width / 2, image.height*0.875)
-
-
-            start_mem = process.memory_info().rss
-            draw.text(position,
-                        text=text, font=font, anchor="ms",
-                        fill=color, stroke_width=font_weight)
-            end = process.memory_info().rss
-      
-            
-        draw = None
-        del draw
-
-        return image.copy()
+            labels.append((position, label.text, label.get_font_path(), label.font_size, tuple(label.color), label.font_weight))
+        return labels
     
     def is_pressed(self) -> bool:
         return self.press_state
@@ -1044,18 +1163,7 @@ class ControllerKey:
         return image
     
     def shrink_image(self, image: Image.Image, factor: float = 0.7) -> Image.Image:
-        image = image.copy()
-        width = int(image.width * factor)
-        height = int(image.height * factor)
-        image = image.resize((width, height))
-
-        background = Image.new("RGBA", self.deck_controller.get_key_image_size(), (0, 0, 0, 0))
-
-        background.paste(image, (int((self.deck_controller.get_key_image_size()[0] - width) / 2), int((self.deck_controller.get_key_image_size()[1] - height) / 2)))
-
-        image.close()
-
-        return background
+        return shrink_image(image, factor)
     
     def show_error(self, duration: int = -1):
         """
@@ -1067,13 +1175,15 @@ class ControllerKey:
             self.hide_error_timer = Timer(duration, self.hide_error, args=[self.key_image, self.key_video, self.labels])
             self.hide_error_timer.start()
 
-        with Image.open(os.path.join("Assets", "images", "error.png")) as image:
+        error_path = os.path.join("Assets", "images", "error.png")
+        with Image.open(error_path) as image:
             image = image.copy()
 
         new_key_image = KeyImage(
             controller_key=self,
             image=image,
-            size=0.7
+            size=0.7,
+            media_id=get_file_media_id(error_path)
         )
 
         # Reset labels
@@ -1083,6 +1193,7 @@ class ControllerKey:
 
     def hide_error(self, original_key_image: "KeyImage", original_video: "KeyVideo", original_labels: dict = {}):
         self.labels = original_labels
+        self.mark_dirty()
         
         if original_video is not None:
             self.set_key_video(original_video) # This also applies the labels
@@ -1113,6 +1224,8 @@ class ControllerKey:
         start = time.time()
         self.own_actions_ready() # Why not threaded? Because this would mean that some image changing calls might get executed after the next lines which blocks custom assets
         actions = self.get_own_actions()
+        # Only the actions that implement on_tick get ticked
+        gl.tick_scheduler.schedule_key(self, actions)
 
         start = time.time()
         ## Load labels
@@ -1146,6 +1259,7 @@ class ControllerKey:
                             size=page_dict.get("media", {}).get("size", 1),
                             valign=page_dict.get("media", {}).get("valign", 0),
                             halign=page_dict.get("media", {}).get("halign", 0),
+                            media_id=get_file_media_id(path)
                         ), update=False)
 
                 elif is_video(path) and True:
@@ -1171,28 +1285,34 @@ class ControllerKey:
                         )) # Videos always update
 
             elif len(self.get_own_actions()) > 1:
-                with Image.open(os.path.join("Assets", "images", "multi_action.png")) as image:
+                multi_action_path = os.path.join("Assets", "images", "multi_action.png")
+                with Image.open(multi_action_path) as image:
                     self.set_key_image(KeyImage(
                         controller_key=self,
                         image=image.copy(),
+                        media_id=get_file_media_id(multi_action_path)
                     ), update=False)
 
         start = time.time()
         if load_background_color:
-            self.background_color = page_dict.get("background", {}).get("color", [0, 0, 0, 0])
-            # Ensure the background color has an alpha channel
-            if len(self.background_color) == 3:
-                self.background_color.append(255)
+            self.set_background_color(page_dict.get("background", {}).get("color", [0, 0, 0, 0]), update=False)
 
+        self.mark_dirty()
 
         if update:
             self.update()
 
     def clear(self, update: bool = True):
+        # Clearing an already empty key doesn't change the rendered image
+        if self.key_image is not None or self.key_video is not None or self.labels or self.background_color != [0, 0, 0, 0]:
+            self.mark_dirty()
+
         self.key_image = None
         self.key_video = None
         self.labels = {}
         self.background_color = [0, 0, 0, 0]
+        # The key has no actions anymore, the ones of the previous page must not tick
+        gl.tick_scheduler.schedule_key(self, [])
         if update:
             self.update()
 
@@ -1232,26 +1352,40 @@ class ControllerKey:
         return actions
     
     def on_key_change(self, state) -> None:
+        self.press_time = time.perf_counter()
+
+        # If the key is up to date and was rendered unpressed the press doesn't change the content, so the composite can be reused
+        composite = self.composite
+        reusable = not self.is_dirty() and composite is not None and composite[0] == self.generation
+
         self.press_state = state
+        self.mark_dirty()
 
-        self.update()
+        if reusable:
+            self.composite = (self.generation, composite[1], composite[2])
+        self.update_press_state()
 
         if state:
             self.own_actions_key_down_threaded()
         else:
             self.own_actions_key_up_threaded()
 
+    def get_job_tag(self, event: str, action_index: int = None) -> tuple:
+        own_coords = self.deck_controller.index_to_coords(self.key)
+        return get_job_tag(event, self.deck_controller.serial_number, f"{own_coords[0]}x{own_coords[1]}", action_index)
+
     def own_actions_ready_threaded(self) -> None:
-        threading.Thread(target=self.own_actions_ready, name="own_actions_ready").start()
+        gl.action_executor.submit(self.deck_controller.serial_number, self.key, self.own_actions_ready, tag=self.get_job_tag("ready"))
 
     def own_actions_key_down_threaded(self) -> None:
-        threading.Thread(target=self.own_actions_key_down, name="own_actions_key_down").start()
+        gl.action_executor.submit(self.deck_controller.serial_number, self.key, self.own_actions_key_down, tag=self.get_job_tag("key-down"))
 
     def own_actions_key_up_threaded(self) -> None:
-        threading.Thread(target=self.own_actions_key_up, name="own_actions_key_up").start()
+        gl.action_executor.submit(self.deck_controller.serial_number, self.key, self.own_actions_key_up, tag=self.get_job_tag("key-up"))
 
     def own_actions_tick_threaded(self) -> None:
-        threading.Thread(target=self.own_actions_tick, name="own_actions_tick").start()
+        # A tick that is still queued or running makes a second one pointless
+        gl.action_executor.submit_tick(self.deck_controller.serial_number, self.key, self.own_actions_tick, tag=self.get_job_tag("tick"))
 
 
 
@@ -1290,11 +1424,15 @@ class KeyLabel:
         if self.font_name is None and False:
             FALLBACK = os.path.join("Assets", "Fonts", "Roboto-Regular.ttf")
             return FALLBACK
-        return matplotlib.font_manager.findfont(matplotlib.font_manager.FontProperties(family=self.font_name))
+        return font_registry.get_font_path(self.font_name)
+    
+    def get_render_token(self) -> tuple:
+        return (self.text, self.font_name, self.font_size, tuple(self.color), self.font_weight)
 
 
 class KeyImage(SingleKeyAsset):
-    def __init__(self, controller_key: ControllerKey, image: Image.Image, fill_mode: str = "cover", size: float = 1, valign: float = 0, halign: float = 0):
+    def __init__(self, controller_key: ControllerKey, image: Image.Image, fill_mode: str = "cover", size: float = 1, valign: float = 0, halign: float = 0,
+                 media_id: str = None):
         """
         Initialize the class with the given controller key, image, fill mode, size, vertical alignment, and horizontal alignment.
 
@@ -1305,8 +1443,9 @@ class KeyImage(SingleKeyAsset):
             size (float, optional): The size of the image. Defaults to 1.
             valign (float, optional): The vertical alignment of the image. Defaults to 0. Ranges from -1 to 1.
             halign (float, optional): The horizontal alignment of the image. Defaults to 0. Ranges from -1 to 1.
+            media_id (str, optional): Identifies the content of the image, used for caching. Defaults to a random id.
         """
-        super().__init__(controller_key, fill_mode, size, valign, halign)
+        super().__init__(controller_key, fill_mode, size, valign, halign, media_id)
         self.image = image
 
         if self.image is None:
@@ -1337,18 +1476,22 @@ class KeyVideo(SingleKeyAsset):
 
         self.video_cache = VideoFrameCache(video_path)
 
-        self.active_frame: int = -1
+        self.active_frame: int = 0
+        self.start_time: float = time.monotonic()
 
+    def seek(self, now: float) -> None:
+        frame = get_frame_index_at(now - self.start_time, self.fps, self.video_cache.n_frames, self.loop)
+        if frame != self.active_frame:
+            self.active_frame = frame
+            self.controller_key.mark_dirty()
 
-    def get_next_frame(self) -> Image:
-        self.active_frame += 1
+    def get_render_token(self) -> tuple:
+        # Video frames rarely repeat within the cache size - don't pollute the cache with them
+        return
 
-        if self.active_frame >= self.video_cache.n_frames:
-            if self.loop:
-                self.active_frame = 0
-        
-        return self.video_cache.get_frame(self.active_frame).resize(self.controller_key.deck_controller.get_key_image_size(), Image.Resampling.LANCZOS)
+    def get_current_frame(self) -> Image:
+        return self.video_cache.get_frame(max(self.active_frame, 0)).resize(self.controller_key.deck_controller.get_key_image_size(), Image.Resampling.LANCZOS)
     
     def get_raw_image(self) -> Image.Image:
-        return self.get_next_frame()
+        return self.get_current_frame()
      
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger as log
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.DeckController import MediaPlayer
+
+class FrameScheduler(threading.Thread):
+    """
+    One scheduler per process that drives the frames of all decks.
+    Each frame, the tick of every registered MediaPlayer runs in the deck pool, so the usb writes of different decks happen in parallel.
+    The key renders of a tick are distributed over the render pool.
+    """
+    def __init__(self, fps: int = 30, max_decks: int = 16):
+        super().__init__(name="FrameScheduler", daemon=True)
+        self.FPS = fps # Max refresh rate of the internal displays
+
+        self.lock = threading.Lock()
+        self.media_players: list["MediaPlayer"] = []
+
+        self.deck_pool = ThreadPoolExecutor(max_workers=max_decks, thread_name_prefix="deck_tick")
+        self.render_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="key_render")
+
+        # Not called _stop, that would hide threading.Thread._stop which is_alive() and join() rely on
+        self.stop_event = threading.Event()
+
+    def add_media_player(self, media_player: "MediaPlayer") -> None:
+        with self.lock:
+            if media_player not in self.media_players:
+                self.media_players.append(media_player)
+
+    def remove_media_player(self, media_player: "MediaPlayer") -> None:
+        with self.lock:
+            if media_player in self.media_players:
+                self.media_players.remove(media_player)
+
+    def run(self):
+        frame_interval = 1 / self.FPS
+        deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            # Each frame has to be on the decks until its deadline
+            deadline += frame_interval
+
+            with self.lock:
+                media_players = list(self.media_players)
+
+            for media_player in media_players:
+                if media_player.ticking:
+                    # The last frame of this deck is still in progress - drop this one
+                    media_player.dropped_frames += 1
+                    continue
+                media_player.ticking = True
+                try:
+                    future = self.deck_pool.submit(media_player.tick, deadline)
+                except RuntimeError:
+                    # The pool got shut down by stop() in the meantime
+                    media_player.ticking = False
+                    break
+                future.add_done_callback(functools.partial(self.on_tick_done, media_player))
+
+            now = time.monotonic()
+            if now > deadline:
+                # We are behind schedule - skip the missed deadlines instead of trying to catch up
+                deadline += (now - deadline) // frame_interval * frame_interval
+
+            self.stop_event.wait(max(0, deadline - time.monotonic()))
+
+    def on_tick_done(self, media_player: "MediaPlayer", future: Future) -> None:
+        if future.cancelled():
+            # The tick never ran, so it couldn't reset the flag itself - MediaPlayer.stop() would wait for it forever
+            media_player.ticking = False
+
+    def stop(self) -> None:
+        log.info("Stopping frame scheduler")
+        self.stop_event.set()
+        self.deck_pool.shutdown(wait=False, cancel_futures=True)
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,104 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import bisect
+import itertools
+import math
+import threading
+import time
+import weakref
+from PIL import Image, ImageSequence
+from loguru import logger as log
+
+# Import own modules
+from src.backend.DeckManagement.Subclasses.key_compositor import fit_foreground
+
+class GifFrames:
+    """
+    Decoded frames of a gif, already fitted to the key they are shown on
+    """
+    # Browsers show frames without or with a very short delay for 100ms, so do we
+    MIN_DURATION = 0.02
+    DEFAULT_DURATION = 0.1
+
+    def __init__(self, frames: list[Image.Image], durations: list[float]):
+        self.frames = frames
+        # Seconds each frame is visible
+        self.durations = durations
+        # Time at which each frame ends, measured from the start of the gif
+        self.timeline: list[float] = list(itertools.accumulate(durations))
+        self.total_duration: float = self.timeline[-1] if self.timeline else 0
+
+    def get_frame_at(self, elapsed: float, loop: bool = True) -> tuple[int, float]:
+        """
+        Returns the index of the frame that is visible after the given seconds and for how many more seconds it stays visible
+        """
+        if len(self.frames) <= 1 or self.total_duration <= 0:
+            return 0, math.inf
+        elapsed = max(elapsed, 0)
+        if loop:
+            elapsed %= self.total_duration
+        elif elapsed >= self.total_duration:
+            # The last frame stays forever
+            return len(self.frames) - 1, math.inf
+
+        index = min(bisect.bisect_right(self.timeline, elapsed), len(self.frames) - 1)
+        return index, self.timeline[index] - elapsed
+
+class GifFrameCache:
+    """
+    Shares the decoded gifs between all keys and decks that show them.
+    Entries are kept as long as at least one key uses them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (media id, key size, fill mode, size) -> frames
+        self.entries: weakref.WeakValueDictionary[tuple, GifFrames] = weakref.WeakValueDictionary()
+        # Makes keys that load the same gif at the same time wait for the first one instead of decoding it again
+        self.loading_locks: dict[tuple, threading.Lock] = {}
+
+    def get_frames(self, gif_path: str, media_id: str, key_size: tuple[int], fill_mode: str = "cover", size: float = 1) -> GifFrames:
+        cache_key = (media_id, tuple(key_size), fill_mode, size)
+        with self.lock:
+            frames = self.entries.get(cache_key)
+            if frames is not None:
+                return frames
+            loading_lock = self.loading_locks.setdefault(cache_key, threading.Lock())
+
+        with loading_lock:
+            frames = self.entries.get(cache_key)
+            if frames is None:
+                frames = self.load(gif_path, key_size, fill_mode, size)
+                with self.lock:
+                    self.entries[cache_key] = frames
+                    self.loading_locks.pop(cache_key, None)
+
+        return frames
+
+    def load(self, gif_path: str, key_size: tuple[int], fill_mode: str, size: float) -> GifFrames:
+        start = time.time()
+        frames: list[Image.Image] = []
+        durations: list[float] = []
+        with Image.open(gif_path) as gif:
+            for frame in ImageSequence.Iterator(gif):
+                duration = frame.info.get("duration")
+                if duration is None or duration / 1000 < GifFrames.MIN_DURATION:
+                    durations.append(GifFrames.DEFAULT_DURATION)
+                else:
+                    durations.append(duration / 1000)
+                frames.append(fit_foreground(frame.convert("RGBA"), key_size, fill_mode, size))
+
+        log.trace(f"Decoded {len(frames)} frames of {gif_path} in {time.time() - start:.2f} seconds")
+        return GifFrames(frames, durations)
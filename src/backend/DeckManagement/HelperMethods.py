@@ -14,7 +14,6 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 import hashlib
 import os
-import matplotlib.font_manager
 import sys
 import math
 import json
@@ -22,6 +21,9 @@ import requests
 from urllib.parse import urlparse
 from PIL import Image
 
+# Import own modules
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+
 # Import globals
 import globals as gl
 
@@ -41,6 +43,20 @@ def sha256(file_path):
             hash_sha256.update(chunk)
     return hash_sha256.hexdigest()
 
+def get_file_media_id(file_path: str) -> str:
+    """
+    Returns an id for the content of a file that changes if the file gets modified.
+    This is cheap because it only uses the file stats.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The id of the file.
+    """
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
 def file_in_dir(file_path, directory) -> None:
     """
     Check if a file is present in a directory.
@@ -76,9 +92,10 @@ def recursive_hasattr(obj, attr_string):
     return True
 
 def font_path_from_name(font_name: str):
-    return matplotlib.font_manager.findfont(matplotlib.font_manager.FontProperties(family=font_name))
+    return font_registry.get_font_path(font_name)
 
 def font_name_from_path(font_path: str):
+    import matplotlib.font_manager
     font_properties = matplotlib.font_manager.FontProperties(fname=font_path)
     return font_properties.get_family()[0]
 
@@ -128,6 +145,26 @@ def is_image(path: str) -> bool:
 
     return False
 
+def get_frame_index_at(elapsed: float, fps: float, n_frames: int, loop: bool = True) -> int:
+    """
+    Calculates the frame of a video that should be visible after the given time.
+
+    Args:
+        elapsed (float): Seconds since the start of the playback.
+        fps (float): Frame rate of the playback.
+        n_frames (int): Number of frames in the video.
+        loop (bool): Whether the video starts again after the last frame.
+
+    Returns:
+        int: The index of the frame.
+    """
+    if n_frames <= 0 or fps <= 0:
+        return 0
+    frame = int(max(elapsed, 0) * fps)
+    if loop:
+        return frame % n_frames
+    return min(frame, n_frames - 1)
+
 def get_image_aspect_ratio(img: Image) -> str:
     width, height = img.size
     gcd = math.gcd(width, height)
@@ -119,6 +119,8 @@ class ScreenSaver:
         self.deck_controller.keys = self.original_keys
         self.deck_controller.background = self.original_background
         self.deck_controller.set_brightness(self.original_brightness)
+        # The deck still shows the screen saver, so all restored keys have to be rendered again
+        self.deck_controller.mark_all_keys_dirty()
         self.deck_controller.update_all_keys()
         self.showing = False
 
@@ -13,15 +13,19 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-from PIL import Image, ImageOps, ImageDraw, ImageFont
+from PIL import Image
 import os
+import uuid
+
+from src.backend.DeckManagement.Subclasses.key_compositor import paste_foreground, draw_labels
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import ControllerKey
 
 class SingleKeyAsset:
-    def __init__(self, controller_key: "ControllerKey", fill_mode: str = "cover", size: float = 1, valign: float = 0, halign: float = 0):
+    def __init__(self, controller_key: "ControllerKey", fill_mode: str = "cover", size: float = 1, valign: float = 0, halign: float = 0,
+                 media_id: str = None):
         self.controller_key = controller_key
         self.deck_controller = controller_key.deck_controller
         self.fill_mode = fill_mode
@@ -29,66 +33,28 @@ class SingleKeyAsset:
         self.valign = valign
         self.halign = halign
 
+        # Identifies the content of the asset - assets with the same id are expected to show the same image
+        if media_id is None:
+            media_id = uuid.uuid4().hex
+        self.media_id = media_id
+
+    def get_render_token(self) -> tuple:
+        """
+        Returns a hashable description of everything that affects how this asset is rendered.
+        Returns None if the asset can't be cached.
+        """
+        return (self.media_id, self.fill_mode, self.size, self.valign, self.halign)
+
     def get_raw_image(self) -> Image.Image:
         return Image.open(os.path.join("Assets", "images", "error.png"))
     
     def add_labels_to_image(self, image: Image.Image, labels: dict) -> Image.Image:
-        draw = ImageDraw.Draw(image)
-        draw.fontmode = "1" # Anti-aliased - this prevents frayed/noisy labels on the deck
-
-        for label in dict(labels):
-            text = labels[label].text
-            if text in [None, ""]:
-                continue
-            # text = "text"
-            font_path = labels[label].get_font_path()
-            color = tuple(labels[label].color)
-            font_size = labels[label].font_size
-            font = ImageFont.truetype(font_path, font_size)
-            font_weight = labels[label].font_weight
-
-            if text is None:
-                continue
-            
-            if label == "top":
-                position = (image.width / 2, font_size*1.125)
-
-            if label == "center":
-                position = (image.width / 2, (image.height + font_size) / 2 - 3)
-
-            if label == "bottom":
-                position = (image.width / 2, image.height*0.875)
+        label_list = []
+        for position, label in dict(labels).items():
+            label_list.append((position, label.text, label.get_font_path(), label.font_size, label.color, label.font_weight))
 
-
-            draw.text(position,
-                        text=text, font=font, anchor="ms",
-                        fill=color, stroke_width=font_weight)
-            
-        draw = None
-        del draw
-
-        return image.copy()
+        return draw_labels(image, label_list).copy()
     
     def generate_final_image(self, background: Image.Image = None, labels: dict = {}) -> Image.Image:
         foreground = self.get_raw_image()
-
-        img_size = self.deck_controller.get_key_image_size()
-        img_size = (int(img_size[0] * self.size), int(img_size[1] * self.size)) # Calculate scaled size of the image
-        if self.fill_mode == "stretch":
-            foreground_resized = foreground.resize(img_size, Image.Resampling.HAMMING)
-
-        elif self.fill_mode == "cover":
-            foreground_resized = ImageOps.cover(foreground, img_size, Image.Resampling.HAMMING)
-
-        elif self.fill_mode == "contain":
-            foreground_resized = ImageOps.contain(foreground, img_size, Image.Resampling.HAMMING)
-
-        left_margin = int((background.width - img_size[0]) * (self.halign + 1) / 2)
-        top_margin = int((background.height - img_size[1]) * (self.valign + 1) / 2)
-
-        if foreground.mode == "RGBA":
-            background.paste(foreground_resized, (left_margin, top_margin), foreground_resized)
-        else:
-            background.paste(foreground_resized, (left_margin, top_margin))
-        
-        return background
\ No newline at end of file
+        return paste_foreground(background, foreground, self.fill_mode, self.size, self.valign, self.halign)
\ No newline at end of file
@@ -1,16 +1,18 @@
-import bz2
-import hashlib
 import os
-import pickle
 import sys
 import threading
 import time
-from PIL import Image, ImageOps
+from collections import OrderedDict
+from PIL import Image
 import cv2
 from StreamDeck.ImageHelpers import PILHelper
-import indexed_bzip2 as ibz2
 from loguru import logger as log
 
+# Import own modules
+from src.backend.DeckManagement.Subclasses.tile_container import TileContainer, TileContainerWriter, open_container
+from src.backend.DeckManagement.VideoCacheBudget import get_image_size
+from src.backend.DeckManagement.Subclasses.tiling import DeckTiler, fit_array
+
 import globals as gl
 
 VID_CACHE = os.path.join(gl.DATA_PATH, "cache", "videos")
@@ -30,8 +32,8 @@ class BackgroundVideoCache:
         self.cap = cv2.VideoCapture(video_path)
         self.n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.cache = {}
-        self.last_decoded_frame = None
-        self.last_frame_index = -1
+        # Index of the frame the capture returns on the next read
+        self.cap_position = 0
 
         self.video_md5 = self.get_video_hash()
 
@@ -40,11 +42,18 @@ class BackgroundVideoCache:
         self.key_count = self.deck_controller.deck.key_count()
         self.key_size = self.deck_controller.deck.key_image_format()['size']
         self.spacing = self.deck_controller.spacing
+        self.tiler = DeckTiler(self.key_layout, self.key_size, self.spacing)
+
+        # Writes the decoded tiles to disk while the video plays for the first time
+        self.writer: TileContainerWriter = None
+        self.written_frames: set[int] = set()
 
-        self.cache_stored = False
+        # The decoded tiles in memory count towards the shared video cache budget
+        gl.video_cache_budget.register(self, os.path.basename(video_path))
 
-        thread = threading.Thread(target=self.load_cache, name="load_video_cache")
-        thread.start()
+        # mmaped tiles from a previous run - opening it is cheap, the tiles are paged in on access
+        self.container: TileContainer = None
+        self.load_cache()
 
         if self.is_cache_complete():
             log.info("Cache is complete. Closing the video capture.")
@@ -54,157 +63,341 @@ class BackgroundVideoCache:
 
         self.do_caching = gl.settings_manager.get_app_settings().get("performance", {}).get("cache-videos", True)
 
+        # Pre-encoded device-native tiles, indexed by (frame, key) - steady-state playback is then just usb writes
+        self.native_cache: dict[tuple[int, int], bytes] = {}
+        self.do_native_caching = self.do_caching and gl.settings_manager.get_app_settings().get("performance", {}).get("cache-native-video-tiles", True)
+
+        # Frames decoded ahead of the playback position, the render tick only takes ready frames from here
+        self.ring: OrderedDict[int, list[Image.Image]] = OrderedDict()
+        self.ring_size: int = max(1, int(gl.settings_manager.get_app_settings().get("performance", {}).get("video-decode-ahead", 15)))
+        self.condition = threading.Condition(self.lock)
+        # Frame the playback wants next
+        self.playback_frame: int = 0
+        # Last frame that was handed out, used if the requested one is not decoded yet
+        self.last_ready: tuple[int, list[Image.Image]] = None
+
+        self.decoder_running = False
+        self.decoder_thread: threading.Thread = None
+        # Set in close(), the decoder is not started again afterwards
+        self.closed = False
+        if not self.is_cache_complete():
+            with self.lock:
+                self.start_decoder()
+
+    def start_decoder(self) -> None:
+        """
+        Must be called while holding self.lock
+        """
+        if self.decoder_running or self.closed:
+            return
+        self.decoder_running = True
+        self.decoder_thread = threading.Thread(target=self.decode_ahead, name="video_decode_ahead", daemon=True)
+        self.decoder_thread.start()
+
+    def stop_decoder(self) -> None:
+        with self.condition:
+            self.decoder_running = False
+            self.condition.notify_all()
+        if self.decoder_thread is not None and self.decoder_thread is not threading.current_thread():
+            # Wait for the decoder to really be done, it might still write to the cache and the container
+            self.decoder_thread.join()
+
     def get_tiles(self, n):
-        n = min(n, self.n_frames - 1)
-        with self.lock:
-            if self.is_cache_complete():
-                self.release()
-                return self.cache.get(n, None)
-
-            # Otherwise, continue with video capture
-            # Check if the frame is already decoded
-            if n in self.cache:
-                return self.cache[n]
-
-            # If the requested frame is before the last decoded one, reset the capture
-            if n < self.last_frame_index:
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, n)
-                self.last_frame_index = n - 1
-
-            # Decode frames until the nth frame
-            while self.last_frame_index < n:
-                success, frame = self.cap.read()
-                if not success:
-                    break  # Reached the end of the video
-                self.last_frame_index += 1
-                
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  
-                pil_image = Image.fromarray(frame_rgb)
-
-                # Resize the image
-                full_sized = self.create_full_deck_sized_image(pil_image)
-
-                tiles: list[Image.Image] = []
-                for key in range(self.key_count):
-                    current_tiles = self.crop_key_image_from_deck_sized_image(full_sized, key)
-                    tiles.append(current_tiles)
-
-                    if n >= self.n_frames - 1:
-                        self.save_cache_threaded()
+        return self.get_ready_tiles(n)[1]
+
+    def get_ready_tiles(self, n: int) -> tuple[int, list[Image.Image]]:
+        """
+        Returns the index and the tiles of frame n, or of the last ready frame if the decoder didn't reach n yet.
+        Never decodes in the calling thread, apart from waiting for the very first frame.
+        """
+        n = max(0, min(n, self.n_frames - 1))
+        if self.container is not None:
+            return n, self.container.get_frame(n)
+        
+        # Check if the frame is already decoded
+        tiles = self.cache.get(n)
+        if tiles is not None:
+            gl.video_cache_budget.touch(self, ("tiles", n))
+            self.last_ready = (n, tiles)
+            return n, tiles
+
+        with self.condition:
+            if self.container is not None:
+                # The container got completed while waiting for the lock
+                return n, self.container.get_frame(n)
+            
+            tiles = self.ring.get(n)
+            if tiles is None and not self.decoder_running:
+                # Frames got evicted after the decoder finished, decode them again
+                self.start_decoder()
+            if self.playback_frame != n:
+                self.playback_frame = n
+                # Frames behind the playback position are not needed anymore
+                self.drop_played_frames()
+                self.condition.notify_all()
+            
+            if tiles is None and self.last_ready is None:
+                # Nothing to show yet, wait for the first frame
+                self.condition.wait_for(lambda: n in self.ring or n in self.cache or not self.decoder_running, timeout=2)
+                tiles = self.ring.get(n, self.cache.get(n))
+            
+            if tiles is not None:
+                self.last_ready = (n, tiles)
+
+        if self.last_ready is None:
+            return n, None
+        return self.last_ready
+    
+    def get_frames_ahead(self, frame: int) -> int:
+        """
+        Distance of the frame from the playback position, wrapping around at the end of the video
+        """
+        return (frame - self.playback_frame) % max(self.n_frames, 1)
+
+    def drop_played_frames(self) -> None:
+        """
+        Must be called while holding self.lock
+        """
+        for frame in list(self.ring):
+            if self.get_frames_ahead(frame) >= self.ring_size:
+                del self.ring[frame]
+
+    def get_next_frame_to_decode(self) -> int:
+        """
+        First frame from the playback position on that is neither in the ring nor in the cache, None if the ring is full
+        Must be called while holding self.lock
+        """
+        for i in range(min(self.ring_size, self.n_frames)):
+            frame = (self.playback_frame + i) % self.n_frames
+            if frame not in self.ring and frame not in self.cache:
+                return frame
+
+    def decode_ahead(self) -> None:
+        """
+        Decodes, resizes and tiles the frames ahead of the playback position
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.decoder_running or self.container is not None or self.get_next_frame_to_decode() is not None, timeout=0.5)
+                if not self.decoder_running or self.container is not None:
+                    break
+                frame_index = self.get_next_frame_to_decode()
+                if frame_index is None:
+                    continue
+
+            tiles = self.decode_frame(frame_index)
+
+            with self.condition:
+                if tiles is None:
+                    # The reported frame count was too high, don't try to decode the missing frames again
+                    log.warning(f"Could not decode frame {frame_index} of {self.video_path}, video has {frame_index} frames")
+                    self.truncate(max(1, frame_index))
+                    self.condition.notify_all()
+                    if self.is_cache_complete():
+                        break
+                    continue
+
+                self.ring[frame_index] = tiles
+                if self.get_frames_ahead(frame_index) >= self.ring_size:
+                    # Playback moved on while decoding
+                    del self.ring[frame_index]
 
                 if self.do_caching:
-                    self.cache[self.last_frame_index] = tiles
+                    self.cache[frame_index] = tiles
+                    self.write_frame(frame_index, tiles)
+                self.condition.notify_all()
 
-                full_sized.close()
-                pil_image.close()
+            if self.do_caching:
+                gl.video_cache_budget.add(self, ("tiles", frame_index), sum(get_image_size(tile) for tile in tiles))
 
+            if self.is_cache_complete():
+                break
 
-        # Return the last decoded frame if the nth frame is not available
-        return self.cache.get(n, tiles)
-    
-    def create_full_deck_sized_image(self, frame: Image.Image) -> Image.Image:
-        key_width *= self.key_layout[0]
-        key_height *= self.key_layout[1]
-
-        # Compute the total number of extra non-visible pixels that are obscured by
-        # the bezel of the StreamDeck.
-        spacing_x *= self.key_layout[0] - 1
-        spacing_y *= self.key_layout[1] - 1
-
-        # Compute final full deck image size, based on the number of buttons and
-        # obscured pixels.
-        full_deck_image_size = (key_width + spacing_x, key_height + spacing_y)
-
-        # Resize the image to suit the StreamDeck's full image size. We use the
-        # helper function in Pillow's ImageOps module so that the image's aspect
-        # ratio is preserved.
-        return ImageOps.fit(frame, full_deck_image_size, Image.Resampling.HAMMING)
-    
-    def crop_key_image_from_deck_sized_image(self, image: Image.Image, key):
-        # deck = self.deck_controller.deck
-        key_rows, key_cols = self.key_layout
-        key_width, key_height = self.key_size
-        spacing_x, spacing_y = self.spacing
+        with self.condition:
+            self.decoder_running = False
+            # The capture gets opened again if evicted frames are needed
+            self.cap.release()
+            self.condition.notify_all()
 
-        # Determine which row and column the requested key is located on.
-        row = key // key_cols
-        col = key % key_cols
+    def truncate(self, n_frames: int) -> None:
+        """
+        Shrinks the video to n_frames frames, the container on disk gets finished with the actual frame count
+        Must be called while holding self.lock
+        """
+        self.n_frames = n_frames
+        self.playback_frame = min(self.playback_frame, self.n_frames - 1)
+        for frame in [frame for frame in self.ring if frame >= n_frames]:
+            del self.ring[frame]
+        for frame in [frame for frame in self.cache if frame >= n_frames]:
+            del self.cache[frame]
+            gl.video_cache_budget.remove(self, ("tiles", frame))
+
+        self.written_frames = {frame for frame in self.written_frames if frame < n_frames}
+        if self.writer is not None:
+            self.writer.truncate(n_frames)
+            # The missing frame might have been the last one that was not written yet
+            self.finish_container()
+
+    def decode_frame(self, frame_index: int) -> list[Image.Image]:
+        """
+        Only called from the decoder thread, which owns the capture
+        """
+        if not self.cap.isOpened():
+            self.cap = cv2.VideoCapture(self.video_path)
+            self.cap_position = 0
 
-        # Compute the starting X and Y offsets into the full size image that the
-        # requested key should display.
-        start_x = col * (key_width + spacing_x)
-        start_y = row * (key_height + spacing_y)
+        if frame_index != self.cap_position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
 
-        # Compute the region of the larger deck image that is occupied by the given
-        # key, and crop out that segment of the full image.
-        region = (start_x, start_y, start_x + key_width, start_y + key_height)
-        segment = image.crop(region)
+        success, frame = self.cap.read()
+        if not success:
+            self.cap_position = -1
+            return
+        self.cap_position = frame_index + 1
+
+        # Scale the frame down to deck size right away, the color conversion and tiling then only touch the small frame
+        deck_sized = fit_array(frame, self.tiler.deck_image_size)
+        deck_sized = self.tiler.to_rgba(deck_sized, cv2.COLOR_BGR2RGBA)
 
-        # Create a new key-sized image, and paste in the cropped section of the
-        # larger image.
+        tiles = self.tiler.get_tiles(deck_sized)
 
-        return segment
+        return tiles
+    
+    def evict(self, entry: tuple) -> None:
+        """
+        Called by the video cache budget - no lock needed, the frames just get decoded again if needed
+        """
+        kind, key = entry
+        if kind == "tiles":
+            self.cache.pop(key, None)
+        elif kind == "native":
+            self.native_cache.pop(key, None)
+    
+    def get_key_tile(self, n: int, key: int) -> tuple[Image.Image, bytes]:
+        """
+        Returns the tile of the given key in frame n and its native version, both from the same frame even if the decoder is behind
+        """
+        n = max(0, min(n, self.n_frames - 1))
+        container = self.container
+        if container is not None:
+            # Only the view of this key instead of the whole frame
+            tile = container.get_tile(n, key)
+        else:
+            # Might be an older frame if the decoder is behind
+            n, tiles = self.get_ready_tiles(n)
+            tile = None if tiles is None else tiles[key]
+        if tile is None:
+            return None, None
+
+        native = self.encode_native_tile(n, key, tile)
+        if container is None:
+            # The decoded tiles get closed with the cache, the views into the container don't
+            tile = tile.copy()
+        return tile, native
+
+    def encode_native_tile(self, n: int, key: int, tile: Image.Image) -> bytes:
+        """
+        Returns the tile of the given key in frame n in the native format of the deck
+        """
+        native = self.native_cache.get((n, key))
+        if native is not None:
+            gl.video_cache_budget.touch(self, ("native", (n, key)))
+            return native
+        
+        native = PILHelper.to_native_key_format(self.deck_controller.deck, tile.convert("RGB"))
+        if self.do_native_caching:
+            self.native_cache[(n, key)] = native
+            gl.video_cache_budget.add(self, ("native", (n, key)), len(native))
+        return native
 
     def release(self):
         with self.lock:
             self.cap.release()
 
     def get_video_hash(self) -> str:
-        sha1sum = hashlib.md5()
-        with open(self.video_path, 'rb') as video:
-            block = video.read(2**16)
-            while len(block) != 0:
-                sha1sum.update(block)
-                block = video.read(2**16)
-            return sha1sum.hexdigest()
-        
-    def save_cache_threaded(self):
-        t = threading.Thread(target=self.save_cache, name="save_video_cache")
-        t.start()
+        return gl.fingerprint_manager.get_fingerprint(self.video_path)
         
-    def save_cache(self):
+    def get_cache_path(self) -> str:
+        return os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}-{self.key_size[0]}x{self.key_size[1]}.tiles")
+
+    def write_frame(self, frame: int, tiles: list[Image.Image]) -> None:
         """
-        Store cache using pickle
+        Appends the tiles to the container on disk. Once all frames are written the tiles are served from the container.
+        Must be called while holding self.lock
         """
-        if self.cache_stored:
+        if frame in self.written_frames:
+            return
+        try:
+            if self.writer is None:
+                self.writer = TileContainerWriter(self.get_cache_path(), self.key_size, self.n_frames, self.key_count)
+            self.writer.add_frame(frame, tiles)
+            self.written_frames.add(frame)
+        except (OSError, ValueError) as e:
+            self.abort_container(e)
             return
-        self.cache_stored = True
-        
-        start = time.time()
-        cache_path = os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}.cache")
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-
-        data = self.cache.copy()
 
-        with bz2.open(cache_path, "wb") as f:
-            pickle.dump(data, f)
+        self.finish_container()
 
-        log.success(f"Saved cache in {time.time() - start:.2f} seconds")
-        self.last_save = time.time()
-        del data
+    def finish_container(self) -> None:
+        """
+        Finishes the container once all frames are written and serves the tiles from it from then on
+        Must be called while holding self.lock
+        """
+        if self.writer is None or len(self.written_frames) < self.n_frames:
+            return
+        try:
+            start = time.time()
+            self.writer.finish()
+            self.writer = None
+            log.success(f"Saved cache in {time.time() - start:.2f} seconds")
+        except (OSError, ValueError) as e:
+            self.abort_container(e)
+            return
 
+        # Serve the tiles from the file from now on, this frees the decoded tiles
+        container = open_container(self.get_cache_path(), self.key_size, self.n_frames, self.key_count)
+        if container is not None and container.is_complete():
+            self.use_container(container)
 
-    def load_cache(self, key_index: int = None):
-        return
-        cache_path = os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}.cache")
-        if not os.path.exists(cache_path):
-            return
-        
-        # with open(os.path.join(VID_CACHE, "3x5", f"{self.video_md5}.pkl"), "rb") as f:
-            # self.cache = pickle.load(f)
-        
-        # return
+    def abort_container(self, error: Exception) -> None:
+        """
+        Must be called while holding self.lock
+        """
+        log.error(f"Failed to save cache: {error}")
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        # Don't try again for this video
+        self.written_frames = set(range(self.n_frames))
+
+    def load_cache(self):
         _time = time.time()
-        try:
-            with ibz2.open(cache_path, parallelization=os.cpu_count()) as f:
-                self.cache = pickle.load(f)
-            log.success(f"Loaded cache in {time.time() - _time:.2f} seconds")
-        except Exception as e:
-            os.remove(cache_path)
-            log.error(f"Failed to load cache: {e}")
+        # The container has less frames than reported if the reported frame count of the video was too high
+        container = open_container(self.get_cache_path(), self.key_size, self.n_frames, self.key_count, allow_truncated=True)
+        if container is None:
             return
+        if not container.is_complete():
+            container.close()
+            return
+
+        with self.lock:
+            self.n_frames = container.n_frames
+            self.use_container(container)
+        log.success(f"Loaded cache in {time.time() - _time:.2f} seconds")
+
+    def use_container(self, container: TileContainer) -> None:
+        """
+        Must be called while holding self.lock
+        """
+        self.container = container
+        # The decoded tiles might still be in use by a render, so just drop them
+        self.cache = {}
+        for frame in range(self.n_frames):
+            gl.video_cache_budget.remove(self, ("tiles", frame))
 
     def is_cache_complete(self) -> bool:
+        if self.container is not None:
+            return True
         if self.n_frames != len(self.cache):
             return False
         
@@ -216,8 +409,17 @@ class BackgroundVideoCache:
     
     def close(self) -> None:
         import gc
+        with self.lock:
+            self.closed = True
+        self.stop_decoder()
         self.release()
 
+        gl.video_cache_budget.unregister(self)
+        with self.lock:
+            if self.writer is not None:
+                self.writer.abort()
+                self.writer = None
+
         for n in self.cache:
             for f in self.cache[n]:
                 # ref = gc.get_referrers(f)
@@ -227,7 +429,12 @@ class BackgroundVideoCache:
                 f = None
 
 
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
         self.cache = None
+        self.native_cache = {}
         del self.cache
         del self.cap
         gc.collect()
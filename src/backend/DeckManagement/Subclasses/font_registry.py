@@ -0,0 +1,63 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Process wide cache of the fonts used for the labels.
+This module is imported by the render worker processes, so it must not import gtk or globals.
+"""
+# Import Python modules
+import threading
+from PIL import ImageFont
+
+class FontRegistry:
+    """
+    Resolves font families to paths and loads each font in each size only once.
+    matplotlib is only imported when a family is resolved for the first time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # family -> path
+        self.paths: dict[str, str] = {}
+        # FreeType faces must not be used by multiple threads at the same time, so every render thread gets its own fonts
+        self.local = threading.local()
+
+    def get_font_path(self, family: str) -> str:
+        path = self.paths.get(family)
+        if path is not None:
+            return path
+
+        import matplotlib.font_manager
+        with self.lock:
+            path = matplotlib.font_manager.findfont(matplotlib.font_manager.FontProperties(family=family))
+            self.paths[family] = path
+        return path
+
+    def get_font(self, path: str, size: int) -> ImageFont.FreeTypeFont:
+        fonts: dict[tuple[str, int], ImageFont.FreeTypeFont] = getattr(self.local, "fonts", None)
+        if fonts is None:
+            fonts = {}
+            self.local.fonts = fonts
+
+        font = fonts.get((path, size))
+        if font is None:
+            font = ImageFont.truetype(path, size)
+            fonts[(path, size)] = font
+        return font
+
+    def warm_up(self) -> None:
+        """
+        Resolves the default font. The first lookup builds matplotlib's font list, which takes a while.
+        """
+        self.get_font_path(None)
+
+font_registry = FontRegistry()
@@ -0,0 +1,253 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Pure compositing functions for key images.
+This module is imported by the render worker processes (see render_worker), so it must not import gtk or globals.
+"""
+# Import Python modules
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps, ImageDraw
+
+# Import own modules
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+
+def create_background(size: tuple[int], tile: Image.Image, background_color: list[int]) -> Image.Image:
+    background: Image.Image = None
+    # Only load the background image if it's not gonna be hidden by the background color
+    if background_color[-1] < 255 and tile is not None:
+        background = tile.copy()
+
+    if background_color[-1] > 0:
+        background_color_img = Image.new("RGBA", size, color=tuple(background_color))
+
+        if background is None:
+            # Use the color as the only background - happens if background color alpha is 255
+            background = background_color_img
+        else:
+            background.paste(background_color_img, (0, 0), background_color_img)
+
+    if background is None:
+        background = Image.new("RGBA", size, (0, 0, 0, 0))
+
+    return background
+
+def get_foreground_size(background_size: tuple[int], size: float = 1) -> tuple[int]:
+    return (int(background_size[0] * size), int(background_size[1] * size))
+
+def is_fitted(foreground: Image.Image, img_size: tuple[int], fill_mode: str) -> bool:
+    """
+    Whether the foreground already has the size fit_foreground would scale it to
+    """
+    width, height = foreground.size
+    if fill_mode == "contain":
+        return (width == img_size[0] and height <= img_size[1]) or (height == img_size[1] and width <= img_size[0])
+    if fill_mode == "cover":
+        # Covered images can be bigger than img_size in one direction
+        return (width == img_size[0] and height >= img_size[1]) or (height == img_size[1] and width >= img_size[0])
+    return foreground.size == tuple(img_size)
+
+def fit_foreground(foreground: Image.Image, background_size: tuple[int], fill_mode: str = "cover", size: float = 1) -> Image.Image:
+    """
+    Scales the foreground like it gets pasted onto a background of the given size.
+    Already fitted images (e.g. pre-scaled gif frames) are returned as they are.
+    """
+    img_size = get_foreground_size(background_size, size) # Calculate scaled size of the image
+    if is_fitted(foreground, img_size, fill_mode):
+        return foreground
+
+    if fill_mode == "stretch":
+        return foreground.resize(img_size, Image.Resampling.HAMMING)
+
+    elif fill_mode == "cover":
+        return ImageOps.cover(foreground, img_size, Image.Resampling.HAMMING)
+
+    elif fill_mode == "contain":
+        return ImageOps.contain(foreground, img_size, Image.Resampling.HAMMING)
+
+def paste_foreground(background: Image.Image, foreground: Image.Image, fill_mode: str = "cover", size: float = 1,
+                     valign: float = 0, halign: float = 0) -> Image.Image:
+    img_size = get_foreground_size(background.size, size)
+    foreground_resized = fit_foreground(foreground, background.size, fill_mode, size)
+
+    left_margin = int((background.width - img_size[0]) * (halign + 1) / 2)
+    top_margin = int((background.height - img_size[1]) * (valign + 1) / 2)
+
+    if foreground.mode == "RGBA":
+        background.paste(foreground_resized, (left_margin, top_margin), foreground_resized)
+    else:
+        background.paste(foreground_resized, (left_margin, top_margin))
+
+    return background
+
+def draw_labels(image: Image.Image, labels: list[tuple]) -> Image.Image:
+    """
+    labels: list of (position, text, font_path, font_size, color, font_weight)
+    """
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = "1" # Anti-aliased - this prevents frayed/noisy labels on the deck
+
+    for label, text, font_path, font_size, color, font_weight in labels:
+        if text in [None, ""]:
+            continue
+        font = font_registry.get_font(font_path, font_size)
+
+        if label == "top":
+            position = (image.width / 2, font_size*1.125)
+
+        if label == "center":
+            position = (image.width / 2, (image.height + font_size) / 2 - 3)
+
+        if label == "bottom":
+            position = (image.width / 2, image.height*0.875)
+
+        draw.text(position,
+                    text=text, font=font, anchor="ms",
+                    fill=tuple(color), stroke_width=font_weight)
+
+    draw = None
+    del draw
+
+    return image
+
+def render_label_overlay(size: tuple[int], labels: list[tuple]) -> Image.Image:
+    """
+    Draws the labels onto a transparent image that can be composited onto every frame of the key
+    """
+    return draw_labels(Image.new("RGBA", tuple(size), (0, 0, 0, 0)), labels)
+
+def composite_label_overlay(image: Image.Image, overlay: Image.Image) -> Image.Image:
+    if overlay is None:
+        return image
+    if image.mode == "RGBA" and image.size == overlay.size:
+        image.alpha_composite(overlay)
+    else:
+        image.paste(overlay, (0, 0), overlay)
+    return image
+
+# Label overlays rendered in this process, by size and label content
+LABEL_OVERLAY_CACHE_SIZE = 256
+label_overlays: OrderedDict[tuple, Image.Image] = OrderedDict()
+label_overlays_lock = threading.Lock()
+
+def get_label_overlay(size: tuple[int], labels: list[tuple]) -> Image.Image:
+    """
+    Returns the cached overlay of the labels, None if there is nothing to draw
+    """
+    labels = tuple(label for label in labels if label[1] not in [None, ""])
+    if len(labels) == 0:
+        return
+    
+    overlay_key = (tuple(size), labels)
+    with label_overlays_lock:
+        overlay = label_overlays.get(overlay_key)
+        if overlay is not None:
+            label_overlays.move_to_end(overlay_key)
+            return overlay
+
+    overlay = render_label_overlay(size, labels)
+    with label_overlays_lock:
+        label_overlays[overlay_key] = overlay
+        while len(label_overlays) > LABEL_OVERLAY_CACHE_SIZE:
+            label_overlays.popitem(last=False)
+    return overlay
+
+class KeyCanvas:
+    """
+    Reusable buffers of one key. Every render is written into the same RGBA image in place,
+    the encoder input is written into the same RGB image. Only the consumers that keep the result get a copy.
+    Not thread safe - the caller has to make sure only one render of the key runs at a time.
+    """
+    def __init__(self, size: tuple[int]):
+        self.size = tuple(size)
+        # Number of images allocated by this canvas, to measure the allocations of the render pipeline
+        self.allocations: int = 0
+
+        self.image = self.new_image("RGBA")
+        self.encoder_input: Image.Image = None
+        self.shrunk: Image.Image = None
+
+        # Background color layer, only created again if the color changes
+        self.color: tuple[int] = None
+        self.color_image: Image.Image = None
+
+    def new_image(self, mode: str, color: tuple[int] = (0, 0, 0, 0)) -> Image.Image:
+        self.allocations += 1
+        return Image.new(mode, self.size, color)
+
+    def draw_background(self, tile: Image.Image, background_color: list[int]) -> Image.Image:
+        """
+        Same as create_background, but draws into the canvas
+        """
+        # Only load the background image if it's not gonna be hidden by the background color
+        if background_color[-1] < 255 and tile is not None:
+            if tile.mode != self.image.mode or tile.size != self.size:
+                # paste() would convert it into a temporary image
+                self.allocations += 1
+            self.image.paste(tile, (0, 0))
+
+            if background_color[-1] > 0:
+                if self.color != tuple(background_color):
+                    self.color = tuple(background_color)
+                    self.color_image = self.new_image("RGBA", self.color)
+                self.image.paste(self.color_image, (0, 0), self.color_image)
+        elif background_color[-1] > 0:
+            # Use the color as the only background - happens if background color alpha is 255 or there is no tile
+            self.image.paste(tuple(background_color), (0, 0, *self.size))
+        else:
+            self.image.paste((0, 0, 0, 0), (0, 0, *self.size))
+
+        return self.image
+
+    def get_encoder_input(self, image: Image.Image) -> Image.Image:
+        """
+        Writes the image into the RGB buffer the native encoder reads - same as image.convert("RGB")
+        """
+        if self.encoder_input is None:
+            self.encoder_input = self.new_image("RGB", (0, 0, 0))
+        if image.size != self.size:
+            self.allocations += 1
+            return image.convert("RGB")
+        self.encoder_input.paste(image, (0, 0))
+        return self.encoder_input
+
+    def shrink(self, image: Image.Image, factor: float = 0.7) -> Image.Image:
+        """
+        Same as shrink_image, but draws into a buffer of the canvas
+        """
+        if self.shrunk is None:
+            self.shrunk = self.new_image("RGBA")
+        width = int(image.width * factor)
+        height = int(image.height * factor)
+        shrunk = image.resize((width, height))
+        self.allocations += 1
+
+        self.shrunk.paste((0, 0, 0, 0), (0, 0, *self.size))
+        self.shrunk.paste(shrunk, (int((image.width - width) / 2), int((image.height - height) / 2)))
+        shrunk.close()
+
+        return self.shrunk
+
+def shrink_image(image: Image.Image, factor: float = 0.7) -> Image.Image:
+    width = int(image.width * factor)
+    height = int(image.height * factor)
+    shrunk = image.resize((width, height))
+
+    background = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    background.paste(shrunk, (int((image.width - width) / 2), int((image.height - height) / 2)))
+
+    shrunk.close()
+
+    return background
+
@@ -0,0 +1,62 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+class KeyImageCache:
+    """
+    Bounded LRU cache for fully composited key images and their native (device) format.
+    Entries are keyed by a hashable description of all render inputs (see ControllerKey.get_render_key)
+    Cached images are shared, so they must never be modified in place.
+    """
+    def __init__(self, max_size: int = 256):
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.cache: OrderedDict[tuple, tuple[Image.Image, bytes]] = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, render_key: tuple) -> tuple[Image.Image, bytes]:
+        if render_key is None:
+            return
+        with self.lock:
+            entry = self.cache.get(render_key)
+            if entry is None:
+                self.misses += 1
+                return
+            self.hits += 1
+            self.cache.move_to_end(render_key)
+            return entry
+        
+    def put(self, render_key: tuple, image: Image.Image, native_image: bytes) -> None:
+        if render_key is None or self.max_size <= 0:
+            return
+        with self.lock:
+            self.cache[render_key] = (image, native_image)
+            self.cache.move_to_end(render_key)
+
+            # Remove least recently used entries
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+
+    def __len__(self) -> int:
+        return len(self.cache)
@@ -1,15 +1,20 @@
-from functools import lru_cache
-import hashlib
 import os
 import sys
 import threading
 import time
-from PIL import Image, ImageOps
+import weakref
+from PIL import Image
 import cv2
 from loguru import logger as log
 import globals as gl
 
-VID_CACHE = "vid_cache"
+# Import own modules
+from src.backend.DeckManagement.VideoCacheBudget import get_image_size
+from src.backend.DeckManagement.Subclasses.tile_container import TileContainer, TileContainerWriter, open_container
+from src.backend.DeckManagement.Subclasses.tiling import fit_array
+
+VID_CACHE = os.path.join(gl.DATA_PATH, "cache", "key_videos")
+os.makedirs(VID_CACHE, exist_ok=True)
 
 class VideoFrameCache:
     def __init__(self, video_path):
@@ -26,6 +31,16 @@ class VideoFrameCache:
 
         self.frame_width: int = 72
 
+        # The decoded frames in memory count towards the shared video cache budget
+        gl.video_cache_budget.register(self, os.path.basename(video_path))
+
+        # Writes the decoded frames to disk while the video plays for the first time
+        self.writer: TileContainerWriter = None
+        self.writer_finalizer: weakref.finalize = None
+        self.written_frames: set[int] = set()
+
+        # All frames in one mmaped file - opening it is cheap, the frames are paged in on access
+        self.container: TileContainer = None
         self.load_cache()
 
         self.do_caching = gl.settings_manager.get_app_settings().get("performance", {}).get("cache-videos", True)
@@ -37,20 +52,24 @@ class VideoFrameCache:
         else:
             log.info("Cache is not complete. Continuing with video capture.")
 
-        # Print size of cache in memory in mb:
-        log.trace(f"Size of cache in memory: {sys.getsizeof(self.cache) / 1024 / 1024:.2f} MB")
-
         log.trace(f"Size of capture: {sys.getsizeof(self.cap) / 1024 / 1024:.2f} MB")
 
     def get_frame(self, n):
         n = min(n, self.n_frames - 1)
-        if self.is_cache_complete():
-            return self.cache.get(n, None)
+        if self.container is not None:
+            return self.container.get_tile(n, 0)
 
-        # Otherwise, continue with video capture
         # Check if the frame is already decoded
-        if n in self.cache:
-            return self.cache[n]
+        frame = self.cache.get(n)
+        if frame is not None:
+            gl.video_cache_budget.touch(self, n)
+            return frame
+
+        with self.lock:
+            if not self.cap.isOpened():
+                # Frames got evicted after the capture was closed, decode them again
+                self.cap = cv2.VideoCapture(self.video_path)
+                self.last_frame_index = -1
 
         # If the requested frame is before the last decoded one, reset the capture
         if n < self.last_frame_index:
@@ -65,80 +84,97 @@ class VideoFrameCache:
             if not success:
                 break  # Reached the end of the video
             self.last_frame_index += 1
-            
-            # Calculate the new height to maintain aspect ratio
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(frame_rgb)
 
             # Fill a 72x72 square completely with the image, keeping the aspect ratio
-            pil_image = ImageOps.fit(pil_image, (self.frame_width, self.frame_width), Image.Resampling.LANCZOS)
+            # Scaling before the color conversion keeps the full sized frame out of PIL
+            frame = fit_array(frame, (self.frame_width, self.frame_width))
+            pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
 
             self.last_decoded_frame = pil_image
             if self.do_caching:
                 self.cache[self.last_frame_index] = pil_image
+                gl.video_cache_budget.add(self, self.last_frame_index, get_image_size(pil_image))
+
+                # Write the frame to the cache
+                self.write_frame(pil_image, self.last_frame_index)
+
+        if self.container is not None:
+            return self.container.get_tile(n, 0)
 
-            # Write the frame to the cache
-            self.write_cache(pil_image, self.last_frame_index)
+        if self.cap.isOpened() and self.is_cache_complete():
+            self.release()
 
-        # Return the last decoded frame if the nth frame is not available
         return self.cache.get(n, self.last_decoded_frame)
 
+    def evict(self, n: int) -> None:
+        """
+        Called by the video cache budget, the frame gets decoded again if needed
+        """
+        self.cache.pop(n, None)
+
     def release(self):
         with self.lock:
             self.cap.release()
 
     def get_video_hash(self) -> str:
-        with self.lock:
-            sha1sum = hashlib.md5()
-            with open(self.video_path, 'rb') as video:
-                block = video.read(2**16)
-                while len(block) != 0:
-                    sha1sum.update(block)
-                    block = video.read(2**16)
-                return sha1sum.hexdigest()
-
-    def write_cache(self, image: Image, frame_index: int, key_index: int = None):
+        return gl.fingerprint_manager.get_fingerprint(self.video_path)
+
+    def get_cache_path(self) -> str:
+        return os.path.join(VID_CACHE, f"{self.video_md5}-{self.frame_width}x{self.frame_width}.tiles")
+
+    def write_frame(self, image: Image.Image, frame_index: int):
         """
-        key_index: if None: single key video, if int: key index
+        Appends the frame to the packed cache file. Once all frames are written the frames are served from the file.
         """
         with self.lock:
-            if key_index is None:
-                path = os.path.join(VID_CACHE, "single_key", self.video_md5, f"{frame_index}.jpg")
-            else:
-                path = os.path.join(VID_CACHE, f"key: {key_index}", self.video_md5, f"{key_index}", f"{frame_index}.jpg")
+            if frame_index in self.written_frames:
+                return
+            try:
+                if self.writer is None:
+                    self.writer = TileContainerWriter(self.get_cache_path(), (self.frame_width, self.frame_width), self.n_frames, 1)
+                    # Don't leave half written files behind if the video gets removed before it played completely
+                    self.writer_finalizer = weakref.finalize(self, self.writer.abort)
+                self.writer.add_tile(frame_index, 0, image)
+                self.written_frames.add(frame_index)
+
+                if len(self.written_frames) < self.n_frames:
+                    return
 
-            if os.path.isfile(path):
+                self.writer_finalizer.detach()
+                self.writer.finish()
+                self.writer = None
+            except (OSError, ValueError) as e:
+                log.error(f"Failed to save cache: {e}")
+                if self.writer is not None:
+                    self.writer_finalizer.detach()
+                    self.writer.abort()
+                    self.writer = None
+                # Don't try again for this video
+                self.written_frames = set(range(self.n_frames))
                 return
-            
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            
-            image.save(path)
 
-    def load_cache(self, key_index: int = None):
+        # Serve the frames from the file from now on, this frees the decoded frames
+        self.load_cache()
+
+    def load_cache(self):
+        start = time.time()
+        container = open_container(self.get_cache_path(), (self.frame_width, self.frame_width), self.n_frames, 1)
+        if container is None:
+            return
+        if not container.is_complete():
+            container.close()
+            return
+
         with self.lock:
-            start = time.time()
-            if key_index is None:
-                path = os.path.join(VID_CACHE, "single_key", self.video_md5)
-                if not os.path.exists(path):
-                    return
-                for file in os.listdir(path):
-                    if os.path.splitext(file)[1] != ".jpg":
-                        continue
-                    with Image.open(os.path.join(path, file)) as img:
-                        self.cache[int(file.split(".")[0])] = img.copy()
-
-            else:
-                path = os.path.join(VID_CACHE, f"key: {key_index}", self.video_md5)
-                if not os.path.exists(path):
-                    return
-                for file in os.listdir(path):
-                    if os.path.splitext(file)[1] != ".jpg":
-                        continue
-                    with Image.open(os.path.join(path, file)) as img:
-                        self.cache[int(file.split(".")[0])] = img.copy()
+            self.container = container
+            # The decoded frames might still be in use by a render, so just drop them
+            self.cache = {}
+            for frame in range(self.n_frames):
+                gl.video_cache_budget.remove(self, frame)
 
-            log.info(f"Loaded cache in {time.time() - start:.2f} seconds")
+        log.info(f"Loaded cache in {time.time() - start:.2f} seconds")
 
-    @lru_cache(maxsize=None)
     def is_cache_complete(self) -> bool:
+        if self.container is not None:
+            return True
         return len(self.cache) == self.n_frames
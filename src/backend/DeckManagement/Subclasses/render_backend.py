@@ -0,0 +1,224 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import os
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from PIL import Image
+from StreamDeck.ImageHelpers import PILHelper
+from loguru import logger as log
+
+# Import own modules
+from src.backend.DeckManagement.Subclasses.key_compositor import shrink_image
+from src.backend.DeckManagement.Subclasses import render_worker
+from src.backend.DeckManagement.Subclasses.render_worker import init_worker, render_job
+
+# Import globals
+import globals as gl
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.DeckController import ControllerKey
+
+class ThreadRenderBackend:
+    """
+    Renders the keys in the calling thread - this is the default
+    """
+    def render(self, controller_key: "ControllerKey") -> tuple[Image.Image, bytes]:
+        deck_controller = controller_key.deck_controller
+        with controller_key.render_lock:
+            canvas = controller_key.get_canvas()
+            allocations = canvas.allocations
+
+            with gl.metrics_manager.measure(deck_controller.serial_number, controller_key.key, "composite"):
+                image = controller_key.render_to_canvas()
+            with gl.metrics_manager.measure(deck_controller.serial_number, controller_key.key, "native-encode"):
+                native_image = PILHelper.to_native_key_format(deck_controller.deck, canvas.get_encoder_input(image))
+
+            # The ui and the key image cache keep the image, the canvas gets overwritten by the next render
+            image = image.copy()
+            gl.metrics_manager.increment("image-allocations", canvas.allocations - allocations + 1)
+        gl.metrics_manager.increment("key-renders")
+        return image, native_image
+
+    def render_pressed(self, controller_key: "ControllerKey", image: Image.Image) -> tuple[Image.Image, bytes]:
+        """
+        Derives the pressed variant of the key from its unpressed composite instead of rendering the key again
+        """
+        deck_controller = controller_key.deck_controller
+        with controller_key.render_lock:
+            with gl.metrics_manager.measure(deck_controller.serial_number, controller_key.key, "press-transform"):
+                pressed = shrink_image(image)
+            with gl.metrics_manager.measure(deck_controller.serial_number, controller_key.key, "native-encode"):
+                native_image = PILHelper.to_native_key_format(deck_controller.deck, controller_key.get_canvas().get_encoder_input(pressed))
+        return pressed, native_image
+    
+    def close(self) -> None:
+        return
+
+class ProcessRenderBackend(ThreadRenderBackend):
+    """
+    Ships the render jobs of the keys to a pool of worker processes so that the compositing and encoding is not limited by the GIL.
+    The images are passed via shared memory, the rest of the job is a compact description of the key.
+    Every key has one segment that is reused by all of its jobs and only replaced if it is too small.
+    """
+    # Segments are allocated in steps of this size, so slightly bigger images don't need a new one
+    SEGMENT_STEP = 64 * 1024
+
+    def __init__(self, n_processes: int):
+        # Spawn instead of fork - forking a process with running gtk and usb threads is not safe
+        context = multiprocessing.get_context("spawn")
+        started = context.Barrier(n_processes)
+        self.pool = ProcessPoolExecutor(max_workers=n_processes, mp_context=context, initializer=init_worker, initargs=(started,))
+        self.broken = False
+
+        self.lock = threading.Lock()
+        # (deck serial, key index) -> segment
+        self.segments: dict[tuple[str, int], shared_memory.SharedMemory] = {}
+
+        self.start_workers(n_processes)
+
+    def start_workers(self, n_processes: int) -> None:
+        """
+        Starts all workers with render_worker as their main module. Otherwise spawn would import main.py and with it gtk in every worker.
+        """
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = render_worker
+        try:
+            # The workers wait for each other in their initializer, so none becomes idle and every submit starts a new one
+            futures = [self.pool.submit(render_worker.is_ready) for _ in range(n_processes)]
+        finally:
+            sys.modules["__main__"] = main_module
+        for future in futures:
+            future.result()
+
+    def render(self, controller_key: "ControllerKey") -> tuple[Image.Image, bytes]:
+        if self.broken:
+            return super().render(controller_key)
+        
+        # The segment of the key is written for every job, so only one job per key at a time
+        with controller_key.render_lock:
+            try:
+                job = self.create_job(controller_key)
+                mode, size, data, native_image, timings = self.pool.submit(render_job, job).result()
+            except BrokenProcessPool as e:
+                log.error(f"Render processes died, falling back to rendering in threads. Error: {e}")
+                self.broken = True
+                native_image = None
+        if native_image is None:
+            return super().render(controller_key)
+
+        # The stages ran in the worker, record the timings it measured
+        for stage, seconds in timings.items():
+            gl.metrics_manager.record(controller_key.deck_controller.serial_number, controller_key.key, stage, seconds)
+
+        return Image.frombytes(mode, size, data), native_image
+    
+    def create_job(self, controller_key: "ControllerKey") -> dict:
+        deck_controller = controller_key.deck_controller
+
+        tile = None
+        # Only ship the background tile if it's not gonna be hidden by the background color
+        if controller_key.background_color[-1] < 255:
+            tile = deck_controller.background.tiles[controller_key.key]
+
+        asset = controller_key.key_image or controller_key.key_video
+        foreground = None
+        media = None
+        if asset is not None:
+            foreground = asset.get_raw_image()
+            media = {
+                "fill-mode": asset.fill_mode,
+                "size": asset.size,
+                "valign": asset.valign,
+                "halign": asset.halign
+            }
+
+        tile_buffer, foreground_buffer = self.share_images(deck_controller.serial_number, controller_key.key, [tile, foreground])
+
+        return {
+            "size": deck_controller.get_key_image_size(),
+            "tile": tile_buffer,
+            "background-color": tuple(controller_key.background_color),
+            "foreground": foreground_buffer,
+            "media": media,
+            "labels": controller_key.get_label_list(),
+            "pressed": controller_key.is_pressed(),
+            "native-format": deck_controller.deck.key_image_format()
+        }
+    
+    def share_images(self, deck: str, key: int, images: list[Image.Image]) -> list[tuple]:
+        """
+        Writes the images one after another into the segment of the key and returns the references that are sent to the worker
+        """
+        data: list[tuple[bytes, str, tuple[int]]] = []
+        for image in images:
+            if image is None:
+                data.append(None)
+                continue
+            if image.mode not in ["RGB", "RGBA"]:
+                # Other modes get pasted without a mask, just like in the thread backend
+                image = image.convert("RGB")
+            data.append((image.tobytes(), image.mode, image.size))
+
+        segment = self.get_segment(deck, key, sum(len(entry[0]) for entry in data if entry is not None))
+
+        buffers = []
+        offset = 0
+        for entry in data:
+            if entry is None:
+                buffers.append(None)
+                continue
+            image_bytes, mode, size = entry
+            segment.buf[offset:offset + len(image_bytes)] = image_bytes
+            buffers.append((segment.name, offset, len(image_bytes), mode, size))
+            offset += len(image_bytes)
+        return buffers
+
+    def get_segment(self, deck: str, key: int, size: int) -> shared_memory.SharedMemory:
+        with self.lock:
+            segment = self.segments.get((deck, key))
+            if segment is not None and segment.size >= size:
+                return segment
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+
+            size = max(1, -(-size // self.SEGMENT_STEP)) * self.SEGMENT_STEP
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self.segments[(deck, key)] = segment
+            return segment
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+                segment.unlink()
+            self.segments.clear()
+
+def create_render_backend() -> ThreadRenderBackend:
+    settings = gl.settings_manager.get_app_settings().get("performance", {})
+    if settings.get("render-backend", "thread") == "process":
+        n_processes = int(settings.get("render-processes", max(1, (os.cpu_count() or 2) - 1)))
+        log.info(f"Using process render backend with {n_processes} processes")
+        return ProcessRenderBackend(n_processes=n_processes)
+    
+    return ThreadRenderBackend()
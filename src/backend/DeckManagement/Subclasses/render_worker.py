@@ -0,0 +1,114 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Entry module of the render worker processes. The workers are started with this module as their main module
+instead of main.py, so it must only import what the rendering needs - no gtk and no globals.
+"""
+# Import Python modules
+import signal
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from PIL import Image
+from StreamDeck.ImageHelpers import PILHelper
+
+# Import own modules
+from src.backend.DeckManagement.Subclasses.key_compositor import create_background, paste_foreground, composite_label_overlay, get_label_overlay, shrink_image
+
+# Segments stay attached between jobs, the main process reuses one segment per key
+MAX_ATTACHED_SEGMENTS = 256
+attached_segments: OrderedDict[str, shared_memory.SharedMemory] = OrderedDict()
+
+def init_worker(started: threading.Barrier = None) -> None:
+    """
+    Initializer of the worker processes
+    started: barrier the main process waits on until all workers are running
+    """
+    # Ctrl+C is handled by the main process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if started is not None:
+        try:
+            started.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+
+def is_ready() -> bool:
+    return True
+
+class NativeFormat:
+    """
+    Stands in for the deck in PILHelper calls inside the render workers
+    """
+    def __init__(self, key_image_format: dict):
+        self._key_image_format = key_image_format
+
+    def key_image_format(self) -> dict:
+        return self._key_image_format
+
+def get_segment(name: str) -> shared_memory.SharedMemory:
+    segment = attached_segments.get(name)
+    if segment is None:
+        # The segment is owned (and unlinked) by the main process
+        segment = shared_memory.SharedMemory(name=name)
+        attached_segments[name] = segment
+        # Segments of keys that got a bigger segment in the meantime are not used anymore
+        while len(attached_segments) > MAX_ATTACHED_SEGMENTS:
+            _, old_segment = attached_segments.popitem(last=False)
+            old_segment.close()
+    attached_segments.move_to_end(name)
+    return segment
+
+def read_shared_image(buffer: tuple) -> Image.Image:
+    """
+    buffer: (shared memory name, offset, length, mode, size) or None
+    """
+    if buffer is None:
+        return
+    name, offset, length, mode, size = buffer
+    segment = get_segment(name)
+    with segment.buf[offset:offset + length] as data:
+        # frombytes copies, so no view into the segment outlives this block
+        return Image.frombytes(mode, size, data)
+
+def render_job(job: dict) -> tuple[str, tuple[int], bytes, bytes, dict]:
+    """
+    Composites the key described by the job and encodes it into the native format of the deck.
+    Returns the mode, size and raw bytes of the composited image, the native image and the time spent in each stage.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    size = tuple(job["size"])
+    background = create_background(size, read_shared_image(job["tile"]), job["background-color"])
+
+    foreground = read_shared_image(job["foreground"])
+    if foreground is not None:
+        media = job["media"]
+        background = paste_foreground(background, foreground, media["fill-mode"], media["size"], media["valign"], media["halign"])
+
+    labels_start = time.perf_counter()
+    image = composite_label_overlay(background, get_label_overlay(size, job["labels"]))
+    timings["label-draw"] = time.perf_counter() - labels_start
+
+    if job["pressed"]:
+        image = shrink_image(image)
+    timings["composite"] = time.perf_counter() - start
+
+    encode_start = time.perf_counter()
+    native_image = PILHelper.to_native_key_format(NativeFormat(job["native-format"]), image.convert("RGB"))
+    timings["native-encode"] = time.perf_counter() - encode_start
+
+    return image.mode, image.size, image.tobytes(), bytes(native_image), timings
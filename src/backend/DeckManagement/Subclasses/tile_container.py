@@ -0,0 +1,177 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+On-disk container for the decoded tiles of videos.
+
+Layout (little endian):
+    header: magic, version, mode, tile width, tile height, number of frames, number of keys, offset of the index
+    data:   the raw pixel data of the tiles
+    index:  (offset, length) per (frame, key), length 0 marks a missing tile
+
+The file is mmaped for reading and the tiles are returned as zero-copy views, so the pixel data
+is only loaded by the kernel when needed and shared between all decks playing the same video.
+"""
+# Import Python modules
+import mmap
+import os
+import struct
+from PIL import Image
+from loguru import logger as log
+
+MAGIC = b"SCTC"
+VERSION = 1
+HEADER = struct.Struct("<4sH4sHHIIQ")
+INDEX_ENTRY = struct.Struct("<QI")
+
+# Modes that PIL can map without copying, see PIL.Image._MAPMODES
+MODE = "RGBA"
+
+class TileContainerError(Exception):
+    pass
+
+class TileContainerWriter:
+    """
+    Writes a container - the frames can be added in any order. The file only appears under its final path after finish()
+    """
+    def __init__(self, path: str, tile_size: tuple[int], n_frames: int, n_keys: int):
+        self.path = path
+        self.tile_size = tuple(tile_size)
+        self.n_frames = n_frames
+        self.n_keys = n_keys
+
+        self.index: list[tuple[int, int]] = [(0, 0)] * (n_frames * n_keys)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.tmp_path = f"{path}.{os.getpid()}-{id(self)}.tmp"
+        self.file = open(self.tmp_path, "wb")
+        # Placeholder, the index offset is only known at the end
+        self.file.write(HEADER.pack(MAGIC, VERSION, MODE.encode().ljust(4, b"\0"), *self.tile_size, n_frames, n_keys, 0))
+
+    def add_tile(self, frame: int, key: int, tile: Image.Image) -> None:
+        if tile.size != self.tile_size:
+            tile = tile.resize(self.tile_size)
+        if tile.mode != MODE:
+            tile = tile.convert(MODE)
+        data = tile.tobytes()
+        self.index[frame * self.n_keys + key] = (self.file.tell(), len(data))
+        self.file.write(data)
+
+    def add_frame(self, frame: int, tiles: list[Image.Image]) -> None:
+        for key, tile in enumerate(tiles):
+            if tile is not None:
+                self.add_tile(frame, key, tile)
+
+    def truncate(self, n_frames: int) -> None:
+        """
+        Drops all frames from n_frames on, e.g. if the video has less frames than it reported. Their data stays in the file but is never referenced.
+        """
+        n_frames = max(0, min(n_frames, self.n_frames))
+        self.index = self.index[:n_frames * self.n_keys]
+        self.n_frames = n_frames
+
+    def finish(self) -> None:
+        index_offset = self.file.tell()
+        self.file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, MODE.encode().ljust(4, b"\0"), *self.tile_size, self.n_frames, self.n_keys, index_offset))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class TileContainer:
+    """
+    Read only, mmaped view of a container file
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self.map) < HEADER.size:
+                raise TileContainerError("File too small")
+            magic, version, mode, width, height, n_frames, n_keys, index_offset = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise TileContainerError(f"Unsupported container (magic: {magic}, version: {version})")
+
+            self.mode = mode.rstrip(b"\0").decode()
+            self.tile_size = (width, height)
+            self.n_frames = n_frames
+            self.n_keys = n_keys
+
+            index_size = n_frames * n_keys * INDEX_ENTRY.size
+            if index_offset < HEADER.size or index_offset + index_size > len(self.map):
+                raise TileContainerError("Index out of bounds")
+            self.index = [INDEX_ENTRY.unpack_from(self.map, index_offset + i * INDEX_ENTRY.size) for i in range(n_frames * n_keys)]
+        except (TileContainerError, struct.error):
+            self.map.close()
+            raise
+
+        self.view = memoryview(self.map)
+
+    def has_tile(self, frame: int, key: int) -> bool:
+        return self.index[frame * self.n_keys + key][1] > 0
+
+    def is_complete(self) -> bool:
+        return all(length > 0 for _, length in self.index)
+
+    def get_tile(self, frame: int, key: int) -> Image.Image:
+        offset, length = self.index[frame * self.n_keys + key]
+        if length == 0:
+            return
+        # Read only view into the mapped file - PIL copies it if someone tries to modify it
+        return Image.frombuffer(self.mode, self.tile_size, self.view[offset:offset + length], "raw", self.mode, 0, 1)
+
+    def get_frame(self, frame: int) -> list[Image.Image]:
+        return [self.get_tile(frame, key) for key in range(self.n_keys)]
+
+    def close(self) -> None:
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Some tiles are still in use, the map gets closed once they are garbage collected
+            log.trace(f"Tiles of {self.path} are still in use, leaving the map open")
+
+def open_container(path: str, tile_size: tuple[int], n_frames: int, n_keys: int, allow_truncated: bool = False) -> TileContainer:
+    """
+    Opens the container at path if it exists and matches the given geometry. Broken or outdated containers get removed.
+    allow_truncated: also accept containers with less than n_frames frames - for videos that report a too high frame count
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        container = TileContainer(path)
+    except (TileContainerError, ValueError, OSError) as e:
+        log.error(f"Failed to load cache {path}: {e}")
+        os.remove(path)
+        return
+
+    if allow_truncated:
+        frames_match = 0 < container.n_frames <= n_frames
+    else:
+        frames_match = container.n_frames == n_frames
+
+    if container.tile_size != tuple(tile_size) or not frames_match or container.n_keys != n_keys:
+        log.warning(f"Cache {path} does not match the video, removing it")
+        container.close()
+        os.remove(path)
+        return
+
+    return container
@@ -0,0 +1,129 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Scaling and tiling of deck sized backgrounds on numpy arrays, shared by the background images and videos.
+The deck sized image is converted to RGBA once, the tiles handed out are PIL images mapped onto it with its row stride
+instead of per key PIL crops - they are only copied if someone modifies them.
+"""
+# Import Python modules
+import cv2
+import numpy as np
+from PIL import Image
+
+def get_deck_image_size(key_layout: tuple[int], key_size: tuple[int], spacing: tuple[int]) -> tuple[int]:
+    """
+    Size of an image covering all keys including the space hidden by the bezel between them.
+    key_layout is (rows, cols) like returned by deck.key_layout()
+    """
+    key_rows, key_cols = key_layout
+    key_width, key_height = key_size
+    spacing_x, spacing_y = spacing
+    return (key_width * key_cols + spacing_x * (key_cols - 1), key_height * key_rows + spacing_y * (key_rows - 1))
+
+def fit_array(frame: np.ndarray, size: tuple[int]) -> np.ndarray:
+    """
+    Same as ImageOps.fit with the default centering: crops the frame to the aspect ratio of size and scales it to size.
+    The crop is only a view, so only the visible part of the frame gets scaled.
+    """
+    height, width = frame.shape[:2]
+    target_width, target_height = size
+
+    if width * target_height > height * target_width:
+        # Frame is wider than the target
+        crop_width = max(1, round(height * target_width / target_height))
+        x = (width - crop_width) // 2
+        frame = frame[:, x:x + crop_width]
+    elif width * target_height < height * target_width:
+        crop_height = max(1, round(width * target_height / target_width))
+        y = (height - crop_height) // 2
+        frame = frame[y:y + crop_height]
+
+    if frame.shape[1] == target_width and frame.shape[0] == target_height:
+        return frame
+
+    # Area averaging gives the best results when shrinking, e.g. 4K wallpapers to deck size
+    if frame.shape[1] > target_width:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_LINEAR
+    return cv2.resize(frame, (target_width, target_height), interpolation=interpolation)
+
+def get_key_regions(key_layout: tuple[int], key_size: tuple[int], spacing: tuple[int]) -> list[tuple[int]]:
+    """
+    (x, y, width, height) of every key in the deck sized image, ordered by key index
+    """
+    key_rows, key_cols = key_layout
+    key_width, key_height = key_size
+    spacing_x, spacing_y = spacing
+
+    regions = []
+    for key in range(key_rows * key_cols):
+        row = key // key_cols
+        col = key % key_cols
+        regions.append((col * (key_width + spacing_x), row * (key_height + spacing_y), key_width, key_height))
+    return regions
+
+class DeckTiler:
+    """
+    Cuts deck sized images into key tiles. The geometry is computed once per deck.
+    """
+    def __init__(self, key_layout: tuple[int], key_size: tuple[int], spacing: tuple[int]):
+        self.key_layout = tuple(key_layout)
+        self.key_size = tuple(key_size)
+        self.spacing = tuple(spacing)
+
+        self.deck_image_size = get_deck_image_size(key_layout, key_size, spacing)
+        self.regions = get_key_regions(key_layout, key_size, spacing)
+
+    def slice(self, deck_image: np.ndarray) -> list[np.ndarray]:
+        """
+        Returns the tiles of all keys as views into deck_image - nothing is copied
+        """
+        return [deck_image[y:y + height, x:x + width] for x, y, width, height in self.regions]
+
+    def to_rgba(self, deck_image: np.ndarray, code: int = cv2.COLOR_RGB2RGBA) -> np.ndarray:
+        """
+        Converts the deck sized image to RGBA in one go, e.g. with code cv2.COLOR_BGR2RGBA for decoded video frames.
+        The returned buffer has one row more than the image: a tile is mapped with the row stride of the whole image,
+        so the mapping of a tile in the last row reaches up to one row past the image.
+        """
+        height, width = deck_image.shape[:2]
+        buffer = np.empty((height + 1, width, 4), dtype=np.uint8)
+        if deck_image.ndim == 3 and deck_image.shape[2] == 4:
+            buffer[:height] = deck_image
+        else:
+            cv2.cvtColor(deck_image, code, dst=buffer[:height])
+        return buffer
+
+    def get_tiles(self, deck_image: np.ndarray) -> list[Image.Image]:
+        """
+        Returns the tiles as RGBA PIL images, so they can be pasted onto the key canvas without a conversion.
+        deck_image: a deck sized RGB or RGBA image, or a buffer returned by to_rgba.
+        The tiles are read only views into the buffer - nothing is copied per key.
+        """
+        width, height = self.deck_image_size
+        if deck_image.shape != (height + 1, width, 4) or not deck_image.flags.c_contiguous:
+            deck_image = self.to_rgba(deck_image)
+
+        stride = deck_image.strides[0]
+        data = memoryview(deck_image.reshape(-1))
+        return [Image.frombuffer("RGBA", self.key_size, data[y * stride + x * 4:], "raw", "RGBA", stride, 1) for x, y, _, _ in self.regions]
+
+    def get_image_tiles(self, image: Image.Image) -> list[Image.Image]:
+        """
+        Fits the image to the deck and returns the tiles of all keys
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return self.get_tiles(fit_array(np.asarray(image), self.deck_image_size))
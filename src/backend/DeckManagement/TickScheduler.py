@@ -0,0 +1,168 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+import time
+from dataclasses import dataclass
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.DeckController import DeckController, ControllerKey
+    from src.backend.PluginManager.ActionBase import ActionBase
+
+@dataclass
+class TickEntry:
+    controller_key: "ControllerKey"
+    action: "ActionBase"
+    # Tag of the tick jobs of the action in the action executor, see get_job_tag
+    tag: tuple
+    # Entries of an older generation than the one of their key are outdated and get dropped when they come up
+    generation: int
+    # Full turns of the wheel left before the entry is due
+    rounds: int = 0
+
+class TickScheduler(threading.Thread):
+    """
+    One scheduler per process that calls on_tick of all actions that implement it, each in its own interval.
+    The actions are kept in a hashed timer wheel, so a step only touches the actions that are due - actions without on_tick are never scheduled.
+    The callbacks themselves run on the action executor.
+    """
+    # Seconds per slot
+    RESOLUTION = 0.1
+    SLOTS = 128
+
+    def __init__(self):
+        super().__init__(name="TickScheduler", daemon=True)
+        self.lock = threading.Lock()
+
+        self.wheel: list[list[TickEntry]] = [[] for _ in range(self.SLOTS)]
+        # Slot that is processed next
+        self.position: int = 0
+
+        # ControllerKey -> (generation, number of ticking actions)
+        self.keys: dict["ControllerKey", tuple[int, int]] = {}
+        # DeckController -> its scheduled keys. The keys of a deck get replaced while the screen saver shows, so they can't be found via deck_controller.keys
+        self.deck_keys: dict["DeckController", set["ControllerKey"]] = {}
+        self.last_generation: int = 0
+
+        # Not called _stop, that would hide threading.Thread._stop which is_alive() and join() rely on
+        self.stop_event = threading.Event()
+
+    def schedule_key(self, controller_key: "ControllerKey", actions: list["ActionBase"]) -> None:
+        """
+        Replaces the scheduled actions of the key with the ones of the given actions that implement on_tick
+        """
+        # The index in the actions of the key identifies the action in the job tag
+        ticking = [(index, action) for index, action in enumerate(actions) if action.implements_on_tick()]
+        tags = [controller_key.get_job_tag("tick", index) for index, _ in ticking]
+        with self.lock:
+            if not ticking:
+                self.unschedule_key(controller_key)
+                return
+
+            self.last_generation += 1
+            self.keys[controller_key] = (self.last_generation, len(ticking))
+            self.deck_keys.setdefault(controller_key.deck_controller, set()).add(controller_key)
+            for (_, action), tag in zip(ticking, tags):
+                self.insert(TickEntry(controller_key=controller_key, action=action, tag=tag, generation=self.last_generation))
+
+    def remove_deck(self, deck_controller: "DeckController") -> None:
+        with self.lock:
+            for controller_key in self.deck_keys.pop(deck_controller, set()):
+                self.keys.pop(controller_key, None)
+
+    def unschedule_key(self, controller_key: "ControllerKey") -> None:
+        """
+        Must be called while holding self.lock. The entries of the key are dropped when they come up.
+        """
+        self.keys.pop(controller_key, None)
+        deck_keys = self.deck_keys.get(controller_key.deck_controller)
+        if deck_keys is not None:
+            deck_keys.discard(controller_key)
+            if not deck_keys:
+                del self.deck_keys[controller_key.deck_controller]
+
+    def insert(self, entry: TickEntry) -> None:
+        """
+        Puts the entry into the slot it's due in. Must be called while holding self.lock.
+        """
+        interval = max(float(getattr(entry.action, "TICK_INTERVAL", 1)), self.RESOLUTION)
+        steps = max(1, round(interval / self.RESOLUTION))
+        entry.rounds = (steps - 1) // self.SLOTS
+        self.wheel[(self.position + steps - 1) % self.SLOTS].append(entry)
+
+    def step(self) -> None:
+        due: list[TickEntry] = []
+        with self.lock:
+            slot = self.position
+            entries = self.wheel[slot]
+            self.wheel[slot] = []
+            self.position = (self.position + 1) % self.SLOTS
+
+            for entry in entries:
+                if self.keys.get(entry.controller_key, (None,))[0] != entry.generation:
+                    # The actions of the key got reloaded or the deck is gone
+                    continue
+                if entry.rounds > 0:
+                    entry.rounds -= 1
+                    self.wheel[slot].append(entry)
+                    continue
+                due.append(entry)
+                self.insert(entry)
+
+        for entry in due:
+            deck_controller = entry.controller_key.deck_controller
+            if deck_controller.screen_saver.showing:
+                continue
+            # A tick that is still queued or running makes a second one pointless
+            gl.action_executor.submit_tick(deck_controller.serial_number, entry.controller_key.key, entry.action.on_tick, tag=entry.tag)
+            gl.metrics_manager.increment("action-ticks")
+
+    def run(self):
+        deadline = time.monotonic() + self.RESOLUTION
+        while not self.stop_event.is_set():
+            self.stop_event.wait(max(0, deadline - time.monotonic()))
+            if self.stop_event.is_set():
+                break
+
+            # Missed steps are caught up instead of skipped - skipping a slot would delay its actions by a full turn of the wheel
+            behind = time.monotonic() - deadline
+            steps = min(int(behind // self.RESOLUTION) + 1, self.SLOTS)
+            for _ in range(steps):
+                try:
+                    self.step()
+                except Exception as e:
+                    log.error(f"Tick scheduler step failed. Error: {e}")
+            deadline += steps * self.RESOLUTION
+
+            if behind > self.SLOTS * self.RESOLUTION:
+                # e.g. after a suspend, one turn of the wheel has been caught up
+                deadline = time.monotonic() + self.RESOLUTION
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "ticking-keys": len(self.keys),
+                "ticking-actions": sum(count for _, count in self.keys.values())
+            }
+
+    def stop(self) -> None:
+        log.info("Stopping tick scheduler")
+        self.stop_event.set()
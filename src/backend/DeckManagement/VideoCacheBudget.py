@@ -0,0 +1,153 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+import weakref
+from collections import OrderedDict
+from PIL import Image
+from loguru import logger as log
+
+def get_image_size(image: Image.Image) -> int:
+    """
+    Approximate number of bytes the pixel data of the image uses
+    """
+    if image is None:
+        return 0
+    return image.width * image.height * len(image.getbands())
+
+class VideoCacheBudget:
+    """
+    Shared memory budget of all video frame caches (background videos and key videos).
+    The caches report every entry they store, once the budget is exceeded the least recently used entries
+    of all caches get evicted via cache.evict(key). The caches decode evicted frames again when they are needed.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # RLock because the weakref callbacks can run while the lock is held by the same thread
+        self.lock = threading.RLock()
+
+        # (cache id, key) -> entry size, ordered from least to most recently used
+        self.entries: OrderedDict[tuple[int, object], int] = OrderedDict()
+        self.caches: dict[int, weakref.ref] = {}
+        self.names: dict[int, str] = {}
+        self.cache_bytes: dict[int, int] = {}
+        self.used_bytes: int = 0
+
+        self.evictions: int = 0
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self.lock:
+            self.max_bytes = max_bytes
+            evictions = self.collect_evictions(keep=None)
+        self.perform_evictions(evictions)
+
+    def register(self, cache, name: str) -> None:
+        cache_id = id(cache)
+        with self.lock:
+            # The entries get dropped as soon as the cache is garbage collected
+            self.caches[cache_id] = weakref.ref(cache, lambda _, cache_id=cache_id: self.unregister_id(cache_id))
+            self.names[cache_id] = name
+            self.cache_bytes[cache_id] = 0
+
+    def unregister(self, cache) -> None:
+        self.unregister_id(id(cache))
+
+    def unregister_id(self, cache_id: int) -> None:
+        with self.lock:
+            if cache_id not in self.caches:
+                return
+            for entry in [entry for entry in self.entries if entry[0] == cache_id]:
+                self.used_bytes -= self.entries.pop(entry)
+            del self.caches[cache_id]
+            del self.names[cache_id]
+            del self.cache_bytes[cache_id]
+
+    def add(self, cache, key, size: int) -> None:
+        """
+        Records a new entry of the cache and evicts old entries if the budget is exceeded
+        """
+        cache_id = id(cache)
+        with self.lock:
+            if cache_id not in self.caches:
+                return
+            entry = (cache_id, key)
+            if entry in self.entries:
+                self.remove_entry(entry)
+            self.entries[entry] = size
+            self.used_bytes += size
+            self.cache_bytes[cache_id] += size
+
+            evictions = self.collect_evictions(keep=entry)
+        # The caches are called without holding the lock - they might hold their own lock while calling add()
+        self.perform_evictions(evictions)
+
+    def touch(self, cache, key) -> None:
+        with self.lock:
+            entry = (id(cache), key)
+            if entry in self.entries:
+                self.entries.move_to_end(entry)
+
+    def remove(self, cache, key) -> None:
+        with self.lock:
+            entry = (id(cache), key)
+            if entry in self.entries:
+                self.remove_entry(entry)
+
+    def remove_entry(self, entry: tuple[int, object]) -> None:
+        size = self.entries.pop(entry)
+        self.used_bytes -= size
+        self.cache_bytes[entry[0]] -= size
+
+    def collect_evictions(self, keep: tuple[int, object]) -> list[tuple[weakref.ref, object]]:
+        evictions = []
+        while self.used_bytes > self.max_bytes and len(self.entries) > 0:
+            entry = next(iter(self.entries))
+            if entry == keep:
+                # A single entry that is bigger than the whole budget, keep it anyway
+                if len(self.entries) == 1:
+                    break
+                self.entries.move_to_end(entry)
+                continue
+            self.remove_entry(entry)
+            evictions.append((self.caches[entry[0]], entry[1]))
+        self.evictions += len(evictions)
+        return evictions
+
+    def perform_evictions(self, evictions: list[tuple[weakref.ref, object]]) -> None:
+        for cache_ref, key in evictions:
+            cache = cache_ref()
+            if cache is None:
+                continue
+            try:
+                cache.evict(key)
+            except Exception as e:
+                log.error(f"Failed to evict video cache entry. Error: {e}")
+
+    def get_usage(self) -> dict[str, dict]:
+        """
+        Returns the used bytes and number of entries per video
+        """
+        with self.lock:
+            entries_per_cache: dict[int, int] = {}
+            for cache_id, _ in self.entries:
+                entries_per_cache[cache_id] = entries_per_cache.get(cache_id, 0) + 1
+
+            usage = {}
+            for cache_id, name in self.names.items():
+                video = usage.setdefault(name, {"bytes": 0, "entries": 0, "caches": 0})
+                video["bytes"] += self.cache_bytes[cache_id]
+                video["entries"] += entries_per_cache.get(cache_id, 0)
+                video["caches"] += 1
+            return usage
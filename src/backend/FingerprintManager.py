@@ -0,0 +1,156 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import hashlib
+import json
+import os
+import threading
+from loguru import logger as log
+
+# Import own modules
+from src.backend.DeckManagement.HelperMethods import sha256
+
+# Import globals
+import globals as gl
+
+class FingerprintManager:
+    """
+    Identifies media files without reading them completely.
+    The results are stored per path together with the size, mtime and inode of the file,
+    as long as these don't change the file is not read again - not even after a restart.
+    """
+    INDEX_PATH = os.path.join(gl.DATA_PATH, "cache", "fingerprints.json")
+
+    # Files up to this size are hashed completely
+    FULL_HASH_LIMIT = 2 * 1024**2
+    SAMPLE_SIZE = 64 * 1024
+    N_SAMPLES = 16
+
+    SAVE_DELAY = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index: dict[str, dict] = {}
+        self.save_timer: threading.Timer = None
+
+        self.load_index()
+
+    def load_index(self) -> None:
+        if not os.path.exists(self.INDEX_PATH):
+            return
+        try:
+            with open(self.INDEX_PATH) as f:
+                self.index = json.load(f)
+        except (json.decoder.JSONDecodeError, OSError) as e:
+            log.error(f"Failed to load fingerprint index, starting with an empty one. Error: {e}")
+            self.index = {}
+
+    def save_index(self) -> None:
+        with self.lock:
+            self.save_timer = None
+            paths = list(self.index)
+
+        # Files that got deleted or moved would otherwise stay in the index forever
+        missing = [path for path in paths if not os.path.exists(path)]
+
+        with self.lock:
+            for path in missing:
+                self.index.pop(path, None)
+            data = json.dumps(self.index)
+
+        # Written to a temporary file first, so a crash while writing can't leave a broken index behind
+        tmp_path = f"{self.INDEX_PATH}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.INDEX_PATH), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, self.INDEX_PATH)
+        except OSError as e:
+            # The fingerprints are just computed again on the next start
+            log.error(f"Failed to save fingerprint index. Error: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def schedule_save(self) -> None:
+        """
+        Must be called while holding self.lock. Bundles the writes of e.g. a page load into one
+        """
+        if self.save_timer is not None:
+            return
+        self.save_timer = threading.Timer(self.SAVE_DELAY, self.save_index)
+        self.save_timer.daemon = True
+        self.save_timer.start()
+
+    def get_entry(self, path: str) -> dict:
+        """
+        Returns the index entry of the file, a fresh one if the file changed since it was indexed
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+        entry = self.index.get(path)
+        if entry is None or entry.get("stat") != stat_key:
+            entry = {"stat": stat_key}
+            self.index[path] = entry
+        return entry
+
+    def get_fingerprint(self, path: str) -> str:
+        """
+        Content fingerprint for cache keys. Big files are identified by their size and a few sampled chunks.
+        """
+        with self.lock:
+            entry = self.get_entry(path)
+            fingerprint = entry.get("fingerprint")
+        if fingerprint is not None:
+            return fingerprint
+
+        fingerprint = self.compute_sampled_hash(path, entry["stat"][0])
+        with self.lock:
+            entry["fingerprint"] = fingerprint
+            self.schedule_save()
+        return fingerprint
+
+    def get_sha256(self, path: str) -> str:
+        """
+        Full sha256 of the file, only computed again if the file changed
+        """
+        with self.lock:
+            entry = self.get_entry(path)
+            hash = entry.get("sha256")
+        if hash is not None:
+            return hash
+
+        hash = sha256(path)
+        with self.lock:
+            entry["sha256"] = hash
+            self.schedule_save()
+        return hash
+
+    def compute_sampled_hash(self, path: str, size: int) -> str:
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(str(size).encode())
+        with open(path, "rb") as f:
+            if size <= self.FULL_HASH_LIMIT:
+                for chunk in iter(lambda: f.read(self.SAMPLE_SIZE), b""):
+                    hasher.update(chunk)
+                return hasher.hexdigest()
+
+            # Evenly spaced chunks, including the very beginning and the very end
+            step = (size - self.SAMPLE_SIZE) / (self.N_SAMPLES - 1)
+            for i in range(self.N_SAMPLES):
+                f.seek(int(i * step))
+                hasher.update(f.read(self.SAMPLE_SIZE))
+        return hasher.hexdigest()
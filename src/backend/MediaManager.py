@@ -23,7 +23,7 @@ import os, psutil
 process = psutil.Process()
 
 # Import own modules
-from src.backend.DeckManagement.HelperMethods import sha256, file_in_dir
+from src.backend.DeckManagement.HelperMethods import file_in_dir
 
 
 # Import globals
@@ -34,7 +34,7 @@ class MediaManager:
         pass
 
     def get_thumbnail(self, file_path):
-        hash = sha256(file_path)
+        hash = gl.fingerprint_manager.get_sha256(file_path)
 
         thumbnail_dir = os.path.join(gl.DATA_PATH, "cache", "thumbnails")
         thumbnail_path = os.path.join(thumbnail_dir, f"{hash}.png")
@@ -0,0 +1,128 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+import time
+import tracemalloc
+from collections import deque
+import psutil
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+class MemoryTracker:
+    """
+    Opt-in memory diagnostics. While enabled the resident memory is sampled periodically in its own thread
+    and tracemalloc records the allocations, so snapshots of the biggest allocations can be taken on demand.
+    Nothing of this runs in the render path.
+    """
+    SAMPLE_INTERVAL = 5
+    # 10 minutes of samples
+    HISTORY_SIZE = 120
+    # Frames of the stack that are stored per allocation
+    TRACEBACK_DEPTH = 1
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.lock = threading.Lock()
+
+        # (time.time(), rss in bytes)
+        self.samples: deque[tuple[float, int]] = deque(maxlen=self.HISTORY_SIZE)
+        self.peak_rss: int = 0
+
+        self.last_snapshot: tracemalloc.Snapshot = None
+
+        self.enabled: bool = False
+        self.stop_event: threading.Event = None
+        self.thread: threading.Thread = None
+
+        self.set_enabled(gl.settings_manager.get_app_settings().get("dev", {}).get("track-memory", False))
+
+    def set_enabled(self, enabled: bool) -> None:
+        with self.lock:
+            if enabled == self.enabled:
+                return
+            self.enabled = enabled
+
+            if enabled:
+                # Slows down all allocations, that's why this is opt-in
+                tracemalloc.start(self.TRACEBACK_DEPTH)
+                self.stop_event = threading.Event()
+                self.thread = threading.Thread(target=self.sample_loop, args=(self.stop_event,), name="memory_tracker", daemon=True)
+                self.thread.start()
+                log.info("Started memory tracking")
+            else:
+                self.stop_event.set()
+                self.thread = None
+                self.last_snapshot = None
+                tracemalloc.stop()
+                log.info("Stopped memory tracking")
+
+    def sample_loop(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            self.sample()
+            stop_event.wait(self.SAMPLE_INTERVAL)
+
+    def sample(self) -> None:
+        rss = self.process.memory_info().rss
+        with self.lock:
+            self.samples.append((time.time(), rss))
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            samples = list(self.samples)
+            traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+            return {
+                "enabled": self.enabled,
+                "rss-mb": samples[-1][1] / 1024**2 if samples else 0,
+                "peak-rss-mb": self.peak_rss / 1024**2,
+                "traced-mb": traced[0] / 1024**2,
+                "traced-peak-mb": traced[1] / 1024**2,
+                "samples": [(timestamp, rss / 1024**2) for timestamp, rss in samples]
+            }
+
+    def take_snapshot(self, limit: int = 15) -> list[dict]:
+        """
+        Returns the source lines that hold the most memory, together with the change since the previous snapshot
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+        with self.lock:
+            previous = self.last_snapshot
+            self.last_snapshot = snapshot
+
+        if previous is None:
+            stats = snapshot.statistics("lineno")
+            return [{
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size-kb": stat.size / 1024,
+                "count": stat.count,
+                "size-diff-kb": 0
+            } for stat in stats[:limit]]
+
+        stats = snapshot.compare_to(previous, "lineno")
+        return [{
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size-kb": stat.size / 1024,
+            "count": stat.count,
+            "size-diff-kb": stat.size_diff / 1024
+        } for stat in stats[:limit]]
@@ -0,0 +1,182 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import threading
+import time
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+class Histogram:
+    # Upper bounds of the buckets in milliseconds, the last bucket catches everything above
+    BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count: int = 0
+        self.sum: float = 0
+        self.max: float = 0
+
+    def add(self, value_ms: float) -> None:
+        index = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if value_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Returns the upper bound of the bucket containing the given percentile (0-100)
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * percentile / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if i < len(self.BUCKETS_MS):
+                    return min(self.BUCKETS_MS[i], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean-ms": self.sum / self.count if self.count > 0 else 0,
+            "p50-ms": self.get_percentile(50),
+            "p95-ms": self.get_percentile(95),
+            "p99-ms": self.get_percentile(99),
+            "max-ms": self.max,
+            "buckets-ms": list(self.BUCKETS_MS),
+            "bucket-counts": list(self.counts)
+        }
+
+
+class StageTimer:
+    def __init__(self, metrics_manager: "MetricsManager", deck: str, key: int, stage: str):
+        self.metrics_manager = metrics_manager
+        self.deck = deck
+        self.key = key
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics_manager.record(self.deck, self.key, self.stage, time.perf_counter() - self.start)
+        return False
+
+class NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+NO_TIMER = NoTimer()
+
+
+class MetricsManager:
+    """
+    Collects the time spent in each stage of the key rendering per deck and per key
+    """
+    STAGES = ["tile-fetch", "composite", "label-draw", "native-encode", "usb-write", "pixbuf-conversion", "press-transform", "press-to-write", "action-queue-wait"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled: bool = gl.settings_manager.get_app_settings().get("dev", {}).get("collect-render-metrics", False)
+
+        # deck serial -> stage -> Histogram
+        self.deck_stages: dict[str, dict[str, Histogram]] = {}
+        # deck serial -> key index -> stage -> Histogram
+        self.key_stages: dict[str, dict[int, dict[str, Histogram]]] = {}
+        # name -> value
+        self.counters: dict[str, float] = {}
+
+        self.start_time = time.time()
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+        log.info(f"{'Enabled' if enabled else 'Disabled'} render metrics")
+
+    def measure(self, deck: str, key: int, stage: str):
+        """
+        Context manager that records the time spent in the block
+        deck: serial number of the deck
+        key: index of the key, None if the stage affects the whole deck
+        """
+        if not self.enabled:
+            return NO_TIMER
+        return StageTimer(self, deck, key, stage)
+
+    def record(self, deck: str, key: int, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        value_ms = seconds * 1000
+        with self.lock:
+            self.deck_stages.setdefault(deck, {}).setdefault(stage, Histogram()).add(value_ms)
+            if key is not None:
+                self.key_stages.setdefault(deck, {}).setdefault(key, {}).setdefault(stage, Histogram()).add(value_ms)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self.lock:
+            self.deck_stages = {}
+            self.key_stages = {}
+            self.counters = {}
+            self.start_time = time.time()
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            metrics = {
+                "enabled": self.enabled,
+                "since": self.start_time,
+                "counters": dict(self.counters),
+                "decks": {}
+            }
+            for deck, stages in self.deck_stages.items():
+                metrics["decks"][deck] = {
+                    "stages": {stage: histogram.to_dict() for stage, histogram in stages.items()},
+                    "keys": {
+                        key: {stage: histogram.to_dict() for stage, histogram in key_stages.items()}
+                        for key, key_stages in self.key_stages.get(deck, {}).items()
+                    }
+                }
+
+        # Frame pacing of the media players
+        if gl.deck_manager is not None:
+            for controller in gl.deck_manager.deck_controller:
+                deck_metrics = metrics["decks"].setdefault(controller.serial_number, {"stages": {}, "keys": {}})
+                deck_metrics["frames"] = controller.media_player.get_frame_stats()
+
+        # Queue of the action callbacks
+        if gl.action_executor is not None:
+            metrics["actions"] = gl.action_executor.get_stats()
+        if gl.tick_scheduler is not None:
+            metrics.setdefault("actions", {}).update(gl.tick_scheduler.get_stats())
+
+        return metrics
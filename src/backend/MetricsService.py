@@ -0,0 +1,46 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import json
+import dbus
+import dbus.service
+
+# Import globals
+import globals as gl
+
+BUS_NAME = "com.core447.StreamController.Metrics"
+OBJECT_PATH = "/com/core447/StreamController/Metrics"
+INTERFACE = "com.core447.StreamController.Metrics"
+
+class MetricsService(dbus.service.Object):
+    """
+    Exposes the render metrics on the session bus, e.g.:
+    gdbus call --session --dest com.core447.StreamController.Metrics --object-path /com/core447/StreamController/Metrics --method com.core447.StreamController.Metrics.GetMetrics
+    """
+    def __init__(self, session_bus: dbus.SessionBus):
+        self.bus_name = dbus.service.BusName(BUS_NAME, bus=session_bus)
+        super().__init__(self.bus_name, OBJECT_PATH)
+
+    @dbus.service.method(INTERFACE, in_signature="", out_signature="s")
+    def GetMetrics(self) -> str:
+        return json.dumps(gl.metrics_manager.get_metrics())
+
+    @dbus.service.method(INTERFACE, in_signature="", out_signature="")
+    def ResetMetrics(self) -> None:
+        gl.metrics_manager.reset()
+
+    @dbus.service.method(INTERFACE, in_signature="b", out_signature="")
+    def SetEnabled(self, enabled: bool) -> None:
+        gl.metrics_manager.set_enabled(bool(enabled))
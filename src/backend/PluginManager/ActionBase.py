@@ -14,7 +14,7 @@ from rpyc.core import netref
 # Import own modules
 from src.Signals.Signals import Signal
 from src.backend.PageManagement.Page import Page
-from src.backend.DeckManagement.HelperMethods import is_image, is_video
+from src.backend.DeckManagement.HelperMethods import is_image, is_video, get_file_media_id
 from src.backend.DeckManagement.DeckController import KeyImage, KeyVideo, BackgroundImage, BackgroundVideo, KeyLabel
 
 # Import globals
@@ -30,6 +30,9 @@ if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import DeckController, ControllerKey
 
 class ActionBase(rpyc.Service):
+    # Seconds between two calls of on_tick, can be changed at any time
+    TICK_INTERVAL: float = 1
+
     # Change to match your action
     def __init__(self, action_id: str, action_name: str,
                  deck_controller: "DeckController", page: Page, coords: str, plugin_base: "PluginBase"):
@@ -102,6 +105,14 @@ class ActionBase(rpyc.Service):
     def on_tick(self):
         pass
 
+    @classmethod
+    def implements_on_tick(cls) -> bool:
+        """
+        Internal function, do not call manually
+        Only actions that override on_tick get ticked
+        """
+        return cls.on_tick is not ActionBase.on_tick
+
     def set_default_image(self, image: Image.Image):
         self.default_image = image
 
@@ -141,9 +152,11 @@ class ActionBase(rpyc.Service):
         if self.has_custom_user_asset():
             return
         
+        media_id = None
         if is_image(media_path):
             with Image.open(media_path) as img:
                 image = img.copy()
+            media_id = get_file_media_id(media_path)
 
         if image is not None or media_path is None:
             self.deck_controller.keys[self.key_index].set_key_image(KeyImage(
@@ -151,7 +164,8 @@ class ActionBase(rpyc.Service):
                 image=image,
                 size=size,
                 valign=valign,
-                halign=halign
+                halign=halign,
+                media_id=media_id
             ), update=False)
         elif is_video(media_path):
             self.deck_controller.keys[self.key_index].set_key_video(KeyVideo(
@@ -170,9 +184,7 @@ class ActionBase(rpyc.Service):
         if not self.on_ready_called:
             update = False
 
-        self.deck_controller.keys[self.key_index].background_color = color
-        if update:
-            self.deck_controller.update_key(self.key_index)
+        self.deck_controller.keys[self.key_index].set_background_color(color, update=update)
 
             
     def show_error(self, duration: int = -1) -> None:
@@ -17,7 +17,7 @@ import gi
 
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
-from gi.repository import Gtk, Adw, Gio
+from gi.repository import Gtk, Adw, Gio, GLib
 
 # Import globals
 import globals as gl
@@ -113,6 +113,8 @@ class DevPage(Adw.PreferencesPage):
         self.set_icon_name("code-block")
 
         self.add(DevPageGroup(settings=settings))
+        self.add(RenderMetricsGroup(settings=settings))
+        self.add(MemoryDiagnosticsGroup(settings=settings))
 
 class DevPageGroup(Adw.PreferencesGroup):
     def __init__(self, settings: Settings):
@@ -144,6 +146,172 @@ class DevPageGroup(Adw.PreferencesGroup):
         # Reload decks
         gl.deck_manager.load_fake_decks()
 
+class RenderMetricsGroup(Adw.PreferencesGroup):
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        super().__init__(title=gl.lm.get("settings.dev.render-metrics.header"),
+                         description=gl.lm.get("settings.dev.render-metrics.description"))
+
+        self.collect_row = Adw.SwitchRow(title=gl.lm.get("settings.dev.render-metrics.collect.title"), active=False,
+                                         subtitle=gl.lm.get("settings.dev.render-metrics.collect.subtitle"))
+        self.add(self.collect_row)
+
+        self.reset_button = Gtk.Button(label=gl.lm.get("settings.dev.render-metrics.reset"), valign=Gtk.Align.CENTER)
+        self.reset_button.connect("clicked", self.on_reset_clicked)
+        self.set_header_suffix(self.reset_button)
+
+        # deck serial -> stage -> row
+        self.deck_rows: dict[str, Adw.ExpanderRow] = {}
+        self.stage_rows: dict[str, dict[str, Adw.ActionRow]] = {}
+
+        self.refresh_source: int = None
+
+        self.load_defaults()
+
+        # Connect signals
+        self.collect_row.connect("notify::active", self.on_collect_toggled)
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
+
+    def load_defaults(self):
+        self.collect_row.set_active(self.settings.settings_json.get("dev", {}).get("collect-render-metrics", False))
+
+    def on_collect_toggled(self, *args):
+        self.settings.settings_json.setdefault("dev", {})
+        self.settings.settings_json["dev"]["collect-render-metrics"] = self.collect_row.get_active()
+
+        # Save
+        self.settings.save_json()
+
+        gl.metrics_manager.set_enabled(self.collect_row.get_active())
+
+    def on_reset_clicked(self, *args):
+        gl.metrics_manager.reset()
+        self.refresh()
+
+    def on_map(self, *args):
+        # Only refresh while the page is visible
+        self.refresh()
+        if self.refresh_source is None:
+            self.refresh_source = GLib.timeout_add_seconds(1, self.refresh)
+
+    def on_unmap(self, *args):
+        if self.refresh_source is not None:
+            GLib.source_remove(self.refresh_source)
+            self.refresh_source = None
+
+    def refresh(self) -> bool:
+        metrics = gl.metrics_manager.get_metrics()
+        for serial, deck_metrics in metrics["decks"].items():
+            if serial not in self.deck_rows:
+                self.deck_rows[serial] = Adw.ExpanderRow(title=serial)
+                self.stage_rows[serial] = {}
+                self.add(self.deck_rows[serial])
+
+            frames = deck_metrics.get("frames", {})
+            self.deck_rows[serial].set_subtitle(gl.lm.get("settings.dev.render-metrics.frames").format(
+                late=frames.get("late-frames", 0), dropped=frames.get("dropped-frames", 0)))
+
+            for stage in gl.metrics_manager.STAGES:
+                histogram = deck_metrics["stages"].get(stage)
+                if stage not in self.stage_rows[serial]:
+                    self.stage_rows[serial][stage] = Adw.ActionRow(title=stage)
+                    self.deck_rows[serial].add_row(self.stage_rows[serial][stage])
+
+                if histogram is None:
+                    self.stage_rows[serial][stage].set_subtitle("-")
+                    continue
+                self.stage_rows[serial][stage].set_subtitle(gl.lm.get("settings.dev.render-metrics.stage").format(
+                    count=histogram["count"], p50=histogram["p50-ms"], p95=histogram["p95-ms"], max=histogram["max-ms"]))
+
+        return True
+
+class MemoryDiagnosticsGroup(Adw.PreferencesGroup):
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        super().__init__(title=gl.lm.get("settings.dev.memory.header"),
+                         description=gl.lm.get("settings.dev.memory.description"))
+
+        self.track_row = Adw.SwitchRow(title=gl.lm.get("settings.dev.memory.track.title"), active=False,
+                                       subtitle=gl.lm.get("settings.dev.memory.track.subtitle"))
+        self.add(self.track_row)
+
+        self.rss_row = Adw.ActionRow(title=gl.lm.get("settings.dev.memory.rss.title"))
+        self.add(self.rss_row)
+
+        self.traced_row = Adw.ActionRow(title=gl.lm.get("settings.dev.memory.traced.title"))
+        self.add(self.traced_row)
+
+        self.snapshot_row = Adw.ExpanderRow(title=gl.lm.get("settings.dev.memory.snapshot.title"),
+                                            subtitle=gl.lm.get("settings.dev.memory.snapshot.subtitle"))
+        self.add(self.snapshot_row)
+        self.allocation_rows: list[Adw.ActionRow] = []
+
+        self.snapshot_button = Gtk.Button(label=gl.lm.get("settings.dev.memory.snapshot.button"), valign=Gtk.Align.CENTER)
+        self.snapshot_button.connect("clicked", self.on_snapshot_clicked)
+        self.set_header_suffix(self.snapshot_button)
+
+        self.refresh_source: int = None
+
+        self.load_defaults()
+
+        # Connect signals
+        self.track_row.connect("notify::active", self.on_track_toggled)
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
+
+    def load_defaults(self):
+        self.track_row.set_active(self.settings.settings_json.get("dev", {}).get("track-memory", False))
+
+    def on_track_toggled(self, *args):
+        self.settings.settings_json.setdefault("dev", {})
+        self.settings.settings_json["dev"]["track-memory"] = self.track_row.get_active()
+
+        # Save
+        self.settings.save_json()
+
+        gl.memory_tracker.set_enabled(self.track_row.get_active())
+        self.refresh()
+
+    def on_snapshot_clicked(self, *args):
+        for row in self.allocation_rows:
+            self.snapshot_row.remove(row)
+        self.allocation_rows.clear()
+
+        for allocation in gl.memory_tracker.take_snapshot():
+            row = Adw.ActionRow(title=allocation["location"], title_lines=1)
+            row.set_subtitle(gl.lm.get("settings.dev.memory.allocation").format(
+                size=allocation["size-kb"], count=allocation["count"], diff=allocation["size-diff-kb"]))
+            self.snapshot_row.add_row(row)
+            self.allocation_rows.append(row)
+
+        self.snapshot_row.set_expanded(len(self.allocation_rows) > 0)
+
+    def on_map(self, *args):
+        # Only refresh while the page is visible
+        self.refresh()
+        if self.refresh_source is None:
+            self.refresh_source = GLib.timeout_add_seconds(2, self.refresh)
+
+    def on_unmap(self, *args):
+        if self.refresh_source is not None:
+            GLib.source_remove(self.refresh_source)
+            self.refresh_source = None
+
+    def refresh(self) -> bool:
+        stats = gl.memory_tracker.get_stats()
+        self.snapshot_button.set_sensitive(stats["enabled"])
+        if not stats["enabled"]:
+            self.rss_row.set_subtitle("-")
+            self.traced_row.set_subtitle("-")
+            return True
+
+        self.rss_row.set_subtitle(gl.lm.get("settings.dev.memory.current-peak").format(
+            current=stats["rss-mb"], peak=stats["peak-rss-mb"]))
+        self.traced_row.set_subtitle(gl.lm.get("settings.dev.memory.current-peak").format(
+            current=stats["traced-mb"], peak=stats["traced-peak-mb"]))
+        return True
+
 class StorePage(Adw.PreferencesPage):
     def __init__(self, settings: Settings):
         self.settings = settings
@@ -184,6 +352,7 @@ class PerformancePage(Adw.PreferencesPage):
         self.set_icon_name("speedometer")
 
         self.add(PerformancePageGroup(settings=settings))
+        self.add(VideoCacheUsageGroup(settings=settings))
 
 class PerformancePageGroup(Adw.PreferencesGroup):
     def __init__(self, settings: Settings):
@@ -201,16 +370,39 @@ class PerformancePageGroup(Adw.PreferencesGroup):
                                           tooltip_text=gl.lm.get("settings.performance.cache-videos.tooltip"))
         self.add(self.cache_videos)
 
+        self.video_cache_budget = Adw.SpinRow.new_with_range(min=64, max=65536, step=64)
+        self.video_cache_budget.set_title(gl.lm.get("settings.performance.video-cache-budget.title"))
+        self.video_cache_budget.set_subtitle(gl.lm.get("settings.performance.video-cache-budget.subtitle"))
+        self.video_cache_budget.set_tooltip_text(gl.lm.get("settings.performance.video-cache-budget.tooltip"))
+        self.add(self.video_cache_budget)
+
+        self.video_decode_ahead = Adw.SpinRow.new_with_range(min=1, max=120, step=1)
+        self.video_decode_ahead.set_title(gl.lm.get("settings.performance.video-decode-ahead.title"))
+        self.video_decode_ahead.set_subtitle(gl.lm.get("settings.performance.video-decode-ahead.subtitle"))
+        self.video_decode_ahead.set_tooltip_text(gl.lm.get("settings.performance.video-decode-ahead.tooltip"))
+        self.add(self.video_decode_ahead)
+
+        self.render_in_processes = Adw.SwitchRow(title=gl.lm.get("settings.performance.render-in-processes.title"), active=False,
+                                                 subtitle=gl.lm.get("settings.performance.render-in-processes.subtitle"),
+                                                 tooltip_text=gl.lm.get("settings.performance.render-in-processes.tooltip"))
+        self.add(self.render_in_processes)
+
         self.load_defaults()
 
         # Connect signals
         self.n_cached_pages.connect("changed", self.on_n_cached_pages_changed)
         self.cache_videos.connect("notify::active", self.on_cache_videos_toggled)
+        self.video_cache_budget.connect("changed", self.on_video_cache_budget_changed)
+        self.video_decode_ahead.connect("changed", self.on_video_decode_ahead_changed)
+        self.render_in_processes.connect("notify::active", self.on_render_in_processes_toggled)
 
     def load_defaults(self):
         settings = self.settings.settings_json
         self.n_cached_pages.set_value(settings.get("performance", {}).get("n-cached-pages", 3))
         self.cache_videos.set_active(settings.get("performance", {}).get("cache-videos", True))
+        self.video_cache_budget.set_value(settings.get("performance", {}).get("video-cache-budget-mb", 1024))
+        self.video_decode_ahead.set_value(settings.get("performance", {}).get("video-decode-ahead", 15))
+        self.render_in_processes.set_active(settings.get("performance", {}).get("render-backend", "thread") == "process")
 
     def on_n_cached_pages_changed(self, *args):
         self.settings.settings_json.setdefault("performance", {})
@@ -227,4 +419,75 @@ class PerformancePageGroup(Adw.PreferencesGroup):
         self.settings.settings_json["performance"]["cache-videos"] = self.cache_videos.get_active()
 
         # Save
-        self.settings.save_json()
\ No newline at end of file
+        self.settings.save_json()
+
+    def on_video_cache_budget_changed(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["video-cache-budget-mb"] = int(self.video_cache_budget.get_value())
+
+        # Save
+        self.settings.save_json()
+
+        # Evicts right away if the budget got smaller
+        gl.video_cache_budget.set_max_bytes(int(self.video_cache_budget.get_value()) * 1024**2)
+
+    def on_video_decode_ahead_changed(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["video-decode-ahead"] = int(self.video_decode_ahead.get_value())
+
+        # Save
+        self.settings.save_json()
+
+    def on_render_in_processes_toggled(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["render-backend"] = "process" if self.render_in_processes.get_active() else "thread"
+
+        # Save
+        self.settings.save_json()
+
+class VideoCacheUsageGroup(Adw.PreferencesGroup):
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        super().__init__(title=gl.lm.get("settings.performance.video-cache-usage.header"))
+
+        self.total_row = Adw.ActionRow(title=gl.lm.get("settings.performance.video-cache-usage.total"))
+        self.add(self.total_row)
+
+        # video name -> row
+        self.video_rows: dict[str, Adw.ActionRow] = {}
+
+        self.refresh_source: int = None
+
+        # Connect signals
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
+
+    def on_map(self, *args):
+        # Only refresh while the page is visible
+        self.refresh()
+        if self.refresh_source is None:
+            self.refresh_source = GLib.timeout_add_seconds(1, self.refresh)
+
+    def on_unmap(self, *args):
+        if self.refresh_source is not None:
+            GLib.source_remove(self.refresh_source)
+            self.refresh_source = None
+
+    def refresh(self) -> bool:
+        budget = gl.video_cache_budget
+        self.total_row.set_subtitle(gl.lm.get("settings.performance.video-cache-usage.total-subtitle").format(
+            used=budget.used_bytes / 1024**2, max=budget.max_bytes / 1024**2, evictions=budget.evictions))
+
+        usage = budget.get_usage()
+        for name in list(self.video_rows):
+            if name not in usage:
+                self.remove(self.video_rows.pop(name))
+
+        for name, video in usage.items():
+            if name not in self.video_rows:
+                self.video_rows[name] = Adw.ActionRow(title=name)
+                self.add(self.video_rows[name])
+            self.video_rows[name].set_subtitle(gl.lm.get("settings.performance.video-cache-usage.video-subtitle").format(
+                used=video["bytes"] / 1024**2, frames=video["entries"], caches=video["caches"]))
+
+        return True
\ No newline at end of file
@@ -271,13 +271,25 @@ class KeyButton(Gtk.Frame):
             if self.key_grid.deck_page.deck_stack_child.stack.get_visible_child() != self.key_grid.deck_page:
                 self.key_grid.deck_controller.ui_grid_buttons_changes_while_hidden[self.coords] = image
 
-        self.pixbuf = image2pixbuf(image.convert("RGBA"), force_transparency=True)
+        if gl.metrics_manager.enabled:
+            # Only look up the key index if the timing is recorded
+            deck_controller = self.key_grid.deck_controller
+            with gl.metrics_manager.measure(deck_controller.serial_number, deck_controller.coords_to_index(reversed(self.coords)), "pixbuf-conversion"):
+                self.pixbuf = self.image_to_pixbuf(image)
+        else:
+            self.pixbuf = self.image_to_pixbuf(image)
         self.show_pixbuf(self.pixbuf)
 
         # update righthand side key preview if possible
         if recursive_hasattr(gl, "app.main_win.sidebar"):
             self.set_icon_selector_previews(self.pixbuf)
 
+    def image_to_pixbuf(self, image):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+            gl.metrics_manager.increment("image-allocations")
+        return image2pixbuf(image, force_transparency=True)
+
     def set_icon_selector_previews(self, pixbuf):
         sidebar = gl.app.main_win.sidebar
         if pixbuf is None:
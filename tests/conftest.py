@@ -0,0 +1,22 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Run the tests from the root of the repo:
+    python -m pytest tests
+"""
+import os
+import sys
+
+# The modules import each other as src.…, like when started via main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import pytest
+
+# ActionBase needs the full app environment
+pytest.importorskip("gi")
+pytest.importorskip("rpyc")
+from src.backend.PluginManager.ActionBase import ActionBase
+
+class TickingAction(ActionBase):
+    def on_tick(self):
+        pass
+
+class SubclassOfTickingAction(TickingAction):
+    pass
+
+class IdleAction(ActionBase):
+    def on_key_down(self):
+        pass
+
+def test_implements_on_tick():
+    assert TickingAction.implements_on_tick()
+    assert SubclassOfTickingAction.implements_on_tick()
+    assert not IdleAction.implements_on_tick()
+    assert not ActionBase.implements_on_tick()
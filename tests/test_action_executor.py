@@ -0,0 +1,119 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+import types
+
+import pytest
+
+import globals as gl
+from src.backend.DeckManagement.ActionExecutor import ActionExecutor, get_job_tag
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(gl, "metrics_manager", types.SimpleNamespace(record=lambda *args, **kwargs: None))
+    executor = ActionExecutor(max_workers=4)
+    yield executor
+    executor.stop()
+
+def wait_until_idle(executor: ActionExecutor, timeout: float = 5) -> None:
+    done = threading.Event()
+    # Runs after everything that is queued for the key so far
+    executor.submit("deck", 0, done.set)
+    assert done.wait(timeout)
+
+def test_jobs_of_a_key_run_in_order(executor):
+    events = []
+    release = threading.Event()
+
+    executor.submit("deck", 0, release.wait, 5)
+    for i in range(20):
+        executor.submit("deck", 0, events.append, i)
+    release.set()
+    wait_until_idle(executor)
+
+    assert events == list(range(20))
+
+def test_keys_run_in_parallel(executor):
+    release = threading.Event()
+    started = threading.Event()
+
+    # Key 0 is blocked until key 1 ran
+    executor.submit("deck", 0, release.wait, 5)
+    executor.submit("deck", 1, started.set)
+
+    assert started.wait(5)
+    release.set()
+
+def test_pending_ticks_get_coalesced(executor):
+    events = []
+    release = threading.Event()
+    tag = get_job_tag("tick", "deck", "0x0", 0)
+
+    assert executor.submit_tick("deck", 0, release.wait, 5, tag=tag)
+    # The previous tick is still running
+    assert not executor.submit_tick("deck", 0, events.append, "tick", tag=tag)
+    # Another action of the key has its own tag
+    other = threading.Event()
+    assert executor.submit_tick("deck", 0, other.set, tag=get_job_tag("tick", "deck", "0x0", 1))
+    assert other.wait(5)
+    release.set()
+
+    assert events == []
+    assert executor.get_stats()["coalesced"] == 1
+
+def test_slow_tick_does_not_delay_key_events(executor):
+    release = threading.Event()
+    key_down = threading.Event()
+
+    executor.submit_tick("deck", 0, release.wait, 5, tag=get_job_tag("tick", "deck", "0x0", 0))
+    executor.submit("deck", 0, key_down.set, tag=get_job_tag("key-down", "deck", "0x0"))
+
+    assert key_down.wait(5)
+    release.set()
+
+def test_slow_ticks_leave_workers_for_key_events(executor):
+    release = threading.Event()
+    key_down = threading.Event()
+
+    # More slow ticks than there are workers in total
+    for key in range(16):
+        executor.submit_tick("deck", key, release.wait, 5, tag=get_job_tag("tick", "deck", f"{key}x0", 0))
+    executor.submit("deck", 0, key_down.set, tag=get_job_tag("key-down", "deck", "0x0"))
+
+    assert key_down.wait(5)
+    release.set()
+
+def test_key_events_are_never_coalesced(executor):
+    events = []
+    release = threading.Event()
+    tag = get_job_tag("key-down", "deck", "0x0")
+
+    executor.submit("deck", 0, release.wait, 5)
+    executor.submit("deck", 0, events.append, "down", tag=tag)
+    executor.submit("deck", 0, events.append, "down", tag=tag)
+    release.set()
+    wait_until_idle(executor)
+
+    assert events == ["down", "down"]
+
+def test_failing_job_does_not_block_the_key(executor):
+    events = []
+
+    executor.submit("deck", 0, lambda: 1 / 0)
+    executor.submit("deck", 0, events.append, "after")
+    wait_until_idle(executor)
+
+    assert events == ["after"]
+    assert executor.get_stats()["queued"] == 0
@@ -0,0 +1,58 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+import time
+
+from src.backend.DeckManagement.FrameScheduler import FrameScheduler
+
+class MediaPlayer:
+    def __init__(self):
+        self.ticking = False
+        self.dropped_frames = 0
+        self.ticks = 0
+
+    def tick(self, deadline: float) -> None:
+        self.ticks += 1
+        self.ticking = False
+
+def test_scheduler_can_be_joined_after_stop():
+    scheduler = FrameScheduler(fps=100)
+    media_player = MediaPlayer()
+    scheduler.add_media_player(media_player)
+    scheduler.start()
+    scheduler.stop()
+    scheduler.join(timeout=5)
+
+    assert not scheduler.is_alive()
+
+def test_cancelled_tick_resets_ticking():
+    scheduler = FrameScheduler(fps=100, max_decks=1)
+    release = threading.Event()
+    # Occupies the only deck worker, so the tick of the media player stays queued
+    scheduler.deck_pool.submit(release.wait, 5)
+
+    media_player = MediaPlayer()
+    scheduler.add_media_player(media_player)
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while not media_player.ticking and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert media_player.ticking
+    scheduler.stop()
+    release.set()
+    scheduler.join(timeout=5)
+
+    assert media_player.ticks == 0
+    assert not media_player.ticking
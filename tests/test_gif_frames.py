@@ -0,0 +1,57 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+
+import pytest
+from PIL import Image
+
+from src.backend.DeckManagement.GifFrameCache import GifFrames
+
+def create_frames(durations: list[float]) -> GifFrames:
+    return GifFrames([Image.new("RGBA", (1, 1)) for _ in durations], durations)
+
+def test_frame_at_follows_the_durations():
+    frames = create_frames([0.1, 0.5, 0.2])
+
+    assert frames.get_frame_at(0) == (0, pytest.approx(0.1))
+    assert frames.get_frame_at(0.3) == (1, pytest.approx(0.3))
+    # A frame ends exactly at its boundary
+    assert frames.get_frame_at(0.6)[0] == 2
+    assert frames.get_frame_at(0.7)[0] == 2
+    assert frames.get_frame_at(0.85)[0] == 0
+
+def test_frame_at_loops():
+    frames = create_frames([0.1, 0.5, 0.2])
+
+    index, remaining = frames.get_frame_at(0.8 * 3 + 0.35)
+    assert index == 1
+    assert remaining == pytest.approx(0.25)
+
+def test_last_frame_stays_without_loop():
+    frames = create_frames([0.1, 0.5, 0.2])
+
+    assert frames.get_frame_at(0.75, loop=False) == (2, pytest.approx(0.05))
+    assert frames.get_frame_at(5, loop=False) == (2, math.inf)
+
+def test_single_frame_never_changes():
+    frames = create_frames([0.1])
+
+    assert frames.get_frame_at(0) == (0, math.inf)
+    assert frames.get_frame_at(100) == (0, math.inf)
+
+def test_negative_time_shows_the_first_frame():
+    frames = create_frames([0.1, 0.1])
+
+    assert frames.get_frame_at(-1)[0] == 0
@@ -0,0 +1,100 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import contextlib
+import threading
+import types
+
+import pytest
+
+import globals as gl
+
+# DeckController needs the full app environment
+pytest.importorskip("gi")
+pytest.importorskip("cv2")
+pytest.importorskip("usb")
+from src.backend.DeckManagement.DeckController import ControllerKey, MediaPlayer
+
+def create_key() -> ControllerKey:
+    controller_key = object.__new__(ControllerKey)
+    controller_key.generation = 0
+    controller_key.rendered_generation = -1
+    controller_key.written_generation = -1
+    return controller_key
+
+class Deck:
+    def __init__(self):
+        self.images = []
+
+    def set_key_image(self, key: int, image: bytes) -> None:
+        self.images.append((key, image))
+
+def create_media_player(monkeypatch) -> MediaPlayer:
+    monkeypatch.setattr(gl, "metrics_manager", types.SimpleNamespace(measure=lambda *args: contextlib.nullcontext()))
+    deck_controller = types.SimpleNamespace(deck=Deck(), serial_number="deck", active_page=None, keys=[create_key()])
+    media_player = object.__new__(MediaPlayer)
+    media_player.deck_controller = deck_controller
+    media_player.image_tasks = {}
+    media_player.write_lock = threading.Lock()
+    return media_player
+
+def test_new_key_is_dirty():
+    assert create_key().is_dirty()
+
+def test_key_is_clean_after_rendering_its_generation():
+    controller_key = create_key()
+    controller_key.set_rendered_generation(controller_key.generation)
+    assert not controller_key.is_dirty()
+
+    controller_key.mark_dirty()
+    assert controller_key.is_dirty()
+
+def test_change_during_the_render_keeps_the_key_dirty():
+    controller_key = create_key()
+    generation = controller_key.generation
+    controller_key.mark_dirty() # e.g. a label changed while rendering
+    controller_key.set_rendered_generation(generation)
+
+    assert controller_key.is_dirty()
+
+def test_late_render_does_not_go_back():
+    controller_key = create_key()
+    controller_key.mark_dirty()
+    controller_key.set_rendered_generation(1)
+    controller_key.set_rendered_generation(0)
+
+    assert controller_key.rendered_generation == 1
+    assert not controller_key.is_dirty()
+
+def test_images_older_than_the_press_feedback_are_dropped(monkeypatch):
+    media_player = create_media_player(monkeypatch)
+
+    assert media_player.add_image_task(0, b"before press", generation=1)
+    assert media_player.write_image_now(0, b"pressed", generation=2)
+    # The render that started before the press finishes late
+    assert not media_player.add_image_task(0, b"unpressed", generation=1)
+    assert not media_player.write_image_now(0, b"unpressed", generation=1)
+
+    assert media_player.image_tasks == {}
+    assert media_player.deck_controller.deck.images == [(0, b"pressed")]
+
+def test_images_of_the_same_or_newer_generation_are_queued(monkeypatch):
+    media_player = create_media_player(monkeypatch)
+    media_player.write_image_now(0, b"pressed", generation=2)
+
+    assert media_player.add_image_task(0, b"same", generation=2)
+    assert media_player.add_image_task(0, b"newer", generation=3)
+    assert media_player.image_tasks[0].native_image == b"newer"
+    # Images without a generation are never outdated
+    assert not media_player.is_outdated(types.SimpleNamespace(key_index=0, generation=None))
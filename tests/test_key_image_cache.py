@@ -0,0 +1,64 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+from PIL import Image
+
+from src.backend.DeckManagement.Subclasses.key_image_cache import KeyImageCache
+
+def create_entry(value: int) -> tuple[Image.Image, bytes]:
+    return Image.new("RGBA", (2, 2), (value, 0, 0, 255)), bytes([value])
+
+def test_least_recently_used_entry_gets_evicted():
+    cache = KeyImageCache(max_size=2)
+    cache.put(("a",), *create_entry(1))
+    cache.put(("b",), *create_entry(2))
+    # Using a makes b the least recently used entry
+    assert cache.get(("a",))[1] == bytes([1])
+    cache.put(("c",), *create_entry(3))
+
+    assert len(cache) == 2
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) is not None
+    assert cache.get(("c",)) is not None
+
+def test_put_replaces_and_refreshes_an_entry():
+    cache = KeyImageCache(max_size=2)
+    cache.put(("a",), *create_entry(1))
+    cache.put(("b",), *create_entry(2))
+    cache.put(("a",), *create_entry(3))
+    cache.put(("c",), *create_entry(4))
+
+    assert cache.get(("a",))[1] == bytes([3])
+    assert cache.get(("b",)) is None
+
+def test_hits_and_misses():
+    cache = KeyImageCache(max_size=2)
+    cache.put(("a",), *create_entry(1))
+    cache.get(("a",))
+    cache.get(("b",))
+
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_keys_without_render_key_are_not_cached():
+    cache = KeyImageCache(max_size=2)
+    cache.put(None, *create_entry(1))
+
+    assert len(cache) == 0
+    assert cache.get(None) is None
+
+def test_size_zero_disables_the_cache():
+    cache = KeyImageCache(max_size=0)
+    cache.put(("a",), *create_entry(1))
+
+    assert cache.get(("a",)) is None
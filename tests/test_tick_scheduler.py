@@ -0,0 +1,203 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import types
+
+import pytest
+
+import globals as gl
+from src.backend.DeckManagement.ActionExecutor import get_job_tag
+from src.backend.DeckManagement.TickScheduler import TickScheduler
+
+class RecordingExecutor:
+    """
+    Runs the submitted jobs right away and remembers them
+    """
+    def __init__(self):
+        self.jobs = []
+
+    def submit_tick(self, deck, key, method, *args, tag):
+        self.jobs.append((deck, key, tag))
+        method(*args)
+        return True
+
+class Action:
+    TICK_INTERVAL = 1
+
+    def __init__(self):
+        self.ticks = 0
+
+    def on_tick(self):
+        pass
+
+    @classmethod
+    def implements_on_tick(cls) -> bool:
+        return cls.on_tick is not Action.on_tick
+
+class TickingAction(Action):
+    def on_tick(self):
+        self.ticks += 1
+
+class IdleAction(Action):
+    pass
+
+class Key:
+    def __init__(self, deck_controller, key: int):
+        self.deck_controller = deck_controller
+        self.key = key
+
+    def get_job_tag(self, event: str, action_index: int = None) -> tuple:
+        return get_job_tag(event, self.deck_controller.serial_number, f"{self.key}x0", action_index)
+
+class DeckController:
+    def __init__(self, serial_number: str, n_keys: int):
+        self.serial_number = serial_number
+        self.screen_saver = types.SimpleNamespace(showing=False)
+        self.keys = [Key(self, i) for i in range(n_keys)]
+
+    def index_to_coords(self, index: int) -> tuple[int, int]:
+        return index, 0
+
+def create_deck(serial: str = "deck", n_keys: int = 2) -> DeckController:
+    return DeckController(serial, n_keys)
+
+@pytest.fixture
+def executor(monkeypatch) -> RecordingExecutor:
+    executor = RecordingExecutor()
+    monkeypatch.setattr(gl, "action_executor", executor)
+    monkeypatch.setattr(gl, "metrics_manager", types.SimpleNamespace(increment=lambda *args, **kwargs: None))
+    return executor
+
+def run_steps(scheduler: TickScheduler, seconds: float) -> None:
+    for _ in range(round(seconds / scheduler.RESOLUTION)):
+        scheduler.step()
+
+def test_only_actions_with_on_tick_get_scheduled(executor):
+    deck_controller = create_deck()
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[0], [IdleAction(), IdleAction()])
+
+    assert scheduler.get_stats() == {"ticking-keys": 0, "ticking-actions": 0}
+    assert sum(len(slot) for slot in scheduler.wheel) == 0
+
+def test_actions_tick_in_their_interval(executor):
+    deck_controller = create_deck()
+    fast = TickingAction()
+    fast.TICK_INTERVAL = 0.2
+    slow = TickingAction()
+    slow.TICK_INTERVAL = 15 # More than one turn of the wheel
+
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[0], [fast])
+    scheduler.schedule_key(deck_controller.keys[1], [IdleAction(), slow])
+    run_steps(scheduler, 30)
+
+    assert fast.ticks == 150
+    assert slow.ticks == 2
+
+def test_ticks_are_tagged_by_key_and_action_index(executor):
+    deck_controller = create_deck()
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[1], [IdleAction(), TickingAction()])
+    run_steps(scheduler, 1)
+
+    assert executor.jobs == [("deck", 1, ("tick", "deck", "1x0", 1))]
+
+    # The reloaded action gets the same tag
+    scheduler.schedule_key(deck_controller.keys[1], [IdleAction(), TickingAction()])
+    run_steps(scheduler, 1)
+
+    assert executor.jobs[1] == executor.jobs[0]
+
+def test_rescheduling_a_key_drops_its_old_actions(executor):
+    deck_controller = create_deck()
+    old = TickingAction()
+    new = TickingAction()
+
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[0], [old])
+    run_steps(scheduler, 1)
+    scheduler.schedule_key(deck_controller.keys[0], [new])
+    run_steps(scheduler, 3)
+
+    assert old.ticks == 1
+    assert new.ticks == 3
+
+def test_remove_deck_finds_keys_replaced_by_the_screen_saver(executor):
+    deck_controller = create_deck()
+    action = TickingAction()
+
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[0], [action])
+    # The screen saver shows temporary keys
+    deck_controller.keys = [Key(deck_controller, i) for i in range(2)]
+    scheduler.remove_deck(deck_controller)
+    run_steps(scheduler, 3)
+
+    assert action.ticks == 0
+    assert scheduler.get_stats()["ticking-keys"] == 0
+    assert sum(len(slot) for slot in scheduler.wheel) == 0
+
+def test_no_ticks_while_the_screen_saver_shows(executor):
+    deck_controller = create_deck()
+    action = TickingAction()
+
+    scheduler = TickScheduler()
+    scheduler.schedule_key(deck_controller.keys[0], [action])
+    deck_controller.screen_saver.showing = True
+    run_steps(scheduler, 3)
+    deck_controller.screen_saver.showing = False
+    run_steps(scheduler, 1)
+
+    assert action.ticks == 1
+
+def test_switching_to_a_page_with_an_empty_key_stops_the_ticks(executor, monkeypatch):
+    # Needs the full app environment
+    pytest.importorskip("gi")
+    pytest.importorskip("cv2")
+    from src.backend.DeckManagement.DeckController import ControllerKey
+
+    scheduler = TickScheduler()
+    monkeypatch.setattr(gl, "tick_scheduler", scheduler)
+
+    deck_controller = create_deck()
+    controller_key = object.__new__(ControllerKey)
+    controller_key.deck_controller = deck_controller
+    controller_key.key = 0
+    controller_key.key_image = None
+    controller_key.key_video = None
+    controller_key.labels = {}
+    controller_key.background_color = [0, 0, 0, 0]
+    controller_key.generation = 0
+
+    # The previous page had a ticking action on this key
+    action = TickingAction()
+    scheduler.schedule_key(controller_key, [action])
+    run_steps(scheduler, 1)
+    assert action.ticks == 1
+
+    # On the new page the key is empty
+    controller_key.load_from_page_dict({}, update=False)
+    run_steps(scheduler, 3)
+
+    assert action.ticks == 1
+    assert scheduler.get_stats()["ticking-keys"] == 0
+
+def test_scheduler_can_be_joined_after_stop(executor):
+    scheduler = TickScheduler()
+    scheduler.start()
+    scheduler.stop()
+    scheduler.join(timeout=5)
+
+    assert not scheduler.is_alive()
@@ -0,0 +1,106 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+
+from PIL import Image
+
+from src.backend.DeckManagement.Subclasses.tile_container import TileContainerWriter, open_container
+
+TILE_SIZE = (4, 3)
+
+def create_tile(value: int) -> Image.Image:
+    return Image.new("RGBA", TILE_SIZE, (value, value, value, 255))
+
+def test_truncated_container_needs_allow_truncated(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    # The video reports 5 frames but only has 3
+    writer = TileContainerWriter(path, TILE_SIZE, 5, 2)
+    for frame in range(3):
+        writer.add_frame(frame, [create_tile(frame), create_tile(frame)])
+    writer.truncate(3)
+    writer.finish()
+
+    assert open_container(path, TILE_SIZE, 5, 2) is None # Removed, the frame count doesn't match
+    assert not os.path.exists(path)
+
+def test_truncated_container_is_accepted_for_the_reported_frame_count(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    writer = TileContainerWriter(path, TILE_SIZE, 5, 2)
+    for frame in range(3):
+        writer.add_frame(frame, [create_tile(frame), create_tile(frame)])
+    writer.truncate(3)
+    writer.finish()
+
+    container = open_container(path, TILE_SIZE, 5, 2, allow_truncated=True)
+    assert container.n_frames == 3
+    assert container.is_complete()
+    assert container.get_tile(2, 1).getpixel((0, 0)) == (2, 2, 2, 255)
+    container.close()
+
+def test_round_trip(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    writer = TileContainerWriter(path, TILE_SIZE, 2, 3)
+    # Frames can be written in any order
+    for frame in (1, 0):
+        writer.add_frame(frame, [create_tile(frame * 10 + key) for key in range(3)])
+    writer.finish()
+
+    container = open_container(path, TILE_SIZE, 2, 3)
+    assert container.is_complete()
+    for frame in range(2):
+        tiles = container.get_frame(frame)
+        assert [tile.getpixel((3, 2)) for tile in tiles] == [create_tile(frame * 10 + key).getpixel((3, 2)) for key in range(3)]
+        assert all(tile.size == TILE_SIZE and tile.mode == "RGBA" for tile in tiles)
+    container.close()
+
+def test_missing_tiles_make_the_container_incomplete(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    writer = TileContainerWriter(path, TILE_SIZE, 2, 2)
+    writer.add_frame(0, [create_tile(0), create_tile(0)])
+    writer.add_frame(1, [create_tile(1), None])
+    writer.finish()
+
+    container = open_container(path, TILE_SIZE, 2, 2)
+    assert not container.is_complete()
+    assert container.has_tile(1, 0)
+    assert not container.has_tile(1, 1)
+    assert container.get_tile(1, 1) is None
+    container.close()
+
+def test_unfinished_container_is_not_visible(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    writer = TileContainerWriter(path, TILE_SIZE, 1, 1)
+    writer.add_frame(0, [create_tile(0)])
+
+    assert open_container(path, TILE_SIZE, 1, 1) is None
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+def test_container_of_other_geometry_gets_removed(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    writer = TileContainerWriter(path, TILE_SIZE, 1, 1)
+    writer.add_frame(0, [create_tile(0)])
+    writer.finish()
+
+    assert open_container(path, (8, 8), 1, 1) is None
+    assert not os.path.exists(path)
+
+def test_broken_container_gets_removed(tmp_path):
+    path = os.path.join(tmp_path, "video.tiles")
+    with open(path, "wb") as f:
+        f.write(b"not a container")
+
+    assert open_container(path, TILE_SIZE, 1, 1) is None
+    assert not os.path.exists(path)
@@ -0,0 +1,66 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+cv2 = pytest.importorskip("cv2")
+from src.backend.DeckManagement.Subclasses.tiling import DeckTiler
+
+def create_tiler() -> DeckTiler:
+    return DeckTiler((3, 5), (72, 72), (36, 36))
+
+def create_deck_image(tiler: DeckTiler, channels: int) -> np.ndarray:
+    width, height = tiler.deck_image_size
+    return np.random.default_rng(0).integers(0, 256, (height, width, channels), dtype=np.uint8)
+
+def test_tiles_match_the_crops_of_the_deck_image():
+    tiler = create_tiler()
+    deck_image = create_deck_image(tiler, 3)
+    image = Image.fromarray(deck_image)
+
+    tiles = tiler.get_tiles(deck_image)
+
+    assert len(tiles) == 15
+    for tile, (x, y, width, height) in zip(tiles, tiler.regions):
+        assert tile.mode == "RGBA"
+        assert tile.tobytes() == image.crop((x, y, x + width, y + height)).convert("RGBA").tobytes()
+
+def test_alpha_of_rgba_images_is_kept():
+    tiler = create_tiler()
+    deck_image = create_deck_image(tiler, 4)
+
+    tiles = tiler.get_tiles(deck_image)
+
+    x, y, _, _ = tiler.regions[-1]
+    assert tiles[-1].getpixel((0, 0)) == tuple(deck_image[y, x])
+
+def test_video_frames_get_converted_from_bgr():
+    tiler = create_tiler()
+    deck_image = create_deck_image(tiler, 3)
+
+    tiles = tiler.get_tiles(tiler.to_rgba(np.ascontiguousarray(deck_image[..., ::-1]), cv2.COLOR_BGR2RGBA))
+
+    assert [tile.tobytes() for tile in tiles] == [tile.tobytes() for tile in tiler.get_tiles(deck_image)]
+
+def test_tiles_are_read_only_views():
+    tiler = create_tiler()
+    buffer = tiler.to_rgba(create_deck_image(tiler, 3))
+    tiles = tiler.get_tiles(buffer)
+
+    # Changes of the buffer show up in the tiles, so nothing was copied
+    buffer[0, 0] = (1, 2, 3, 4)
+    assert tiles[0].getpixel((0, 0)) == (1, 2, 3, 4)
+    assert tiles[0].readonly